@@ -0,0 +1,191 @@
+"""
+    Admission control and per-user rate limiting.
+
+    Each worker caps its number of in-flight requests and the upload bytes it
+    is holding at once, and keeps a token bucket per user_id. Requests over a
+    limit are shed early with 429/503 and a Retry-After hint instead of queueing.
+"""
+from collections import OrderedDict
+from typing import Optional
+import threading
+import time
+import logging
+
+from fastapi.responses import JSONResponse
+
+from app.exceptions import APIException, ServiceUnavailableException
+from app.settings import settings
+
+log = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at `rate` tokens per second up to `burst`."""
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self, tokens: float = 1.0) -> float:
+        """Takes tokens if available. Returns 0 on success, else the seconds to wait before retrying."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            if self.rate <= 0:
+                return float("inf")
+            return (tokens - self._tokens) / self.rate
+
+    def take(self, tokens: float = 1.0):
+        """Blocks until the tokens are available, then takes them."""
+        while True:
+            wait = self.try_take(tokens)
+            if wait == 0.0:
+                return
+            time.sleep(wait)
+
+
+class AdmissionController:
+    """Tracks in-flight requests and upload bytes for one worker, plus per-user token buckets."""
+    def __init__(
+        self,
+        max_concurrent_requests: int,
+        max_inflight_bytes: int,
+        user_rate: float,
+        user_burst: int,
+        retry_after: float = 1.0,
+        max_tracked_users: int = 10000,
+    ):
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_inflight_bytes = max_inflight_bytes
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.retry_after = retry_after
+        self.max_tracked_users = max_tracked_users
+        self.inflight_requests = 0
+        self.inflight_bytes = 0
+        self._users: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def try_admit(self, nbytes: int) -> Optional[float]:
+        """Admits a request holding `nbytes`. Returns None when admitted, else a retry-after in seconds."""
+        with self._lock:
+            if self.inflight_requests >= self.max_concurrent_requests:
+                return self.retry_after
+            # Always let one request through so a single large upload cannot starve
+            if self.inflight_requests and self.inflight_bytes + nbytes > self.max_inflight_bytes:
+                return self.retry_after
+            self.inflight_requests += 1
+            self.inflight_bytes += nbytes
+            return None
+
+    def add_bytes(self, nbytes: int):
+        """Accounts for body bytes received beyond what the request declared."""
+        with self._lock:
+            self.inflight_bytes += nbytes
+
+    def release(self, nbytes: int):
+        """Releases an admitted request and the bytes it was holding."""
+        with self._lock:
+            self.inflight_requests -= 1
+            self.inflight_bytes -= nbytes
+
+    def check_user(self, user_id: str) -> float:
+        """Takes a token from the user's bucket. Returns 0 when allowed, else a retry-after in seconds."""
+        with self._lock:
+            bucket = self._users.get(user_id)
+            if bucket is None:
+                bucket = TokenBucket(self.user_rate, self.user_burst)
+                self._users[user_id] = bucket
+                if len(self._users) > self.max_tracked_users:
+                    self._users.popitem(last=False)
+            else:
+                self._users.move_to_end(user_id)
+        return bucket.try_take()
+
+
+def build_admission_controller() -> Optional[AdmissionController]:
+    """Creates the controller from settings, or None when admission control is disabled."""
+    if not settings.admission_enabled:
+        return None
+    return AdmissionController(
+        max_concurrent_requests=settings.max_concurrent_requests,
+        max_inflight_bytes=settings.max_inflight_upload_bytes,
+        user_rate=settings.user_rate_limit_per_second,
+        user_burst=settings.user_rate_limit_burst,
+        retry_after=settings.admission_retry_after_seconds,
+    )
+
+
+def _error_response(exc: APIException) -> JSONResponse:
+    # Middleware runs outside the app's exception handlers, so the response is built here
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail}, headers=exc.headers)
+
+
+class AdmissionMiddleware:
+    """
+        ASGI middleware applying worker-level admission control to requests under `path_prefix`.
+        Uses the controller stored on `app.state.admission`; does nothing when it is None.
+    """
+    def __init__(self, app, path_prefix: str = "/images"):
+        self.app = app
+        self.path_prefix = path_prefix
+
+    def _applies(self, scope) -> bool:
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        return path.startswith(self.path_prefix)
+
+    async def __call__(self, scope, receive, send):
+        controller = getattr(scope["app"].state, "admission", None) if "app" in scope else None
+        if controller is None or scope["type"] != "http" or not self._applies(scope):
+            await self.app(scope, receive, send)
+            return
+
+        declared = 0
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    declared = max(int(value), 0)
+                except ValueError:
+                    pass
+                break
+
+        if declared > controller.max_inflight_bytes:
+            response = JSONResponse(status_code=413, content={"detail": "Request body too large."})
+            await response(scope, receive, send)
+            return
+
+        retry_after = controller.try_admit(declared)
+        if retry_after is not None:
+            log.warning("Shedding request to %s: worker at capacity", scope["path"])
+            response = _error_response(ServiceUnavailableException("Service is overloaded, retry later.", retry_after))
+            await response(scope, receive, send)
+            return
+
+        reserved = declared
+        received = 0
+
+        async def counted_receive():
+            nonlocal reserved, received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > reserved:
+                    # Chunked or under-declared bodies still count against the budget
+                    controller.add_bytes(received - reserved)
+                    reserved = received
+            return message
+
+        try:
+            await self.app(scope, counted_receive, send)
+        finally:
+            controller.release(reserved)
@@ -0,0 +1,354 @@
+"""
+    Resumable, throttled backfills over the metadata table.
+
+        python -m app.backfill upload-time-keys image-attributes --max-wcu 50
+        python -m app.backfill image-attributes --dry-run
+        python -m app.backfill storage-encoding
+
+    Items are read with a parallel scan (one thread per segment), passed through
+    the named transforms and written back. Reads and writes are paced
+    by token buckets filled at the target consumed-capacity rates. After each page
+    the segment's position is saved to a checkpoint file, so an interrupted run
+    resumes where it stopped. A dry run scans and transforms without writing and
+    reports throughput and the estimated time to completion.
+
+    Each rewritten item is written back with a conditional UpdateItem that only
+    sets the attributes the transforms changed (and removes those they dropped),
+    and only while the image is live. Items deleted or tombstoned between being
+    scanned and written back are left alone and counted as skipped.
+"""
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from datetime import datetime
+
+from botocore.exceptions import ClientError
+
+from app.admission import TokenBucket
+from app.capacity import consumed_units
+from app.image_service.encoding import decode_item, encode_item, stored_version, target_version
+from app.storage.dynamodb import DynamoDBService
+from app.storage.s3 import S3Service
+
+log = logging.getLogger("image-service.backfill")
+
+class BackfillError(Exception):
+    """Raised when a backfill cannot run (e.g. its checkpoint belongs to other arguments)."""
+
+
+class BackfillContext:
+    """Shared resources handed to transforms. The S3 client is only created if a transform needs it."""
+    def __init__(self, db: DynamoDBService, s3: Optional[S3Service] = None):
+        self.db = db
+        self._s3 = s3
+        self._lock = threading.Lock()
+
+    @property
+    def s3(self) -> S3Service:
+        with self._lock:
+            if self._s3 is None:
+                self._s3 = S3Service()
+            return self._s3
+
+
+# A transform returns the rewritten item, or None when the item needs no change
+Transform = Callable[[Dict[str, Any], BackfillContext], Optional[Dict[str, Any]]]
+
+TRANSFORMS: Dict[str, Transform] = {}
+
+def register_transform(name: str):
+    """Registers a per-item transform under a CLI name."""
+    def decorator(func: Transform) -> Transform:
+        TRANSFORMS[name] = func
+        return func
+    return decorator
+
+
+# -------------------------
+# Built-in transforms
+# -------------------------
+@register_transform("upload-time-keys")
+def add_upload_time_keys(item: Dict[str, Any], ctx: BackfillContext) -> Optional[Dict[str, Any]]:
+    """Adds the uploaded_ts/upload_day keys of the time-ordered indexes."""
+    from app.image_service.service import to_epoch_us, upload_day
+    if "uploaded_ts" in item and "upload_day" in item:
+        return None
+    uploaded_at = datetime.fromisoformat(item["uploaded_at"])
+    return {**item, "uploaded_ts": to_epoch_us(uploaded_at), "upload_day": upload_day(uploaded_at)}
+
+@register_transform("image-attributes")
+def add_image_attributes(item: Dict[str, Any], ctx: BackfillContext) -> Optional[Dict[str, Any]]:
+    """Downloads the object and fills in dimensions, frame count, orientation, EXIF and the perceptual hash."""
+    from app.routers.image_service import inspect_image_bytes
+    from app.exceptions import InvalidImageException
+    if item.get("width") is not None:
+        return None
+    try:
+        info = inspect_image_bytes(ctx.s3.download(item["s3_key"]), item.get("content_type"))
+    except InvalidImageException:
+        log.warning("Skipping %s: stored object is not a valid image", item["image_id"])
+        return None
+    attributes = info.model_dump(exclude={"content_type"}, exclude_none=True)
+    return {**item, **attributes} if attributes else None
+
+@register_transform("storage-encoding")
+def reencode(item: Dict[str, Any], ctx: BackfillContext) -> Optional[Dict[str, Any]]:
+    """Rewrites items stored in another encoding than METADATA_ENCODING."""
+    return item if stored_version(item) != target_version() else None
+
+
+# -------------------------
+# Checkpoints
+# -------------------------
+def _encode(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f"Unserializable value: {value!r}")
+
+class Checkpoint:
+    """Per-segment scan positions and counters, persisted atomically as JSON."""
+    def __init__(self, path: Optional[str], transforms: List[str], total_segments: int):
+        self.path = path
+        self.transforms = transforms
+        self.total_segments = total_segments
+        self.segments: Dict[int, Dict[str, Any]] = {
+            segment: {"last_key": None, "done": False, "scanned": 0, "updated": 0, "skipped": 0}
+            for segment in range(total_segments)
+        }
+        self._lock = threading.Lock()
+
+    def load(self) -> bool:
+        """Restores a previous run's progress. Returns False when there is no checkpoint file."""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data["transforms"] != self.transforms or data["total_segments"] != self.total_segments:
+            raise BackfillError(
+                f"Checkpoint {self.path} was written for transforms {data['transforms']} with "
+                f"{data['total_segments']} segments; use the same arguments or a new checkpoint file"
+            )
+        self.segments = {int(segment): state for segment, state in data["segments"].items()}
+        return True
+
+    def advance(self, segment: int, last_key: Optional[Dict[str, Any]], scanned: int, updated: int, skipped: int = 0):
+        """Records a completed page and saves the checkpoint."""
+        with self._lock:
+            state = self.segments[segment]
+            state["last_key"] = last_key
+            state["done"] = last_key is None
+            state["scanned"] += scanned
+            state["updated"] += updated
+            state["skipped"] = state.get("skipped", 0) + skipped
+            self._save()
+
+    def totals(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "scanned": sum(s["scanned"] for s in self.segments.values()),
+                "updated": sum(s["updated"] for s in self.segments.values()),
+                "skipped": sum(s.get("skipped", 0) for s in self.segments.values()),
+                "segments_done": sum(s["done"] for s in self.segments.values()),
+            }
+
+    def _save(self):
+        if not self.path:
+            return
+        data = {"transforms": self.transforms, "total_segments": self.total_segments, "segments": self.segments}
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, default=_encode)
+        os.replace(tmp, self.path)
+
+
+# -------------------------
+# Runner
+# -------------------------
+def _charge(bucket: Optional[TokenBucket], units: float):
+    """Pays for capacity already consumed, in installments no larger than the bucket's burst."""
+    if bucket is None:
+        return
+    while units > 0:
+        installment = min(units, bucket.burst)
+        bucket.take(installment)
+        units -= installment
+
+class Backfill:
+    def __init__(
+        self,
+        db: DynamoDBService,
+        transforms: List[str],
+        total_segments: int = 4,
+        page_size: int = 100,
+        max_rcu: Optional[float] = None,
+        max_wcu: Optional[float] = None,
+        checkpoint_path: Optional[str] = None,
+        dry_run: bool = False,
+        s3: Optional[S3Service] = None,
+    ):
+        unknown = [name for name in transforms if name not in TRANSFORMS]
+        if unknown:
+            raise BackfillError(f"Unknown transforms: {', '.join(unknown)}")
+        self.db = db
+        self.transforms = [TRANSFORMS[name] for name in transforms]
+        self.total_segments = total_segments
+        self.page_size = page_size
+        self.read_bucket = TokenBucket(max_rcu, max_rcu) if max_rcu else None
+        self.write_bucket = TokenBucket(max_wcu, max_wcu) if max_wcu else None
+        self.dry_run = dry_run
+        self.ctx = BackfillContext(db, s3)
+        # Dry runs never write a checkpoint, so they always start from the beginning
+        self.checkpoint = Checkpoint(None if dry_run else checkpoint_path, transforms, total_segments)
+        self.stop = threading.Event()
+        self.started = time.monotonic()
+        self.scanned_at_start = 0
+        self.estimated_total: Optional[int] = None
+
+    def transform(self, stored: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+            Decodes a stored item, applies every transform in order and re-encodes it
+            in the configured encoding. Returns None when no transform changed it.
+        """
+        item, changed = decode_item(stored), False
+        for transform in self.transforms:
+            result = transform(item, self.ctx)
+            if result is not None:
+                item, changed = result, True
+        return encode_item(item) if changed else None
+
+    def write_back(self, stored: Dict[str, Any], updated: Dict[str, Any]) -> bool:
+        """
+            Writes the attributes that differ between the scanned and the rewritten item.
+            Returns False when the item was deleted or tombstoned since it was scanned.
+        """
+        set_attributes = {k: v for k, v in updated.items() if k != "image_id" and stored.get(k) != v}
+        remove_attributes = [k for k in stored if k not in updated]
+        if not set_attributes and not remove_attributes:
+            return True
+        try:
+            consumed = self.db.update_live_metadata(stored["image_id"], set_attributes, remove_attributes)
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            log.info("Skipping %s: deleted since it was scanned", stored["image_id"])
+            return False
+        _charge(self.write_bucket, consumed)
+        return True
+
+    def run_segment(self, segment: int):
+        state = self.checkpoint.segments[segment]
+        last_key = state["last_key"]
+        if state["done"]:
+            return
+        while not self.stop.is_set():
+            resp = self.db.scan_metadata(
+                limit=self.page_size, exclusive_start_key=last_key,
+                segment=segment, total_segments=self.total_segments,
+            )
+            _charge(self.read_bucket, consumed_units(resp))
+            items = resp.get("Items", [])
+            updated = skipped = 0
+            for stored in items:
+                rewritten = self.transform(stored)
+                if rewritten is None:
+                    continue
+                if self.dry_run or self.write_back(stored, rewritten):
+                    updated += 1
+                else:
+                    skipped += 1
+            last_key = resp.get("LastEvaluatedKey")
+            self.checkpoint.advance(segment, last_key, scanned=len(items), updated=updated, skipped=skipped)
+            if last_key is None:
+                return
+
+    def progress(self) -> Dict[str, Any]:
+        """Counters, throughput and, when the table size is known, the estimated time to completion."""
+        totals = self.checkpoint.totals()
+        elapsed = time.monotonic() - self.started
+        rate = (totals["scanned"] - self.scanned_at_start) / elapsed if elapsed > 0 else 0.0
+        report = {
+            **totals,
+            "dry_run": self.dry_run,
+            "elapsed_seconds": round(elapsed, 1),
+            "items_per_second": round(rate, 1),
+            "estimated_total": self.estimated_total,
+            "eta_seconds": None,
+        }
+        if self.estimated_total and rate > 0:
+            report["eta_seconds"] = round(max(self.estimated_total - totals["scanned"], 0) / rate, 1)
+        return report
+
+    def run(self, report_every: float = 10.0) -> Dict[str, Any]:
+        """Runs every unfinished segment to completion, logging progress every `report_every` seconds."""
+        if self.checkpoint.load():
+            log.info("Resuming from checkpoint %s", self.checkpoint.path)
+        try:
+            self.estimated_total = self.db.approximate_item_count()
+        except Exception:
+            log.warning("Could not read the table item count; no completion estimate")
+            self.estimated_total = None
+        self.started = time.monotonic()
+        self.scanned_at_start = self.checkpoint.totals()["scanned"]
+
+        with ThreadPoolExecutor(max_workers=self.total_segments, thread_name_prefix="backfill") as pool:
+            futures = [pool.submit(self.run_segment, segment) for segment in range(self.total_segments)]
+            try:
+                while True:
+                    _, pending = wait(futures, timeout=report_every, return_when=FIRST_EXCEPTION)
+                    if not pending or any(f.exception() for f in futures if f.done()):
+                        break
+                    log.info("Backfill progress: %s", json.dumps(self.progress()))
+            except KeyboardInterrupt:
+                log.warning("Interrupted; stopping after the current pages (progress is checkpointed)")
+                self.stop.set()
+                raise
+            finally:
+                self.stop.set()
+            for future in futures:
+                future.result()
+        return self.progress()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.backfill", description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("transforms", nargs="+", metavar="transform", help=f"one or more of: {', '.join(sorted(TRANSFORMS))}")
+    parser.add_argument("--segments", type=int, default=4, help="parallel scan segments (one thread each)")
+    parser.add_argument("--page-size", type=int, default=100, help="items per scan page")
+    parser.add_argument("--max-rcu", type=float, default=None, help="target read capacity units per second")
+    parser.add_argument("--max-wcu", type=float, default=None, help="target write capacity units per second")
+    parser.add_argument("--checkpoint", default="backfill-checkpoint.json", help="checkpoint file used to resume")
+    parser.add_argument("--dry-run", action="store_true", help="scan and transform without writing")
+    parser.add_argument("--report-every", type=float, default=10.0, help="seconds between progress reports")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        backfill = Backfill(
+            DynamoDBService(),
+            args.transforms,
+            total_segments=args.segments,
+            page_size=args.page_size,
+            max_rcu=args.max_rcu,
+            max_wcu=args.max_wcu,
+            checkpoint_path=args.checkpoint,
+            dry_run=args.dry_run,
+        )
+        report = backfill.run(report_every=args.report_every)
+    except BackfillError as e:
+        log.error("%s", e)
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,41 @@
+"""
+    Periodic background jobs run alongside the FastAPI application.
+"""
+import asyncio
+import logging
+from typing import Callable, Optional
+
+log = logging.getLogger(__name__)
+
+class PeriodicTask:
+    """Runs a blocking callable every `interval_seconds` in a worker thread, off the event loop."""
+    def __init__(self, name: str, interval_seconds: float, func: Callable[[], object]):
+        self.name = name
+        self.interval_seconds = interval_seconds
+        self.func = func
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Schedules the task on the running event loop."""
+        self._task = asyncio.create_task(self._run(), name=self.name)
+        log.info("Started background task %s (every %ss)", self.name, self.interval_seconds)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await asyncio.to_thread(self.func)
+            except Exception:
+                log.exception("Background task %s failed", self.name)
+
+    async def stop(self):
+        """Cancels the task and waits for it to finish."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        log.info("Stopped background task %s", self.name)
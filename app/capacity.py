@@ -0,0 +1,113 @@
+"""
+    DynamoDB consumed-capacity and scan-efficiency accounting.
+
+    Every table operation asks for ReturnConsumedCapacity and reports its
+    response here. Capacity units and scanned/returned item counts are counted
+    per table and operation, and added to the usage of the HTTP request the call
+    was made for. That usage lives in a context variable, so calls made from
+    threadpool handlers and hedged reads are attributed to their request too.
+    When a request finishes, its usage is recorded per route (and optionally per
+    user), returned in X-DynamoDB-* response headers, and a warning is logged
+    when its scans read far more items than they returned.
+"""
+from contextvars import ContextVar, Token
+from typing import Any, Dict, Optional
+import threading
+import logging
+
+from app.metrics import DYNAMODB_CONSUMED_CAPACITY, DYNAMODB_ITEMS, REQUEST_CONSUMED_CAPACITY, REQUEST_SCAN_EFFICIENCY
+from app.settings import settings
+
+log = logging.getLogger(__name__)
+
+RETURN_CONSUMED_CAPACITY = "TOTAL"
+
+READ_UNITS_HEADER = "X-DynamoDB-Read-Units"
+WRITE_UNITS_HEADER = "X-DynamoDB-Write-Units"
+SCANNED_HEADER = "X-DynamoDB-Scanned-Count"
+RETURNED_HEADER = "X-DynamoDB-Returned-Count"
+
+class RequestUsage:
+    """DynamoDB usage of one HTTP request. Thread-safe."""
+    def __init__(self):
+        self.user_id: Optional[str] = None
+        self.read_units = 0.0
+        self.write_units = 0.0
+        self.scanned = 0
+        self.returned = 0
+        self._lock = threading.Lock()
+
+    def add(self, kind: str, units: float, scanned: Optional[int], returned: Optional[int]):
+        with self._lock:
+            if kind == "write":
+                self.write_units += units
+            else:
+                self.read_units += units
+            if scanned is not None:
+                self.scanned += scanned
+                self.returned += returned or 0
+
+    @property
+    def scan_efficiency(self) -> Optional[float]:
+        """Items returned per item read by queries and scans, or None if there were none."""
+        return self.returned / self.scanned if self.scanned else None
+
+_current: ContextVar[Optional[RequestUsage]] = ContextVar("dynamodb_request_usage", default=None)
+
+def start_request() -> Token:
+    """Starts accounting for a new request in the current context."""
+    return _current.set(RequestUsage())
+
+def end_request(token: Token):
+    _current.reset(token)
+
+def current_usage() -> Optional[RequestUsage]:
+    return _current.get()
+
+def set_request_user(user_id: Optional[str]):
+    """Attributes the current request's usage to a user."""
+    usage = _current.get()
+    if usage is not None and user_id:
+        usage.user_id = user_id
+
+def consumed_units(resp: Dict[str, Any]) -> float:
+    """Capacity units in a response; batch operations return one entry per table."""
+    consumed = resp.get("ConsumedCapacity")
+    if not consumed:
+        return 0.0
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    return float(sum(c.get("CapacityUnits", 0.0) for c in consumed))
+
+def record(table: str, operation: str, kind: str, resp: Dict[str, Any]) -> float:
+    """Records the capacity a `kind` ("read" or "write") operation consumed. Returns the units."""
+    units = consumed_units(resp)
+    DYNAMODB_CONSUMED_CAPACITY.labels(table=table, operation=operation, kind=kind).inc(units)
+    scanned = resp.get("ScannedCount")
+    returned = resp.get("Count")
+    if scanned is not None:
+        DYNAMODB_ITEMS.labels(table=table, operation=operation, stage="scanned").inc(scanned)
+        DYNAMODB_ITEMS.labels(table=table, operation=operation, stage="returned").inc(returned or 0)
+    usage = _current.get()
+    if usage is not None:
+        usage.add(kind, units, scanned, returned)
+    return units
+
+def finish_request(usage: RequestUsage, route: str, headers=None):
+    """Records a finished request's usage per route, warns on inefficient scans and sets response headers."""
+    user = (usage.user_id or "") if settings.capacity_metrics_per_user else ""
+    REQUEST_CONSUMED_CAPACITY.labels(route=route, user=user, kind="read").inc(usage.read_units)
+    REQUEST_CONSUMED_CAPACITY.labels(route=route, user=user, kind="write").inc(usage.write_units)
+    efficiency = usage.scan_efficiency
+    if efficiency is not None:
+        REQUEST_SCAN_EFFICIENCY.labels(route=route).observe(efficiency)
+        if usage.scanned >= settings.scan_efficiency_warn_min_scanned and efficiency < settings.scan_efficiency_warn_ratio:
+            log.warning(
+                "Inefficient DynamoDB reads on %s for user %s: %d items scanned, %d returned (%.1f%%), %.1f RCU",
+                route, usage.user_id or "-", usage.scanned, usage.returned, efficiency * 100, usage.read_units,
+            )
+    if headers is not None and settings.capacity_headers_enabled:
+        headers[READ_UNITS_HEADER] = f"{usage.read_units:g}"
+        headers[WRITE_UNITS_HEADER] = f"{usage.write_units:g}"
+        headers[SCANNED_HEADER] = str(usage.scanned)
+        headers[RETURNED_HEADER] = str(usage.returned)
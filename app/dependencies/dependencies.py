@@ -1,6 +1,9 @@
+from typing import Optional
 from fastapi import Request
 from app.storage.dynamodb import DynamoDBService
 from app.storage.s3 import S3Service
+from app.exceptions import TooManyRequestsException
+from app.capacity import set_request_user
 
 def get_s3_service(request: Request) -> S3Service:
     """Dependency provider for S3Service"""
@@ -9,3 +12,28 @@ def get_s3_service(request: Request) -> S3Service:
 def get_dynamodb_service(request: Request) -> DynamoDBService:
     """Dependency provider for DynamoDBService"""
     return request.app.state.db
+
+async def request_user_id(request: Request) -> Optional[str]:
+    """Returns the request's user_id from the query string or, for POSTs, the form."""
+    user_id = request.query_params.get("user_id")
+    if user_id is None and request.method == "POST":
+        # The form has already been parsed for the endpoint, so this reads the cached copy
+        form = await request.form()
+        user_id = form.get("user_id")
+    return user_id or None
+
+async def enforce_user_rate_limit(request: Request):
+    """Applies the per-user token bucket using the request's user_id (query string or form field)."""
+    controller = getattr(request.app.state, "admission", None)
+    if controller is None:
+        return
+    user_id = await request_user_id(request)
+    if not user_id:
+        return
+    retry_after = controller.check_user(user_id)
+    if retry_after:
+        raise TooManyRequestsException(f"Rate limit exceeded for user '{user_id}'", retry_after)
+
+async def attribute_dynamodb_usage(request: Request):
+    """Attributes the request's DynamoDB usage to its user_id (path parameter, query string or form field)."""
+    set_request_user(request.path_params.get("user_id") or await request_user_id(request))
@@ -3,15 +3,18 @@
 """
 from fastapi import Request, HTTPException
 from fastapi.responses import JSONResponse
+from typing import Dict, Optional
+import math
 import logging
 
 log = logging.getLogger(__name__)
 
 class APIException(Exception):
     """Base class for API exceptions."""
-    def __init__(self, status_code: int, detail: str):
+    def __init__(self, status_code: int, detail: str, headers: Optional[Dict[str, str]] = None):
         self.status_code = status_code
         self.detail = detail
+        self.headers = headers
         super().__init__(self.detail)
 
 class ImageNotFoundException(APIException):
@@ -34,12 +37,34 @@ class DynamoDBException(APIException):
     def __init__(self, detail: str):
         super().__init__(status_code=500, detail=detail)
 
+class ConflictException(APIException):
+    """Exception for requests that conflict with another request in progress."""
+    def __init__(self, detail: str, retry_after: Optional[float] = None):
+        headers = {"Retry-After": str(math.ceil(retry_after))} if retry_after else None
+        super().__init__(status_code=409, detail=detail, headers=headers)
+
+class IdempotencyKeyReusedException(APIException):
+    """Exception for an Idempotency-Key reused with a different request."""
+    def __init__(self):
+        super().__init__(status_code=422, detail="Idempotency-Key was already used with a different request.")
+
+class TooManyRequestsException(APIException):
+    """Exception for clients exceeding their request rate."""
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(status_code=429, detail=detail, headers={"Retry-After": str(math.ceil(retry_after))})
+
+class ServiceUnavailableException(APIException):
+    """Exception for shedding load when the service is overloaded."""
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(status_code=503, detail=detail, headers={"Retry-After": str(math.ceil(retry_after))})
+
 async def api_exception_handler(request: Request, exc: APIException):
     """Handles API exceptions."""
     log.error(f"API Exception: {exc.detail}", exc_info=exc)
     return JSONResponse(
         status_code=exc.status_code,
         content={"detail": exc.detail},
+        headers=exc.headers,
     )
 
 async def http_exception_handler(request: Request, exc: HTTPException):
@@ -0,0 +1,111 @@
+"""
+    Idempotency-Key support for mutating endpoints.
+
+    The first request with a key claims it with a conditional put and, once it
+    finishes, stores its response under the key with a TTL. Retries with the
+    same key get the stored response back without repeating any storage work.
+    A duplicate that arrives while the first request is still running waits
+    for its result instead of doing the work a second time. Reusing a key for a
+    different request (different fingerprint) is rejected.
+"""
+from typing import Any, Optional
+import hashlib
+import json
+import time
+import uuid
+import logging
+
+from botocore.exceptions import BotoCoreError, ClientError
+from fastapi.responses import JSONResponse, Response
+
+from app.storage.dynamodb import DynamoDBService
+from app.exceptions import ConflictException, DynamoDBException, IdempotencyKeyReusedException
+from app.settings import settings
+
+log = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+POLL_INTERVAL_SECONDS = 0.1
+
+def fingerprint(*parts: Any) -> str:
+    """Hashes the parts of a request that must match for a replay to be valid."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else json.dumps(part, sort_keys=True, default=str).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class StoredResponse:
+    """A response recorded under an idempotency key."""
+    def __init__(self, status_code: int, body: Optional[str]):
+        self.status_code = status_code
+        self.body = body
+
+    def to_response(self) -> Response:
+        headers = {REPLAYED_HEADER: "true"}
+        if self.body is None:
+            return Response(status_code=self.status_code, headers=headers)
+        return JSONResponse(status_code=self.status_code, content=json.loads(self.body), headers=headers)
+
+class IdempotentRequest:
+    """
+        One request carrying an Idempotency-Key. Call `begin()` before doing any work:
+        it returns the stored response to replay, or None when this request now owns
+        the key and must call `complete()` on success or `release()` on failure.
+    """
+    def __init__(self, db: DynamoDBService, scope: str, key: str, request_fingerprint: str):
+        self.db = db
+        self.key = f"{scope}#{key}"
+        self.fingerprint = request_fingerprint
+        self.owner = str(uuid.uuid4())
+
+    def begin(self) -> Optional[StoredResponse]:
+        deadline = time.monotonic() + settings.idempotency_wait_seconds
+        try:
+            while True:
+                try:
+                    self.db.claim_idempotency_key(
+                        self.key, self.owner, self.fingerprint,
+                        now=int(time.time()), lease_seconds=settings.idempotency_lease_seconds,
+                    )
+                    return None
+                except ClientError as e:
+                    if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                        raise
+                record = self.db.get_idempotency_record(self.key)
+                if record is None:
+                    # Released or expired between the claim and the read
+                    continue
+                if record.get("fingerprint") != self.fingerprint:
+                    raise IdempotencyKeyReusedException()
+                if record.get("state") == "completed":
+                    return StoredResponse(int(record["status_code"]), record.get("response_body"))
+                # A duplicate is still running: wait for its result rather than redoing the work
+                if time.monotonic() >= deadline:
+                    raise ConflictException(
+                        "A request with this Idempotency-Key is still in progress.",
+                        retry_after=settings.admission_retry_after_seconds,
+                    )
+                time.sleep(POLL_INTERVAL_SECONDS)
+        except (BotoCoreError, ClientError) as e:
+            log.error(f"DynamoDB idempotency claim failed: {e}")
+            raise DynamoDBException(f"Failed to check Idempotency-Key: {e}")
+
+    def complete(self, status_code: int, body: Optional[Any] = None):
+        """Records the response for replay. Failures are logged: the work itself already succeeded."""
+        try:
+            self.db.complete_idempotency_key(
+                self.key, self.owner, status_code,
+                json.dumps(body) if body is not None else None,
+                expires_at=int(time.time()) + settings.idempotency_ttl_seconds,
+            )
+        except (BotoCoreError, ClientError) as e:
+            log.error(f"DynamoDB idempotency completion failed for {self.key}: {e}")
+
+    def release(self):
+        """Gives the key up after a failure so the client can retry."""
+        try:
+            self.db.release_idempotency_key(self.key, self.owner)
+        except (BotoCoreError, ClientError) as e:
+            log.error(f"DynamoDB idempotency release failed for {self.key}: {e}")
@@ -0,0 +1,96 @@
+"""
+    Image attributes captured at upload time: dimensions, frame count,
+    display orientation and a bounded set of readable EXIF fields.
+"""
+from typing import Dict, Mapping, Optional, Tuple
+import math
+import re
+
+from PIL import ExifTags, Image
+
+EXIF_IFD = 0x8769
+ORIENTATION_TAG = 0x0112
+
+# EXIF orientations that rotate the image by 90 degrees when displayed
+ROTATED_ORIENTATIONS = {5, 6, 7, 8}
+
+# Binary blobs, pointers and location data are not kept
+SKIPPED_EXIF_TAGS = {"MakerNote", "UserComment", "PrintImageMatching", "ExifOffset", "GPSInfo", "InteropOffset"}
+MAX_EXIF_ENTRIES = 64
+MAX_EXIF_VALUE_LENGTH = 256
+
+SVG_LENGTH_RE = re.compile(r"^\s*([0-9]*\.?[0-9]+)\s*(px)?\s*$")
+# SVG sizes are only declared, never decoded; anything larger than a raster may be is not kept
+MAX_SVG_SIDE = Image.MAX_IMAGE_PIXELS
+
+def layout_orientation(width: Optional[int], height: Optional[int]) -> Optional[str]:
+    """Returns landscape, portrait or square for the displayed dimensions."""
+    if not width or not height:
+        return None
+    if width > height:
+        return "landscape"
+    if height > width:
+        return "portrait"
+    return "square"
+
+def _exif_fields(img: Image.Image) -> Tuple[Dict[str, str], Optional[int]]:
+    """Returns readable EXIF fields and the EXIF orientation tag, if any."""
+    exif = img.getexif()
+    if not exif:
+        return {}, None
+    fields: Dict[str, str] = {}
+    entries = list(exif.items()) + list(exif.get_ifd(EXIF_IFD).items())
+    for tag, value in entries:
+        name = ExifTags.TAGS.get(tag)
+        if not name or name in SKIPPED_EXIF_TAGS or isinstance(value, (bytes, tuple)):
+            continue
+        text = str(value).strip("\x00 ")
+        if text and len(text) <= MAX_EXIF_VALUE_LENGTH:
+            fields[name] = text
+        if len(fields) >= MAX_EXIF_ENTRIES:
+            break
+    orientation = exif.get(ORIENTATION_TAG)
+    return fields, orientation if isinstance(orientation, int) else None
+
+def raster_attributes(img: Image.Image) -> Dict:
+    """Extracts attributes from an opened raster image."""
+    width, height = img.size
+    exif, exif_orientation = _exif_fields(img)
+    display_width, display_height = (height, width) if exif_orientation in ROTATED_ORIENTATIONS else (width, height)
+    return {
+        "width": width,
+        "height": height,
+        "frame_count": getattr(img, "n_frames", 1),
+        "orientation": layout_orientation(display_width, display_height),
+        "exif": exif or None,
+    }
+
+def _svg_size(value: str) -> Optional[int]:
+    """Parses a declared SVG size, returning None unless it is a positive number up to MAX_SVG_SIDE."""
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    if not math.isfinite(number) or number <= 0 or number > MAX_SVG_SIDE:
+        return None
+    return round(number)
+
+def _svg_length(value: Optional[str]) -> Optional[int]:
+    match = SVG_LENGTH_RE.match(value) if value else None
+    return _svg_size(match.group(1)) if match else None
+
+def svg_attributes(attrib: Mapping[str, str]) -> Dict:
+    """Extracts dimensions from the root <svg> attributes (width/height, else viewBox)."""
+    width, height = _svg_length(attrib.get("width")), _svg_length(attrib.get("height"))
+    if (width is None or height is None) and attrib.get("viewBox"):
+        parts = attrib["viewBox"].replace(",", " ").split()
+        if len(parts) == 4:
+            box_width, box_height = _svg_size(parts[2]), _svg_size(parts[3])
+            if box_width is not None and box_height is not None:
+                width, height = box_width, box_height
+    return {
+        "width": width,
+        "height": height,
+        "frame_count": 1,
+        "orientation": layout_orientation(width, height),
+    }
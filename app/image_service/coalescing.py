@@ -0,0 +1,120 @@
+"""
+    Request coalescing for hot keys.
+
+    `SingleFlight` lets concurrent callers asking for the same key share one
+    backend call: the first caller (the leader) runs it, the others wait for
+    and reuse its result or exception. Followers can bound their wait: if the
+    leader has not finished by then, they make the call themselves rather than
+    hang behind a stuck leader. `CoalescingCache` adds an optional short TTL on
+    top; an expired entry is refreshed through the same single flight, so an
+    expiry under load costs one backend call, not one per waiting request.
+"""
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+import threading
+import time
+
+from app.metrics import COALESCED_CALLS
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into one. Thread-safe."""
+    def __init__(self, group: str):
+        self.group = group
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any], wait_seconds: Optional[float] = None) -> Any:
+        """
+            Runs `fn` unless a call for `key` is already in flight, in which case its outcome
+            is shared. A follower waits at most `wait_seconds` (None: no limit) for the
+            leader, then runs `fn` itself.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            COALESCED_CALLS.labels(group=self.group, result="follower").inc()
+            if not call.done.wait(wait_seconds):
+                COALESCED_CALLS.labels(group=self.group, result="timeout").inc()
+                return fn()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        COALESCED_CALLS.labels(group=self.group, result="leader").inc()
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+class CoalescingCache:
+    """
+        Single-flight lookups with an optional TTL cache holding up to `max_entries`
+        values. Values for which `cacheable` returns False (by default None) are
+        shared with concurrent callers but not cached.
+    """
+    def __init__(
+        self,
+        group: str,
+        max_entries: int = 10000,
+        cacheable: Callable[[Any], bool] = lambda value: value is not None,
+    ):
+        self.group = group
+        self.max_entries = max_entries
+        self.cacheable = cacheable
+        self.flight = SingleFlight(group)
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self, key: Hashable, loader: Callable[[], Any], ttl_seconds: float = 0.0, wait_seconds: Optional[float] = None,
+    ) -> Any:
+        """
+            Returns the cached value for `key`, loading it through the single flight on a
+            miss or expiry. With `ttl_seconds` <= 0 nothing is cached and only concurrent
+            callers share a load. `wait_seconds` bounds how long a caller waits for another
+            caller's load before loading itself.
+        """
+        if ttl_seconds > 0:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    COALESCED_CALLS.labels(group=self.group, result="hit").inc()
+                    return entry[1]
+        return self.flight.do(key, lambda: self._load(key, loader, ttl_seconds), wait_seconds)
+
+    def _load(self, key: Hashable, loader: Callable[[], Any], ttl_seconds: float) -> Any:
+        value = loader()
+        if ttl_seconds > 0 and self.cacheable(value):
+            with self._lock:
+                self._entries[key] = (time.monotonic() + ttl_seconds, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key: Hashable):
+        """Drops a cached value, e.g. after the underlying item changed."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
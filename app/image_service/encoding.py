@@ -0,0 +1,141 @@
+"""
+    Storage encodings of image metadata items.
+
+    Item size drives DynamoDB read and write capacity, so items are written in a
+    compact, versioned encoding: short attribute names, tags as a string set,
+    no ISO `uploaded_at` (derived from the numeric `uploaded_ts`), no `filename`
+    when it is the tail of `s3_key`, short content-type codes and zlib-compressed
+    long descriptions.
+
+    Table and index key attributes (image_id, user_id, uploaded_ts, upload_day,
+    tombstone, deleted_at) keep their names in every encoding, so key conditions
+    work unchanged. Items without a version attribute are in the original
+    (legacy) layout. `decode_item` turns either encoding into the legacy layout,
+    which is what the rest of the service works with.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+import zlib
+
+from boto3.dynamodb.conditions import Attr
+from boto3.dynamodb.types import Binary
+
+from app.settings import settings
+
+VERSION_ATTR = "v"
+COMPACT_VERSION = 2
+
+# Legacy attribute name -> compact attribute name
+COMPACT_NAMES = {
+    "title": "t",
+    "description": "d",
+    "tags": "tg",
+    "filename": "fn",
+    "s3_key": "k",
+    "content_type": "ct",
+    "size": "sz",
+    "original_size": "osz",
+    "original_content_type": "oct",
+    "phash": "ph",
+    "width": "w",
+    "height": "h",
+    "frame_count": "fc",
+    "orientation": "o",
+    "exif": "ex",
+}
+LEGACY_NAMES = {short: name for name, short in COMPACT_NAMES.items()}
+COMPRESSED_DESCRIPTION = "dz"
+
+CONTENT_TYPE_CODES = {
+    "image/png": "png",
+    "image/jpeg": "jpeg",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "image/svg+xml": "svg",
+}
+CONTENT_TYPES = {code: content_type for content_type, code in CONTENT_TYPE_CODES.items()}
+
+INT_FIELDS = ("size", "original_size", "width", "height", "frame_count")
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def any_encoding(name: str, build):
+    """
+        ORs a filter condition over the field's name in both encodings, so scans
+        and queries match items whichever way they were written.
+    """
+    legacy, compact = build(Attr(name)), build(Attr(COMPACT_NAMES.get(name, name)))
+    return legacy if name not in COMPACT_NAMES else legacy | compact
+
+def stored_version(item: Dict[str, Any]) -> int:
+    """Returns the encoding version of a stored or decoded item (1 for legacy items)."""
+    return int(item.get(VERSION_ATTR, 1))
+
+def target_version() -> int:
+    """Returns the encoding version new writes use."""
+    return COMPACT_VERSION if settings.metadata_encoding == "compact" else 1
+
+def _filename_from_key(s3_key: str) -> str:
+    # Keys end in "<uuid>_<filename>"; the uuid contains no underscores
+    return s3_key.rsplit("/", 1)[-1].split("_", 1)[-1]
+
+def encode_item(item: Dict[str, Any], encoding: Optional[str] = None) -> Dict[str, Any]:
+    """Encodes a legacy-layout item for storage in the given encoding (default: the configured one)."""
+    encoding = encoding or settings.metadata_encoding
+    if encoding != "compact":
+        return {k: v for k, v in item.items() if k != VERSION_ATTR}
+
+    out: Dict[str, Any] = {VERSION_ATTR: COMPACT_VERSION}
+    for name, value in item.items():
+        if value is None or name == VERSION_ATTR:
+            continue
+        if name == "uploaded_at" and "uploaded_ts" in item:
+            # Derived from uploaded_ts on read
+            continue
+        if name == "tags":
+            if value:
+                # String sets cannot be empty and do not keep order or duplicates
+                out["tg"] = set(value)
+        elif name == "filename":
+            if _filename_from_key(item.get("s3_key", "")) != value:
+                out["fn"] = value
+        elif name in ("content_type", "original_content_type"):
+            out[COMPACT_NAMES[name]] = CONTENT_TYPE_CODES.get(value, value)
+        elif name == "description":
+            raw = value.encode("utf-8")
+            compressed = zlib.compress(raw) if len(raw) >= settings.metadata_compress_min_bytes else None
+            if compressed is not None and len(compressed) < len(raw):
+                out[COMPRESSED_DESCRIPTION] = Binary(compressed)
+            else:
+                out["d"] = value
+        else:
+            out[COMPACT_NAMES.get(name, name)] = value
+    return out
+
+def decode_item(item: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+        Decodes a stored item in either encoding to the legacy layout. Legacy items
+        are returned as they are; decoded items keep the version attribute.
+    """
+    if not item or VERSION_ATTR not in item:
+        return item
+
+    out: Dict[str, Any] = {}
+    for name, value in item.items():
+        if name == COMPRESSED_DESCRIPTION:
+            data = value.value if isinstance(value, Binary) else bytes(value)
+            out["description"] = zlib.decompress(data).decode("utf-8")
+        else:
+            out[LEGACY_NAMES.get(name, name)] = value
+    out["tags"] = sorted(out.get("tags") or [])
+    for name in ("content_type", "original_content_type"):
+        if name in out:
+            out[name] = CONTENT_TYPES.get(out[name], out[name])
+    if "filename" not in out and "s3_key" in out:
+        out["filename"] = _filename_from_key(out["s3_key"])
+    if "uploaded_ts" in out:
+        out["uploaded_at"] = (EPOCH + timedelta(microseconds=int(out["uploaded_ts"]))).isoformat()
+    for name in INT_FIELDS:
+        if out.get(name) is not None:
+            out[name] = int(out[name])
+    return out
@@ -0,0 +1,157 @@
+"""
+    Bulk metadata export.
+
+    The table is read with a DynamoDB parallel scan: one worker thread per
+    segment pages through its slice and hands pages to the consumer through a
+    bounded queue. Workers block once the queue is full, so the scan never
+    runs further ahead of the client than `buffered_pages` pages, and
+    everything stops as soon as the consumer goes away.
+
+    The response status is sent before the scan starts, so a scan that fails
+    half way cannot turn into an error response. Instead every export ends
+    with a trailer line, {"_export": {"complete": ..., "count": ...}}, which
+    reports the failure; a stream without one was cut off.
+"""
+import json
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+import logging
+import queue
+import threading
+import zlib
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from app.storage.dynamodb import DynamoDBService
+from app.image_service.encoding import decode_item
+from app.exceptions import DynamoDBException
+
+log = logging.getLogger(__name__)
+
+# How often blocked workers re-check whether the export was abandoned
+PUT_TIMEOUT_SECONDS = 0.5
+# Compressed output is flushed once this much plain text has been fed in
+GZIP_FLUSH_BYTES = 64 * 1024
+# Key of the trailer record that ends every export
+TRAILER_KEY = "_export"
+
+_DONE = object()
+
+class _SegmentError:
+    def __init__(self, segment: int, error: Exception):
+        self.segment = segment
+        self.error = error
+
+def _scan_segment(
+    db: DynamoDBService,
+    segment: int,
+    total_segments: int,
+    page_size: int,
+    filters: Optional[Dict[str, str]],
+    pages: queue.Queue,
+    stop: threading.Event,
+):
+    """Pages through one scan segment, putting each page on the queue until done or stopped."""
+    exclusive_start_key = None
+    try:
+        while not stop.is_set():
+            resp = db.scan_metadata(
+                filter_expression=filters, limit=page_size, exclusive_start_key=exclusive_start_key,
+                segment=segment, total_segments=total_segments,
+            )
+            items = resp.get("Items", [])
+            if items and not _put(pages, items, stop):
+                return
+            exclusive_start_key = resp.get("LastEvaluatedKey")
+            if not exclusive_start_key:
+                break
+    except (BotoCoreError, ClientError) as e:
+        log.error(f"DynamoDB export scan of segment {segment} failed: {e}")
+        _put(pages, _SegmentError(segment, e), stop)
+        return
+    except Exception as e:
+        # Anything else must reach the consumer too, or it waits for this segment forever
+        log.exception(f"Export scan of segment {segment} failed")
+        _put(pages, _SegmentError(segment, e), stop)
+        return
+    _put(pages, _DONE, stop)
+
+def _put(pages: queue.Queue, value, stop: threading.Event) -> bool:
+    """Blocks until there is room on the queue; returns False if the export was stopped meanwhile."""
+    while not stop.is_set():
+        try:
+            pages.put(value, timeout=PUT_TIMEOUT_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def iter_export_items(
+    db: DynamoDBService,
+    user_id: Optional[str] = None,
+    total_segments: int = 4,
+    page_size: int = 500,
+    buffered_pages: int = 8,
+) -> Iterator[Dict]:
+    """
+        Yields every live metadata item, optionally for one user, in no particular order.
+        At most `buffered_pages` pages (plus one in flight per segment) are held in memory.
+    """
+    filters = {"user_id": user_id} if user_id else None
+    pages: queue.Queue = queue.Queue(maxsize=buffered_pages)
+    stop = threading.Event()
+    workers: List[threading.Thread] = [
+        threading.Thread(
+            target=_scan_segment,
+            args=(db, segment, total_segments, page_size, filters, pages, stop),
+            name=f"export-scan-{segment}",
+            daemon=True,
+        )
+        for segment in range(total_segments)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        remaining = total_segments
+        while remaining:
+            page = pages.get()
+            if page is _DONE:
+                remaining -= 1
+            elif isinstance(page, _SegmentError):
+                raise DynamoDBException(f"Failed to export images: {page.error}")
+            else:
+                yield from map(decode_item, page)
+    finally:
+        # Runs on completion, on error and when the client disconnects (generator closed)
+        stop.set()
+
+def ndjson_lines(items: Iterable[Dict], serialize: Callable[[Dict], str]) -> Iterator[bytes]:
+    """
+        Encodes each item as one JSON line, followed by the trailer line. If reading or
+        encoding the items fails, the trailer says the export is incomplete and why.
+    """
+    count = 0
+    trailer: Dict = {"complete": True}
+    try:
+        for item in items:
+            line = serialize(item).encode() + b"\n"
+            count += 1
+            yield line
+    except Exception as e:
+        log.error(f"Export failed after {count} items: {e}")
+        trailer = {"complete": False, "error": getattr(e, "detail", "An unexpected error occurred.")}
+    trailer["count"] = count
+    yield json.dumps({TRAILER_KEY: trailer}).encode() + b"\n"
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Gzip-compresses a byte stream incrementally, emitting a chunk every GZIP_FLUSH_BYTES of input."""
+    compressor = zlib.compressobj(wbits=31)  # 31: gzip container
+    pending = 0
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        pending += len(chunk)
+        if pending >= GZIP_FLUSH_BYTES:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,198 @@
+"""
+    In-process secondary indexes over image metadata.
+
+    Indexes are kept current from the write path (`index_item_saved` /
+    `index_item_removed`), rebuilt from a full table scan, and can be persisted
+    to gzip-compressed JSON snapshots so new workers start warm.
+"""
+from typing import Any, Dict, Iterable, List, Optional
+import gzip
+import json
+import os
+import tempfile
+import threading
+import logging
+
+log = logging.getLogger(__name__)
+
+class InMemoryIndex:
+    """
+        Base class for in-process indexes. Subclasses keep all their data in one
+        state object and implement `_new_state`, `_apply_add`, `_apply_remove`,
+        `_dump` and `_restore`. Bump `snapshot_version` when the `_dump` format
+        changes; snapshots of another version are ignored and the index rebuilt.
+
+        A rebuild fills a fresh state without holding the lock; writes that arrive
+        meanwhile are applied to the live state and replayed on the fresh one
+        before it is swapped in, so no update is lost.
+    """
+    name = "index"
+    snapshot_version = 1
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._state = self._new_state()
+        self._pending: Optional[List] = None
+
+    # -- subclass hooks --
+    def _new_state(self):
+        raise NotImplementedError
+
+    def _apply_add(self, state, item: Dict[str, Any]):
+        raise NotImplementedError
+
+    def _apply_remove(self, state, image_id: str):
+        raise NotImplementedError
+
+    def _dump(self, state) -> Any:
+        raise NotImplementedError
+
+    def _restore(self, data: Any):
+        raise NotImplementedError
+
+    # -- incremental updates --
+    def add(self, item: Dict[str, Any]):
+        """Indexes (or re-indexes) an item."""
+        with self._lock:
+            self._apply_remove(self._state, item["image_id"])
+            self._apply_add(self._state, item)
+            if self._pending is not None:
+                self._pending.append(("add", item))
+
+    def remove(self, image_id: str):
+        """Drops an item from the index."""
+        with self._lock:
+            self._apply_remove(self._state, image_id)
+            if self._pending is not None:
+                self._pending.append(("remove", image_id))
+
+    # -- rebuild --
+    def begin_rebuild(self):
+        """Starts recording writes and returns an empty state to fill."""
+        with self._lock:
+            self._pending = []
+        return self._new_state()
+
+    def finish_rebuild(self, state):
+        """Replays writes recorded since `begin_rebuild` and swaps the state in."""
+        with self._lock:
+            for op, arg in self._pending or []:
+                if op == "add":
+                    self._apply_remove(state, arg["image_id"])
+                    self._apply_add(state, arg)
+                else:
+                    self._apply_remove(state, arg)
+            self._pending = None
+            self._state = state
+
+    def abort_rebuild(self):
+        """Stops recording writes after a failed rebuild; the live state is kept."""
+        with self._lock:
+            self._pending = None
+
+    def rebuild(self, items: Iterable[Dict[str, Any]]):
+        """Rebuilds the index from an iterable of items."""
+        rebuild_all([self], items)
+
+    # -- snapshots --
+    def snapshot_path(self, directory: str) -> str:
+        return os.path.join(directory, f"{self.name}.json.gz")
+
+    def save_snapshot(self, directory: str):
+        """Writes the index to `<directory>/<name>.json.gz` atomically."""
+        with self._lock:
+            data = self._dump(self._state)
+        os.makedirs(directory, exist_ok=True)
+        path = self.snapshot_path(directory)
+        # A unique temp file, so workers shutting down together never write into each other's
+        fd, tmp = tempfile.mkstemp(prefix=f"{self.name}.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        log.info("Saved %s index snapshot to %s", self.name, path)
+
+    def load_snapshot(self, directory: str) -> bool:
+        """
+            Loads the index from its snapshot. Returns False if there is none or it cannot
+            be used (unreadable, corrupt or another format version), so the caller rebuilds.
+        """
+        path = self.snapshot_path(directory)
+        if not os.path.exists(path):
+            return False
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+            version = data.get("version") if isinstance(data, dict) else None
+            if version != self.snapshot_version:
+                log.warning(
+                    "Ignoring %s index snapshot %s: version %r, expected %r",
+                    self.name, path, version, self.snapshot_version,
+                )
+                return False
+            state = self._restore(data)
+        except Exception:
+            log.exception("Ignoring unreadable %s index snapshot %s", self.name, path)
+            return False
+        with self._lock:
+            self._state = state
+        log.info("Loaded %s index snapshot from %s", self.name, path)
+        return True
+
+
+# -------------------------
+# Registry
+# -------------------------
+_indexes: List[InMemoryIndex] = []
+
+def register_index(index: InMemoryIndex) -> InMemoryIndex:
+    """Registers an index so it receives write-path updates, rebuilds and snapshots."""
+    _indexes.append(index)
+    return index
+
+def registered_indexes() -> List[InMemoryIndex]:
+    return list(_indexes)
+
+def index_item_saved(item: Dict[str, Any]):
+    """Feeds a newly written item to every index. Index errors never fail the write."""
+    for index in _indexes:
+        try:
+            index.add(item)
+        except Exception:
+            log.exception("Failed to update %s index for %s", index.name, item.get("image_id"))
+
+def index_item_removed(image_id: str):
+    """Drops a deleted item from every index."""
+    for index in _indexes:
+        try:
+            index.remove(image_id)
+        except Exception:
+            log.exception("Failed to remove %s from %s index", image_id, index.name)
+
+def rebuild_all(indexes: List[InMemoryIndex], items: Iterable[Dict[str, Any]]):
+    """Rebuilds several indexes from a single pass over `items`."""
+    states = [index.begin_rebuild() for index in indexes]
+    count = 0
+    try:
+        for item in items:
+            for index, state in zip(indexes, states):
+                index._apply_add(state, item)
+            count += 1
+    except Exception:
+        for index in indexes:
+            index.abort_rebuild()
+        raise
+    for index, state in zip(indexes, states):
+        index.finish_rebuild(state)
+    log.info("Rebuilt %s from %d items", ", ".join(i.name for i in indexes), count)
+
+def save_snapshots(directory: str):
+    """Persists every registered index."""
+    for index in _indexes:
+        try:
+            index.save_snapshot(directory)
+        except OSError as e:
+            log.error(f"Failed to save {index.name} index snapshot: {e}")
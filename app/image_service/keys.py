@@ -0,0 +1,50 @@
+"""
+    S3 object key layouts.
+
+    S3 scales request rates per key prefix. The legacy layout groups objects by
+    user and day (`{user_id}/{YYYYMMDD}/{uuid}_{filename}`), so a heavy user or a
+    bulk import lands on one prefix. The hashed layout puts a short hex prefix
+    derived from the object's uuid in front
+    (`{hash}/{user_id}/{YYYYMMDD}/{uuid}_{filename}`), spreading the same
+    traffic over 16^S3_KEY_HASH_CHARS prefixes.
+
+    The layout only decides how new keys are built: every item stores its full
+    `s3_key`, so objects written under any layout stay readable. All layouts
+    end in `{uuid}_{filename}`.
+"""
+from datetime import datetime
+from typing import Callable, Dict
+import hashlib
+
+from app.settings import settings
+
+KeyLayout = Callable[[str, datetime, str, str], str]
+
+KEY_LAYOUTS: Dict[str, KeyLayout] = {}
+
+def register_layout(name: str):
+    """Registers a function building an S3 key from (user_id, uploaded_at, object uuid, filename)."""
+    def decorator(func: KeyLayout) -> KeyLayout:
+        KEY_LAYOUTS[name] = func
+        return func
+    return decorator
+
+def hash_prefix(object_id: str, chars: int) -> str:
+    """Returns the first `chars` hex digits of a (non-cryptographic) hash of the object id."""
+    return hashlib.md5(object_id.encode(), usedforsecurity=False).hexdigest()[:chars]
+
+@register_layout("legacy")
+def legacy_key(user_id: str, uploaded_at: datetime, object_id: str, filename: str) -> str:
+    return f"{user_id}/{uploaded_at.strftime('%Y%m%d')}/{object_id}_{filename}"
+
+@register_layout("hashed")
+def hashed_key(user_id: str, uploaded_at: datetime, object_id: str, filename: str) -> str:
+    prefix = hash_prefix(object_id, settings.s3_key_hash_chars)
+    return f"{prefix}/{legacy_key(user_id, uploaded_at, object_id, filename)}"
+
+def build_s3_key(user_id: str, uploaded_at: datetime, object_id: str, filename: str) -> str:
+    """Builds the S3 key for a new object with the configured S3_KEY_LAYOUT."""
+    layout = KEY_LAYOUTS.get(settings.s3_key_layout)
+    if layout is None:
+        raise ValueError(f"Unknown S3 key layout '{settings.s3_key_layout}'; expected one of {sorted(KEY_LAYOUTS)}")
+    return layout(user_id, uploaded_at, object_id, filename)
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 from pydantic import BaseModel, Field
 from uuid import uuid4
@@ -7,6 +7,16 @@ def new_image_id() -> str:
     """Generates a new unique image ID."""
     return str(uuid4())
 
+class ImageInfo(BaseModel):
+    """Attributes extracted while validating the uploaded bytes."""
+    content_type: str
+    phash: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    frame_count: Optional[int] = None
+    orientation: Optional[str] = None  # landscape | portrait | square, as displayed
+    exif: Optional[Dict[str, str]] = None
+
 class ImageMeta(BaseModel):
     image_id: str = Field(default_factory=new_image_id)
     user_id: str
@@ -16,8 +26,17 @@ class ImageMeta(BaseModel):
     s3_key: str
     filename: str
     content_type: str
-    size: int
+    size: int  # stored bytes
     uploaded_at: datetime
+    # Set when the upload policy re-encoded the image before storing it
+    original_size: Optional[int] = None
+    original_content_type: Optional[str] = None
+    phash: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    frame_count: Optional[int] = None
+    orientation: Optional[str] = None
+    exif: Optional[Dict[str, str]] = None
 
 class ImageItem(BaseModel):
     image_id: str
@@ -30,6 +49,14 @@ class ImageItem(BaseModel):
     size: int
     s3_key: str
     uploaded_at: datetime
+    original_size: Optional[int] = None
+    original_content_type: Optional[str] = None
+    phash: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    frame_count: Optional[int] = None
+    orientation: Optional[str] = None
+    exif: Optional[Dict[str, str]] = None
 
 class UploadResponse(BaseModel):
     image_id: str
@@ -40,4 +67,42 @@ class UploadResponse(BaseModel):
 
 class ListImagesResponse(BaseModel):
     images: List[ImageItem]
-    next_token: Optional[str] = None
\ No newline at end of file
+    next_token: Optional[str] = None
+
+class SearchHit(BaseModel):
+    image_id: str
+    user_id: str
+    title: Optional[str] = None
+    tags: List[str] = []
+    score: float
+
+class SearchResponse(BaseModel):
+    results: List[SearchHit]
+
+class TagSuggestion(BaseModel):
+    tag: str
+    count: int
+
+class TagSuggestionsResponse(BaseModel):
+    prefix: str
+    suggestions: List[TagSuggestion]
+
+
+class SimilarImage(BaseModel):
+    image_id: str
+    distance: int
+
+class SimilarImagesResponse(BaseModel):
+    image_id: str
+    phash: str
+    results: List[SimilarImage]
+
+class ContentTypeUsage(BaseModel):
+    count: int
+    bytes: int
+
+class UserStatsResponse(BaseModel):
+    user_id: str
+    image_count: int
+    total_bytes: int
+    content_types: Dict[str, ContentTypeUsage] = {}
@@ -0,0 +1,128 @@
+"""
+    Upload policy: optional canonical re-encoding of validated raster uploads.
+
+    With UPLOAD_REENCODE_FORMAT=webp uploads are re-encoded to WebP, lossless
+    or at UPLOAD_REENCODE_QUALITY. With UPLOAD_STRIP_METADATA they are
+    re-encoded without EXIF/ICC/text blocks (in their own format unless a
+    target format is set). Either way the result is kept only when it is
+    smaller than what the client sent. SVGs are stored as sent.
+
+    A kept result is described as stored: its content type, dimensions, a
+    filename whose extension matches the new format, and no EXIF fields when
+    the EXIF block was stripped.
+"""
+from io import BytesIO
+from typing import Optional, Tuple
+import logging
+import os
+
+from PIL import Image, ImageOps, JpegImagePlugin
+
+from app.image_service.attributes import layout_orientation
+from app.image_service.models import ImageInfo
+from app.metrics import track, REENCODE_LATENCY
+from app.settings import settings
+
+log = logging.getLogger(__name__)
+
+FORMATS = {"webp": ("WEBP", "image/webp")}
+PIL_FORMATS = {"image/png": "PNG", "image/jpeg": "JPEG", "image/gif": "GIF", "image/webp": "WEBP"}
+# Extensions accepted for each content type; the first is used when renaming
+EXTENSIONS = {
+    "image/png": (".png",),
+    "image/jpeg": (".jpg", ".jpeg", ".jpe"),
+    "image/gif": (".gif",),
+    "image/webp": (".webp",),
+}
+
+def _save_options(fmt: str, source: Image.Image, strip: bool) -> dict:
+    options = {}
+    if fmt == "WEBP":
+        options["lossless"] = settings.upload_reencode_lossless
+        options["quality"] = settings.upload_reencode_quality
+        options["method"] = 4
+    elif fmt == "JPEG":
+        if source.format == "JPEG":
+            # Re-use the source quantization tables so stripping does not degrade the image
+            options["qtables"] = source.quantization
+            options["subsampling"] = JpegImagePlugin.get_sampling(source)
+        else:
+            options["quality"] = settings.upload_reencode_quality
+        options["optimize"] = True
+    elif fmt == "PNG":
+        options["optimize"] = True
+    if getattr(source, "n_frames", 1) > 1 and fmt in ("WEBP", "GIF"):
+        options["save_all"] = True
+    if not strip:
+        for key in ("exif", "icc_profile"):
+            if source.info.get(key):
+                options[key] = source.info[key]
+    return options
+
+def reencode(data: bytes, content_type: str) -> Optional[Tuple[bytes, str, Tuple[int, int]]]:
+    """
+        Re-encodes the image according to the upload policy. Returns the new bytes,
+        content type and pixel size, or None when the policy does not apply or the
+        result is not smaller.
+    """
+    target = FORMATS.get(settings.upload_reencode_format or "")
+    strip = settings.upload_strip_metadata
+    if content_type not in PIL_FORMATS or not (target or strip):
+        return None
+    fmt, new_content_type = target if target else (PIL_FORMATS[content_type], content_type)
+
+    source = img = Image.open(BytesIO(data))
+    animated = getattr(img, "n_frames", 1) > 1
+    if animated and fmt not in ("WEBP", "GIF"):
+        return None
+    if strip and not animated:
+        # The orientation tag goes away with the EXIF block, so apply it to the pixels
+        img = ImageOps.exif_transpose(img)
+    if fmt == "JPEG" and img.mode not in ("RGB", "L", "CMYK"):
+        return None
+    if fmt == "WEBP" and not animated and img.mode not in ("RGB", "RGBA"):
+        # Animated sources are converted frame by frame by the WebP writer
+        img = img.convert("RGBA" if img.mode in ("P", "LA", "PA") or "transparency" in img.info else "RGB")
+
+    out = BytesIO()
+    img.save(out, format=fmt, **_save_options(fmt, source, strip))
+    encoded = out.getvalue()
+    if len(encoded) >= len(data):
+        return None
+    return encoded, new_content_type, img.size
+
+def stored_filename(filename: str, content_type: str) -> str:
+    """Returns `filename` with an extension matching `content_type`, e.g. photo.png -> photo.webp."""
+    extensions = EXTENSIONS.get(content_type)
+    if not extensions or not filename:
+        return filename
+    stem, ext = os.path.splitext(filename)
+    if ext.lower() in extensions:
+        return filename
+    # Only replace what looks like an image extension; "v1.2" keeps its dot
+    if not any(ext.lower() in known for known in EXTENSIONS.values()):
+        stem = filename
+    return stem + extensions[0]
+
+def apply_upload_policy(data: bytes, info: ImageInfo) -> Tuple[bytes, ImageInfo]:
+    """
+        Applies the upload policy to validated bytes. Returns the bytes to store and
+        their attributes; the input is returned unchanged when re-encoding does not help.
+        CPU bound: call it off the event loop.
+    """
+    try:
+        with track(REENCODE_LATENCY, content_type=info.content_type):
+            result = reencode(data, info.content_type)
+    except Exception:
+        # Validation already accepted the image; storing it as sent is always safe
+        log.exception("Re-encoding a %s upload failed; storing the original", info.content_type)
+        result = None
+    if result is None:
+        return data, info
+    encoded, content_type, (width, height) = result
+    log.debug("Re-encoded %s (%d bytes) to %s (%d bytes)", info.content_type, len(data), content_type, len(encoded))
+    update = {"content_type": content_type, "width": width, "height": height}
+    if settings.upload_strip_metadata:
+        # The EXIF block is gone and any rotation was applied to the pixels
+        update.update(exif=None, orientation=layout_orientation(width, height))
+    return encoded, info.model_copy(update=update)
@@ -0,0 +1,142 @@
+"""
+    Full-text search over image titles, descriptions and tags.
+
+    An in-process inverted index ranked with BM25. Title and tag matches weigh
+    more than description matches. Queries never touch DynamoDB.
+"""
+from typing import Any, Dict, List, Optional
+import heapq
+import math
+import re
+
+from app.image_service.indexes import InMemoryIndex, register_index
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Per-field weights applied to term frequencies
+FIELD_WEIGHTS = {"title": 2.0, "tags": 3.0, "description": 1.0}
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lowercases and splits text into word tokens."""
+    if not text:
+        return []
+    return TOKEN_RE.findall(text.lower())
+
+def weighted_terms(item: Dict[str, Any]) -> Dict[str, float]:
+    """Returns the weighted term frequencies of an item's searchable fields."""
+    terms: Dict[str, float] = {}
+    fields = {
+        "title": tokenize(item.get("title")),
+        "description": tokenize(item.get("description")),
+        "tags": [t for tag in (item.get("tags") or []) for t in tokenize(tag)],
+    }
+    for field, tokens in fields.items():
+        weight = FIELD_WEIGHTS[field]
+        for token in tokens:
+            terms[token] = terms.get(token, 0.0) + weight
+    return terms
+
+class SearchState:
+    """Postings (term -> {image_id: weighted tf}) plus per-document data."""
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, float]] = {}
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self.total_length = 0.0
+
+class SearchIndex(InMemoryIndex):
+    """BM25-ranked inverted index of image metadata."""
+    name = "search"
+
+    def _new_state(self) -> SearchState:
+        return SearchState()
+
+    def _index_doc(self, state: SearchState, image_id: str, doc: Dict[str, Any]):
+        terms = doc["terms"]
+        if not terms:
+            return
+        state.docs[image_id] = doc
+        state.total_length += doc["length"]
+        for term, tf in terms.items():
+            state.postings.setdefault(term, {})[image_id] = tf
+
+    def _apply_add(self, state: SearchState, item: Dict[str, Any]):
+        terms = weighted_terms(item)
+        doc = {
+            "user_id": item.get("user_id"),
+            "title": item.get("title"),
+            "tags": list(item.get("tags") or []),
+            "terms": terms,
+            "length": sum(terms.values()),
+        }
+        self._index_doc(state, item["image_id"], doc)
+
+    def _apply_remove(self, state: SearchState, image_id: str):
+        doc = state.docs.pop(image_id, None)
+        if doc is None:
+            return
+        state.total_length -= doc["length"]
+        for term in doc["terms"]:
+            posting = state.postings.get(term)
+            if posting is not None:
+                posting.pop(image_id, None)
+                if not posting:
+                    del state.postings[term]
+
+    def _dump(self, state: SearchState) -> Any:
+        # Postings are derived from per-document terms, so only documents are stored
+        return {
+            "version": self.snapshot_version,
+            "docs": [
+                [image_id, doc["user_id"], doc["title"], doc["tags"], doc["terms"]]
+                for image_id, doc in state.docs.items()
+            ],
+        }
+
+    def _restore(self, data: Any) -> SearchState:
+        state = SearchState()
+        for image_id, user_id, title, tags, terms in data["docs"]:
+            doc = {"user_id": user_id, "title": title, "tags": tags, "terms": terms, "length": sum(terms.values())}
+            self._index_doc(state, image_id, doc)
+        return state
+
+    def search(self, query: str, user_id: Optional[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
+        """Returns the top `limit` documents for `query`, best first, optionally restricted to a user."""
+        terms = set(tokenize(query))
+        with self._lock:
+            state = self._state
+            n_docs = len(state.docs)
+            if not terms or not n_docs:
+                return []
+            avg_length = state.total_length / n_docs
+            scores: Dict[str, float] = {}
+            for term in terms:
+                posting = state.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                for image_id, tf in posting.items():
+                    length = state.docs[image_id]["length"]
+                    norm = tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / avg_length))
+                    scores[image_id] = scores.get(image_id, 0.0) + idf * norm
+            if user_id:
+                scores = {i: s for i, s in scores.items() if state.docs[i]["user_id"] == user_id}
+            top = heapq.nlargest(limit, scores.items(), key=lambda kv: kv[1])
+            return [
+                {
+                    "image_id": image_id,
+                    "user_id": state.docs[image_id]["user_id"],
+                    "title": state.docs[image_id]["title"],
+                    "tags": state.docs[image_id]["tags"],
+                    "score": score,
+                }
+                for image_id, score in top
+            ]
+
+    def __len__(self):
+        return len(self._state.docs)
+
+search_index = register_index(SearchIndex())
@@ -1,19 +1,46 @@
-from datetime import datetime, timezone
-from typing import List, Dict, Optional
+from datetime import datetime, timezone, timedelta
+from typing import List, Dict, Iterator, Optional
 import logging
-from datetime import datetime, timezone
 import uuid
-from boto3.dynamodb.conditions import Attr
+from boto3.dynamodb.conditions import Attr, Key
 from botocore.exceptions import BotoCoreError, ClientError
 
-from app.storage.dynamodb import DynamoDBService
+from app.storage.dynamodb import (
+    DynamoDBService, USER_TIME_INDEX, UPLOAD_DAY_INDEX, STATS_COUNT_PREFIX, STATS_BYTES_PREFIX, STATS_VERSION,
+)
 from app.storage.s3 import S3Service
-from app.image_service.models import ImageMeta
+from app.image_service.models import ImageMeta, ImageInfo
+from app.image_service.encoding import encode_item, decode_item, any_encoding
+from app.image_service.coalescing import CoalescingCache
+from app.image_service.keys import build_s3_key
+from app.image_service.indexes import index_item_saved, index_item_removed, registered_indexes, rebuild_all, save_snapshots
 from app.settings import settings
-from app.exceptions import S3UploadException, DynamoDBException, ImageNotFoundException
+from app.capacity import RETURN_CONSUMED_CAPACITY, record as record_capacity
+from app.metrics import track, BACKEND_LATENCY
+from app.exceptions import S3UploadException, DynamoDBException, ImageNotFoundException, InvalidImageException
 
 log = logging.getLogger(__name__)
 
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Hot images are read by many requests at once; they share one get_item per image
+METADATA_READS = CoalescingCache("metadata", max_entries=settings.metadata_cache_max_entries)
+
+def as_utc(dt: datetime) -> datetime:
+    """Returns the datetime in UTC; naive values are taken to be UTC already."""
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+def to_epoch_us(dt: datetime) -> int:
+    """Converts a datetime to integer epoch microseconds."""
+    delta = as_utc(dt) - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+def upload_day(dt: datetime) -> str:
+    """Returns the UTC day bucket (YYYYMMDD) used by the UploadDayIndex."""
+    return as_utc(dt).strftime("%Y%m%d")
+
 def save_image_and_meta(
     db: DynamoDBService,
     s3: S3Service,
@@ -24,20 +51,35 @@ def save_image_and_meta(
     user_id: str,
     title: Optional[str],
     description: Optional[str],
-    tags: List[str]
+    tags: List[str],
+    info: Optional[ImageInfo] = None,
+    original_size: Optional[int] = None,
+    original_content_type: Optional[str] = None
 ) -> ImageMeta:
-    """Saves image to S3 and metadata to DynamoDB."""
+    """
+        Saves image to S3 and metadata to DynamoDB, including attributes extracted at validation.
+        `original_size`/`original_content_type` describe the upload when the stored bytes were re-encoded.
+    """
     # generate s3 key and metadata
+    uploaded_at = datetime.now(timezone.utc)
     image = ImageMeta(
         user_id = user_id,
         title = title,
         description = description,
         tags = tags,
-        s3_key = f"{user_id}/{datetime.now(timezone.utc).strftime('%Y%m%d')}/{image_id_key()}_{filename}",
+        s3_key = build_s3_key(user_id, uploaded_at, image_id_key(), filename),
         filename = filename,
         content_type = content_type,
         size = size,
-        uploaded_at = datetime.now(timezone.utc),
+        uploaded_at = uploaded_at,
+        original_size = original_size,
+        original_content_type = original_content_type,
+        phash = info.phash if info else None,
+        width = info.width if info else None,
+        height = info.height if info else None,
+        frame_count = info.frame_count if info else None,
+        orientation = info.orientation if info else None,
+        exif = info.exif if info else None,
     )
     # upload to s3
     try:
@@ -50,12 +92,19 @@ def save_image_and_meta(
     item = image.model_dump()
     # Dynamo needs uploaded_at as ISO string
     item["uploaded_at"] = item["uploaded_at"].isoformat()
+    # Sort/partition keys of the time-ordered indexes
+    item["uploaded_ts"] = to_epoch_us(image.uploaded_at)
+    item["upload_day"] = upload_day(image.uploaded_at)
+    stored = encode_item(item)
     try:
-        db.put_metadata(item)
+        db.put_metadata(stored)
     except (BotoCoreError, ClientError) as e:
         log.error(f"DynamoDB put_metadata failed: {e}")
         raise DynamoDBException(f"Failed to save image metadata: {e}")
 
+    # Index the item as it reads back (e.g. compact tags are deduplicated and sorted)
+    index_item_saved(decode_item(stored))
+    _record_usage(db, user_id, content_type, 1, size)
     log.info("Saved image metadata %s", image.image_id)
     return image
 
@@ -69,38 +118,176 @@ def fetch_images(
     user_id: Optional[str] = None, 
     tag: Optional[str] = None, 
     limit:int = 50, 
-    exclusive_start_key: Optional[Dict[str,str]] = None
+    exclusive_start_key: Optional[Dict[str,str]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    order: Optional[str] = None,
+    min_width: Optional[int] = None,
+    min_height: Optional[int] = None,
+    orientation: Optional[str] = None
 ):
-    """Fetches images from DynamoDB with optional filters."""
+    """
+        Fetches images from DynamoDB with optional filters.
+        Time-range or ordered requests are served by key-condition queries on the
+        time-ordered indexes; everything else falls back to a scan.
+    """
+    attr_filter = _attribute_filter(min_width=min_width, min_height=min_height, orientation=orientation)
     try:
-        filters = {}
-        if user_id:
-            filters["user_id"] = user_id
-        if tag:
+        if since or until or order:
+            resp = _query_time_range(
+                db, user_id=user_id, tag=tag, limit=limit, exclusive_start_key=exclusive_start_key,
+                since=since, until=until, ascending=(order == "asc"), extra_filter=attr_filter,
+            )
+        elif tag:
             table = db.resource.Table(settings.dynamodb_table)
-            scan_kwargs = {"Limit": limit}
+            scan_kwargs = {"Limit": limit, "ReturnConsumedCapacity": RETURN_CONSUMED_CAPACITY}
             if exclusive_start_key:
                 scan_kwargs["ExclusiveStartKey"] = exclusive_start_key
-            scan_kwargs["FilterExpression"] = Attr("tags").contains(tag)
+            scan_kwargs["FilterExpression"] = _tag_filter(tag) & Attr("deleted_at").not_exists()
             if user_id:
                 scan_kwargs["FilterExpression"] = scan_kwargs["FilterExpression"] & Attr("user_id").eq(user_id)
-            resp = table.scan(**scan_kwargs)
-            items = resp.get("Items", [])
-            return {"Items": items, "LastEvaluatedKey": resp.get("LastEvaluatedKey")}
+            if attr_filter is not None:
+                scan_kwargs["FilterExpression"] = scan_kwargs["FilterExpression"] & attr_filter
+            with track(BACKEND_LATENCY, backend="dynamodb", operation="scan_by_tag"):
+                resp = table.scan(**scan_kwargs)
+            record_capacity(settings.dynamodb_table, "scan_by_tag", "read", resp)
         else:
-            resp = db.scan_metadata(filter_expression=filters if filters else None, limit=limit, exclusive_start_key=exclusive_start_key)
-            return resp
+            resp = db.scan_metadata(
+                filter_expression={"user_id": user_id} if user_id else None, limit=limit,
+                exclusive_start_key=exclusive_start_key, condition=attr_filter,
+            )
     except (BotoCoreError, ClientError) as e:
         log.error(f"DynamoDB fetch_images failed: {e}")
         raise DynamoDBException(f"Failed to fetch images: {e}")
-    
+    # Items may be stored in either encoding
+    items = [decode_item(it) for it in resp.get("Items", [])]
+    return {"Items": items, "LastEvaluatedKey": resp.get("LastEvaluatedKey")}
+
+def _tag_filter(tag: str):
+    # contains() matches both the legacy list and the compact string set
+    return any_encoding("tags", lambda a: a.contains(tag))
+
+def _attribute_filter(
+    min_width: Optional[int] = None,
+    min_height: Optional[int] = None,
+    orientation: Optional[str] = None
+):
+    """Builds a filter condition on the image attributes captured at upload, or None."""
+    conditions = []
+    if min_width is not None:
+        conditions.append(any_encoding("width", lambda a: a.gte(min_width)))
+    if min_height is not None:
+        conditions.append(any_encoding("height", lambda a: a.gte(min_height)))
+    if orientation is not None:
+        conditions.append(any_encoding("orientation", lambda a: a.eq(orientation)))
+    combined = None
+    for cond in conditions:
+        combined = cond if combined is None else combined & cond
+    return combined
+
+def _time_condition(hash_key: str, hash_value: str, since_ts: Optional[int], until_ts: Optional[int]):
+    cond = Key(hash_key).eq(hash_value)
+    if since_ts is not None and until_ts is not None:
+        return cond & Key("uploaded_ts").between(since_ts, until_ts)
+    if since_ts is not None:
+        return cond & Key("uploaded_ts").gte(since_ts)
+    if until_ts is not None:
+        return cond & Key("uploaded_ts").lte(until_ts)
+    return cond
+
+def _query_time_range(
+    db: DynamoDBService,
+    user_id: Optional[str],
+    tag: Optional[str],
+    limit: int,
+    exclusive_start_key: Optional[Dict],
+    since: Optional[datetime],
+    until: Optional[datetime],
+    ascending: bool,
+    extra_filter=None
+):
+    """Lists images by upload time using UserTimeIndex, or UploadDayIndex day buckets for global queries."""
+    tag_filter = _tag_filter(tag) if tag else None
+    if extra_filter is not None:
+        tag_filter = extra_filter if tag_filter is None else tag_filter & extra_filter
+
+    if user_id:
+        cond = _time_condition(
+            "user_id", user_id,
+            to_epoch_us(since) if since else None,
+            to_epoch_us(until) if until else None,
+        )
+        return db.query_metadata(
+            USER_TIME_INDEX, cond, filter_expression=tag_filter, ascending=ascending,
+            limit=limit, exclusive_start_key=exclusive_start_key,
+        )
+
+    max_span = timedelta(days=settings.list_max_lookback_days)
+    upper = until or datetime.now(timezone.utc)
+    lower = since or upper - max_span
+    if upper - lower > max_span:
+        # Every day bucket costs a query, so bound the work a single request can cause
+        raise InvalidImageException(
+            f"Time range without user_id may span at most {settings.list_max_lookback_days} days"
+        )
+    since_ts, until_ts = to_epoch_us(lower), to_epoch_us(upper)
+    days = []
+    day = datetime.strptime(upload_day(lower), "%Y%m%d")
+    last = upload_day(upper)
+    while day.strftime("%Y%m%d") <= last:
+        days.append(day.strftime("%Y%m%d"))
+        day += timedelta(days=1)
+    if not ascending:
+        days.reverse()
+
+    # The page token is either a query LastEvaluatedKey (which carries upload_day)
+    # or just {"upload_day": ...} when the previous page ended on a bucket boundary
+    start_key = None
+    if exclusive_start_key:
+        if exclusive_start_key.get("upload_day") not in days:
+            return {"Items": [], "LastEvaluatedKey": None}
+        days = days[days.index(exclusive_start_key["upload_day"]):]
+        if len(exclusive_start_key) > 1:
+            start_key = exclusive_start_key
+
+    items = []
+    for i, day in enumerate(days):
+        key = start_key if i == 0 else None
+        while True:
+            resp = db.query_metadata(
+                UPLOAD_DAY_INDEX, _time_condition("upload_day", day, since_ts, until_ts),
+                filter_expression=tag_filter, ascending=ascending,
+                limit=limit - len(items), exclusive_start_key=key,
+            )
+            items.extend(resp.get("Items", []))
+            key = resp.get("LastEvaluatedKey")
+            if len(items) >= limit:
+                if key:
+                    return {"Items": items, "LastEvaluatedKey": key}
+                if i + 1 < len(days):
+                    return {"Items": items, "LastEvaluatedKey": {"upload_day": days[i + 1]}}
+                return {"Items": items, "LastEvaluatedKey": None}
+            if not key:
+                break
+    return {"Items": items, "LastEvaluatedKey": None}
+
 def get_image_meta(db: DynamoDBService, image_id: str):
-    """Gets image metadata from DynamoDB."""
+    """
+        Gets image metadata from DynamoDB. Tombstoned images are treated as missing.
+        Concurrent lookups of the same image share one read (see METADATA_CACHE_TTL_SECONDS).
+    """
     try:
-        item = db.get_metadata(image_id)
-        if not item:
+        item = METADATA_READS.get(
+            image_id,
+            lambda: decode_item(db.get_metadata(image_id)),
+            ttl_seconds=settings.metadata_cache_ttl_seconds,
+            # A read is given up after the storage read deadline; waiting longer for one is pointless
+            wait_seconds=settings.storage_read_deadline_seconds or None,
+        )
+        if not item or item.get("deleted_at"):
             raise ImageNotFoundException(image_id)
-        return item
+        # The item may be shared with other requests
+        return dict(item)
     except (BotoCoreError, ClientError) as e:
         log.error(f"DynamoDB get_image_meta failed: {e}")
         raise DynamoDBException(f"Failed to get image metadata: {e}")
@@ -110,21 +297,172 @@ def remove_image(
     s3: S3Service,
     image_id: str
 ):
-    """Removes image from S3 and metadata from DynamoDB."""
+    """
+        Soft deletes an image by writing a tombstone on its metadata.
+        The S3 object and the item itself are purged later by `purge_deleted_images`.
+    """
     item = get_image_meta(db, image_id)
     if not item:
         raise ImageNotFoundException(image_id)
-    
-    s3_key = item.get("s3_key")
-    if s3_key:
-        try:
-            s3.delete(s3_key)
-        except (BotoCoreError, ClientError) as e:
-            log.error(f"S3 delete failed: {e}")
-            raise S3UploadException(f"Failed to delete image from S3: {e}")
+
     try:
-        db.delete_metadata(image_id)
-    except (BotoCoreError, ClientError) as e:
-        log.error(f"DynamoDB delete_metadata failed: {e}")
+        db.mark_deleted(image_id, datetime.now(timezone.utc).isoformat())
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            # Deleted concurrently by another request
+            raise ImageNotFoundException(image_id)
+        log.error(f"DynamoDB mark_deleted failed: {e}")
+        raise DynamoDBException(f"Failed to delete image metadata: {e}")
+    except BotoCoreError as e:
+        log.error(f"DynamoDB mark_deleted failed: {e}")
         raise DynamoDBException(f"Failed to delete image metadata: {e}")
+    METADATA_READS.invalidate(image_id)
+    index_item_removed(image_id)
+    _record_usage(db, item["user_id"], item.get("content_type"), -1, -int(item.get("size") or 0))
     return True
+
+def purge_deleted_images(
+    db: DynamoDBService,
+    s3: S3Service,
+    grace_period_seconds: int,
+    batch_size: int
+) -> int:
+    """
+        Purges one batch of tombstoned images older than the grace period.
+        S3 objects are removed with DeleteObjects and metadata with batched deletes;
+        items whose object or metadata could not be deleted keep their tombstone and are retried next run.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=grace_period_seconds)).isoformat()
+    items = [decode_item(it) for it in db.query_tombstones(deleted_before=cutoff, limit=batch_size)]
+    if not items:
+        return 0
+
+    keys = [it["s3_key"] for it in items if it.get("s3_key")]
+    failed = set(s3.delete_many(keys)) if keys else set()
+    image_ids = [it["image_id"] for it in items if it.get("s3_key") not in failed]
+    unprocessed = db.batch_delete_metadata(image_ids)
+
+    purged = len(image_ids) - len(unprocessed)
+    log.info("Purged %d deleted images (%d S3 failures, %d metadata deletes left)", purged, len(failed), len(unprocessed))
+    return purged
+
+def _usage_deltas(content_type: Optional[str], count: int, nbytes: int) -> Dict[str, int]:
+    content_type = content_type or "unknown"
+    return {
+        "image_count": count,
+        "total_bytes": nbytes,
+        f"{STATS_COUNT_PREFIX}{content_type}": count,
+        f"{STATS_BYTES_PREFIX}{content_type}": nbytes,
+    }
+
+def _record_usage(db: DynamoDBService, user_id: str, content_type: Optional[str], count: int, nbytes: int):
+    """
+        Applies an upload/delete to the user's aggregates. The image write has already
+        succeeded, so a failure here is only logged and left to `reconcile_user_stats`.
+    """
+    try:
+        db.add_user_stats(user_id, _usage_deltas(content_type, count, nbytes))
+    except (BotoCoreError, ClientError) as e:
+        log.error(f"DynamoDB add_user_stats failed for user {user_id}: {e}")
+
+def _stats_totals(item: Optional[Dict]) -> Dict[str, int]:
+    """Returns the numeric aggregate attributes of a stats item as ints."""
+    if not item:
+        return {}
+    return {k: int(v) for k, v in item.items() if k not in ("user_id", STATS_VERSION)}
+
+def get_user_stats(db: DynamoDBService, user_id: str) -> Dict:
+    """Returns a user's image count, total bytes and per-content-type breakdown from their aggregate item."""
+    try:
+        totals = _stats_totals(db.get_user_stats(user_id))
+    except (BotoCoreError, ClientError) as e:
+        log.error(f"DynamoDB get_user_stats failed: {e}")
+        raise DynamoDBException(f"Failed to get user stats: {e}")
+    content_types: Dict[str, Dict[str, int]] = {}
+    for name, value in totals.items():
+        for prefix, field in ((STATS_COUNT_PREFIX, "count"), (STATS_BYTES_PREFIX, "bytes")):
+            if name.startswith(prefix):
+                content_types.setdefault(name[len(prefix):], {"count": 0, "bytes": 0})[field] = value
+    return {
+        "user_id": user_id,
+        "image_count": totals.get("image_count", 0),
+        "total_bytes": totals.get("total_bytes", 0),
+        # Content types whose images have all been deleted are left out
+        "content_types": {ct: v for ct, v in content_types.items() if v["count"]},
+    }
+
+def reconcile_user_stats(db: DynamoDBService) -> int:
+    """
+        Recomputes every user's aggregates from a table scan and ADDs the difference
+        to those that drifted. Returns the number of users corrected.
+
+        Each correction is conditional on the stats item still being at the version
+        read before the scan, so concurrent reconcilers (one per worker) apply it at
+        most once, and users whose stats changed meanwhile (an upload or delete raced
+        with the scan) are skipped and left to the next run.
+    """
+    # Stats are read before the images, so any later upload or delete bumps the version
+    actual: Dict[str, Dict[str, int]] = {}
+    versions: Dict[str, int] = {}
+    exclusive_start_key = None
+    while True:
+        resp = db.scan_user_stats(exclusive_start_key=exclusive_start_key)
+        for item in resp.get("Items", []):
+            actual[item["user_id"]] = _stats_totals(item)
+            versions[item["user_id"]] = int(item.get(STATS_VERSION) or 0)
+        exclusive_start_key = resp.get("LastEvaluatedKey")
+        if not exclusive_start_key:
+            break
+
+    expected: Dict[str, Dict[str, int]] = {}
+    for item in iter_all_images(db):
+        totals = expected.setdefault(item["user_id"], {})
+        for name, delta in _usage_deltas(item.get("content_type"), 1, int(item.get("size") or 0)).items():
+            totals[name] = totals.get(name, 0) + delta
+
+    corrected = skipped = 0
+    for user_id in expected.keys() | actual.keys():
+        want, have = expected.get(user_id, {}), actual.get(user_id, {})
+        deltas = {
+            name: want.get(name, 0) - have.get(name, 0)
+            for name in want.keys() | have.keys()
+            if want.get(name, 0) != have.get(name, 0)
+        }
+        if not deltas:
+            continue
+        try:
+            db.add_user_stats(user_id, deltas, expected_version=versions.get(user_id, 0))
+            corrected += 1
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            skipped += 1
+    if skipped:
+        log.info("Skipped %d users whose stats changed during reconciliation", skipped)
+    log.info("Reconciled user stats: %d of %d users corrected", corrected, len(expected.keys() | actual.keys()))
+    return corrected
+
+def iter_all_images(db: DynamoDBService, page_size: int = 1000) -> Iterator[Dict]:
+    """Yields every live (non-tombstoned) item by paging through a table scan."""
+    exclusive_start_key = None
+    while True:
+        resp = db.scan_metadata(limit=page_size, exclusive_start_key=exclusive_start_key)
+        yield from map(decode_item, resp.get("Items", []))
+        exclusive_start_key = resp.get("LastEvaluatedKey")
+        if not exclusive_start_key:
+            return
+
+def rebuild_indexes(db: DynamoDBService):
+    """Rebuilds every in-process index from one table scan, then snapshots them if configured."""
+    rebuild_all(registered_indexes(), iter_all_images(db))
+    if settings.index_snapshot_dir:
+        save_snapshots(settings.index_snapshot_dir)
+
+def warm_indexes(db: DynamoDBService):
+    """Loads each index from its snapshot when one exists, rebuilding the rest from the table."""
+    cold = [
+        index for index in registered_indexes()
+        if not (settings.index_snapshot_dir and index.load_snapshot(settings.index_snapshot_dir))
+    ]
+    if cold:
+        rebuild_all(cold, iter_all_images(db))
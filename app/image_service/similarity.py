@@ -0,0 +1,139 @@
+"""
+    Perceptual-hash near-duplicate search.
+
+    Uploads get a 64-bit difference hash (dHash) computed from the already
+    decoded image. Re-encoded or resized copies of a picture land within a few
+    bits of each other, so lookalikes are found with a Hamming-distance query
+    on an in-process BK-tree.
+
+    Nodes are never removed and their `children`/`image_ids` are replaced rather
+    than mutated, so a search walks the tree without holding the index lock and
+    never blocks uploads.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+from PIL import Image
+
+from app.image_service.indexes import InMemoryIndex, register_index
+
+log = logging.getLogger(__name__)
+
+HASH_SIZE = 8
+
+def dhash(img: Image.Image) -> str:
+    """Returns the 64-bit difference hash of an image as 16 hex characters."""
+    # BOX averages source pixels, which is both fast and robust for downscaling this far
+    small = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{bits:016x}"
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+class SearchTooBroad(Exception):
+    """Raised when a search would visit more nodes than it is allowed to."""
+
+class BKNode:
+    """
+        A BK-tree node: one hash value, the images that have it, and children keyed by distance.
+        Writers replace `image_ids` and `children` with updated copies, so readers need no lock.
+    """
+    __slots__ = ("value", "image_ids", "children")
+
+    def __init__(self, value: int):
+        self.value = value
+        self.image_ids: List[str] = []
+        self.children: Dict[int, "BKNode"] = {}
+
+class SimilarityState:
+    def __init__(self):
+        self.root: Optional[BKNode] = None
+        self.nodes: Dict[int, BKNode] = {}
+        self.hashes: Dict[str, int] = {}
+
+class SimilarityIndex(InMemoryIndex):
+    """BK-tree over perceptual hashes. Removed images leave their node in place until the next rebuild."""
+    name = "similarity"
+
+    def _new_state(self) -> SimilarityState:
+        return SimilarityState()
+
+    def _insert(self, state: SimilarityState, image_id: str, value: int):
+        node = state.nodes.get(value)
+        if node is None:
+            node = BKNode(value)
+            state.nodes[value] = node
+            if state.root is None:
+                state.root = node
+            else:
+                current = state.root
+                while True:
+                    distance = hamming(current.value, value)
+                    child = current.children.get(distance)
+                    if child is None:
+                        current.children = {**current.children, distance: node}
+                        break
+                    current = child
+        node.image_ids = node.image_ids + [image_id]
+        state.hashes[image_id] = value
+
+    def _apply_add(self, state: SimilarityState, item: Dict[str, Any]):
+        phash = item.get("phash")
+        if phash:
+            self._insert(state, item["image_id"], int(phash, 16))
+
+    def _apply_remove(self, state: SimilarityState, image_id: str):
+        value = state.hashes.pop(image_id, None)
+        if value is not None:
+            node = state.nodes[value]
+            node.image_ids = [i for i in node.image_ids if i != image_id]
+
+    def _dump(self, state: SimilarityState) -> Any:
+        return {"version": self.snapshot_version, "hashes": [[i, f"{v:016x}"] for i, v in state.hashes.items()]}
+
+    def _restore(self, data: Any) -> SimilarityState:
+        state = SimilarityState()
+        for image_id, phash in data["hashes"]:
+            self._insert(state, image_id, int(phash, 16))
+        return state
+
+    def search(
+        self, phash: str, max_distance: int, limit: int = 50, max_visits: Optional[int] = None,
+    ) -> List[Tuple[str, int]]:
+        """
+            Returns (image_id, distance) pairs within `max_distance` bits, closest first.
+            Raises SearchTooBroad once more than `max_visits` nodes have been visited.
+        """
+        target = int(phash, 16)
+        matches: List[Tuple[str, int]] = []
+        with self._lock:
+            root = self._state.root
+        if root is None:
+            return []
+        stack = [root]
+        visited = 0
+        while stack:
+            node = stack.pop()
+            visited += 1
+            if max_visits and visited > max_visits:
+                raise SearchTooBroad(f"search visited more than {max_visits} nodes")
+            distance = hamming(node.value, target)
+            if distance <= max_distance:
+                matches.extend((image_id, distance) for image_id in node.image_ids)
+            # Triangle inequality: only children at distance d ± max_distance can match
+            for child_distance, child in node.children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        matches.sort(key=lambda m: (m[1], m[0]))
+        return matches[:limit]
+
+    def __len__(self):
+        return len(self._state.hashes)
+
+similarity_index = register_index(SimilarityIndex())
@@ -0,0 +1,65 @@
+"""
+    Incremental SVG validation.
+
+    An SVG upload is accepted once its root element has been seen: the bytes are
+    fed to an expat parser in small chunks and parsing stops at the root start
+    tag, so the work done is bounded by the size of the prolog (XML declaration,
+    comments, doctype) rather than by the size of the document. Documents with
+    an internal DTD subset or entity declarations are rejected, which rules out
+    entity-expansion attacks; external DTDs are never fetched.
+"""
+from typing import Dict
+import xml.parsers.expat
+
+from app.exceptions import InvalidImageException
+
+CHUNK_SIZE = 16 * 1024
+
+class _RootFound(Exception):
+    def __init__(self, tag: str, attrib: Dict[str, str]):
+        self.tag = tag
+        self.attrib = attrib
+
+def _reject(detail: str):
+    def handler(*args):
+        raise InvalidImageException(detail)
+    return handler
+
+def _doctype(name, system_id, public_id, has_internal_subset):
+    if has_internal_subset:
+        raise InvalidImageException("SVG files must not declare a DTD internal subset")
+
+def _root(tag: str, attrib: Dict[str, str]):
+    raise _RootFound(tag, attrib)
+
+def svg_root_attributes(data: bytes, max_bytes: int, max_prolog_bytes: int) -> Dict[str, str]:
+    """
+        Checks that `data` is an SVG document and returns the root element's attributes.
+        `max_bytes` bounds the whole payload; the root element must start within the
+        first `max_prolog_bytes` bytes.
+    """
+    if len(data) > max_bytes:
+        raise InvalidImageException(f"SVG file exceeds {max_bytes} bytes")
+
+    parser = xml.parsers.expat.ParserCreate(namespace_separator="}")
+    parser.SetParamEntityParsing(xml.parsers.expat.XML_PARAM_ENTITY_PARSING_NEVER)
+    parser.StartDoctypeDeclHandler = _doctype
+    parser.EntityDeclHandler = _reject("SVG files must not declare entities")
+    parser.UnparsedEntityDeclHandler = _reject("SVG files must not declare entities")
+    parser.ExternalEntityRefHandler = _reject("SVG files must not reference external entities")
+    parser.StartElementHandler = _root
+    try:
+        for start in range(0, min(len(data), max_prolog_bytes), CHUNK_SIZE):
+            parser.Parse(data[start:min(start + CHUNK_SIZE, max_prolog_bytes)], False)
+        if len(data) <= max_prolog_bytes:
+            parser.Parse(b"", True)
+    except _RootFound as root:
+        # Namespaced tags come back as "<namespace>}svg"; any namespace is accepted
+        if root.tag.split("}")[-1].lower() != "svg":
+            raise InvalidImageException("Invalid SVG root element")
+        return root.attrib
+    except xml.parsers.expat.ExpatError:
+        raise InvalidImageException("Invalid SVG file")
+    if len(data) > max_prolog_bytes:
+        raise InvalidImageException(f"SVG root element must start within the first {max_prolog_bytes} bytes")
+    raise InvalidImageException("Invalid SVG file")
@@ -0,0 +1,154 @@
+"""
+    Tag autocomplete.
+
+    An in-process index of tag usage counts, overall and per user. Each scope
+    keeps its tags in a sorted array keyed by the case-folded tag, so the tags
+    starting with a prefix are one contiguous slice found by binary search; the
+    slice is ranked by usage count. Short prefixes match thousands of tags, so
+    the ranked top TOP_K of any prefix matching more than DENSE_PREFIX_MATCHES
+    tags is cached and kept exact as counts change. Queries never touch DynamoDB.
+"""
+from bisect import bisect_left, insort
+from typing import Any, Dict, List, Optional, Tuple
+import heapq
+
+from app.image_service.indexes import InMemoryIndex, register_index
+
+# Most suggestions a query can ask for
+TOP_K = 50
+# Prefixes matching more tags than this get their top TOP_K cached
+DENSE_PREFIX_MATCHES = 256
+
+def _rank(tc: Tuple[str, int]):
+    return (-tc[1], tc[0])
+
+class TagCounts:
+    """Usage counts of the tags in one scope, with a sorted array for prefix lookups."""
+    def __init__(self):
+        self.counts: Dict[str, int] = {}
+        self.keys: List[Tuple[str, str]] = []  # (case-folded tag, tag)
+        self.top: Dict[str, List[Tuple[str, int]]] = {}  # dense prefix -> its top TOP_K, ranked
+
+    def add(self, tag: str):
+        count = self.counts.get(tag, 0)
+        folded = tag.casefold()
+        if count == 0:
+            insort(self.keys, (folded, tag))
+        self.counts[tag] = count + 1
+        # A higher count can only move the tag up, so cached rankings are patched in place
+        for end in range(len(folded) + 1):
+            top = self.top.get(folded[:end])
+            if top is None:
+                continue
+            top[:] = [tc for tc in top if tc[0] != tag]
+            entry = (tag, count + 1)
+            if len(top) < TOP_K or _rank(entry) < _rank(top[-1]):
+                top.append(entry)
+                top.sort(key=_rank)
+                del top[TOP_K:]
+
+    def remove(self, tag: str):
+        count = self.counts.get(tag, 0)
+        if count == 0:
+            return
+        folded = tag.casefold()
+        if count > 1:
+            self.counts[tag] = count - 1
+        else:
+            del self.counts[tag]
+            key = (folded, tag)
+            pos = bisect_left(self.keys, key)
+            if pos < len(self.keys) and self.keys[pos] == key:
+                del self.keys[pos]
+        # A lower count may let a tag outside a cached ranking overtake this one: drop those rankings
+        for end in range(len(folded) + 1):
+            top = self.top.get(folded[:end])
+            if top is not None and any(tc[0] == tag for tc in top):
+                del self.top[folded[:end]]
+
+    def complete(self, prefix: str, limit: int) -> List[Tuple[str, int]]:
+        """Returns up to `limit` (tag, count) pairs starting with `prefix`, most used first."""
+        folded = prefix.casefold()
+        top = self.top.get(folded)
+        if top is not None and limit <= TOP_K:
+            return top[:limit]
+        keys = self.keys
+        matches = []
+        for pos in range(bisect_left(keys, (folded,)), len(keys)):
+            key, tag = keys[pos]
+            if not key.startswith(folded):
+                break
+            matches.append((tag, self.counts[tag]))
+        if len(matches) > DENSE_PREFIX_MATCHES:
+            self.top[folded] = heapq.nsmallest(TOP_K, matches, key=_rank)
+        return heapq.nsmallest(limit, matches, key=_rank)
+
+    def __len__(self):
+        return len(self.counts)
+
+class TagState:
+    """Tag counts overall and per user, plus each image's tags for removals."""
+    def __init__(self):
+        self.docs: Dict[str, Tuple[str, List[str]]] = {}
+        self.all = TagCounts()
+        self.users: Dict[str, TagCounts] = {}
+
+class TagIndex(InMemoryIndex):
+    """Prefix index of tags with usage counts, optionally scoped to a user."""
+    name = "tags"
+
+    def _new_state(self) -> TagState:
+        return TagState()
+
+    def _index_doc(self, state: TagState, image_id: str, user_id: Optional[str], tags: List[str]):
+        if not tags:
+            return
+        state.docs[image_id] = (user_id, tags)
+        user_counts = state.users.setdefault(user_id, TagCounts())
+        for tag in tags:
+            state.all.add(tag)
+            user_counts.add(tag)
+
+    def _apply_add(self, state: TagState, item: Dict[str, Any]):
+        tags = sorted({t for t in (item.get("tags") or []) if t})
+        self._index_doc(state, item["image_id"], item.get("user_id"), tags)
+
+    def _apply_remove(self, state: TagState, image_id: str):
+        doc = state.docs.pop(image_id, None)
+        if doc is None:
+            return
+        user_id, tags = doc
+        user_counts = state.users.get(user_id)
+        for tag in tags:
+            state.all.remove(tag)
+            if user_counts is not None:
+                user_counts.remove(tag)
+        if user_counts is not None and not user_counts:
+            del state.users[user_id]
+
+    def _dump(self, state: TagState) -> Any:
+        # Counts are derived from per-image tags, so only those are stored
+        return {
+            "version": self.snapshot_version,
+            "docs": [[image_id, user_id, tags] for image_id, (user_id, tags) in state.docs.items()],
+        }
+
+    def _restore(self, data: Any) -> TagState:
+        state = TagState()
+        for image_id, user_id, tags in data["docs"]:
+            self._index_doc(state, image_id, user_id, tags)
+        return state
+
+    def autocomplete(self, prefix: str, user_id: Optional[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
+        """Returns the most used tags starting with `prefix` (case-insensitive), optionally among one user's images."""
+        with self._lock:
+            state = self._state
+            counts = state.users.get(user_id) if user_id else state.all
+            if counts is None:
+                return []
+            return [{"tag": tag, "count": count} for tag, count in counts.complete(prefix, limit)]
+
+    def __len__(self):
+        return len(self._state.all)
+
+tag_index = register_index(TagIndex())
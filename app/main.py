@@ -1,14 +1,22 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import asyncio
 import uvicorn
 import logging
+import time
 
 from app.storage.dynamodb import DynamoDBService
 from app.storage.s3 import S3Service
 from app.settings import settings
 from app.routers.image_service import router as image_router
 from app.exceptions import add_exception_handlers
+from app.background import PeriodicTask
+from app.admission import AdmissionMiddleware, build_admission_controller
+from app.metrics import REQUEST_LATENCY, render_latest
+from app.capacity import start_request, end_request, current_usage, finish_request
+from app.image_service.service import purge_deleted_images, warm_indexes, rebuild_indexes, reconcile_user_stats
+from app.image_service.indexes import save_snapshots
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("image-service")
@@ -22,8 +30,47 @@ async def lifespan(app: FastAPI):
     # Initialize resources
     app.state.s3 = S3Service()
     app.state.db = DynamoDBService()
+
+    # Warm the in-process indexes before serving
+    if settings.index_warm_on_startup:
+        try:
+            await asyncio.to_thread(warm_indexes, app.state.db)
+        except Exception:
+            log.exception("Failed to warm in-process indexes")
+
+    # Start background jobs
+    tasks = []
+    if settings.index_rebuild_interval_seconds > 0:
+        tasks.append(PeriodicTask(
+            "index-rebuild",
+            settings.index_rebuild_interval_seconds,
+            lambda: rebuild_indexes(app.state.db),
+        ))
+    if settings.gc_enabled:
+        tasks.append(PeriodicTask(
+            "image-gc",
+            settings.gc_interval_seconds,
+            lambda: purge_deleted_images(
+                app.state.db,
+                app.state.s3,
+                grace_period_seconds=settings.gc_grace_period_seconds,
+                batch_size=settings.gc_batch_size,
+            ),
+        ))
+    if settings.stats_reconcile_interval_seconds > 0:
+        tasks.append(PeriodicTask(
+            "user-stats-reconcile",
+            settings.stats_reconcile_interval_seconds,
+            lambda: reconcile_user_stats(app.state.db),
+        ))
+    for task in tasks:
+        task.start()
     yield
     # Cleanup resources
+    for task in tasks:
+        await task.stop()
+    if settings.index_snapshot_dir:
+        save_snapshots(settings.index_snapshot_dir)
     app.state.s3.close()
     app.state.db.close()
 
@@ -38,6 +85,10 @@ app = FastAPI(
 # Add exception handlers
 add_exception_handlers(app)
 
+# Admission control - Middleware (per-user limits are applied by the image router)
+app.state.admission = build_admission_controller()
+app.add_middleware(AdmissionMiddleware, path_prefix=image_router.prefix)
+
 # CORS - Middleware
 app.add_middleware(
     CORSMiddleware,
@@ -47,6 +98,39 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request metrics - Middleware
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Records request latency labelled by method, route template and status code."""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        REQUEST_LATENCY.labels(
+            method=request.method,
+            route=route.path if route else "unmatched",
+            status=str(status),
+        ).observe(time.perf_counter() - start)
+
+# DynamoDB usage accounting - Middleware
+@app.middleware("http")
+async def account_dynamodb_usage(request: Request, call_next):
+    """Attributes DynamoDB capacity consumed while handling the request to its route (see app.capacity)."""
+    token = start_request()
+    usage = current_usage()
+    try:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        # Streamed bodies are produced later, so their headers only cover work done before streaming
+        finish_request(usage, route.path if route else "unmatched", response.headers)
+        return response
+    finally:
+        end_request(token)
+
 # Add the routers
 app.include_router(image_router)
 
@@ -59,5 +143,15 @@ def read_root():
     """
     return "Image Uploader Service is running."
 
+# Prometheus metrics
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """
+        Prometheus scrape endpoint
+    
+    """
+    body, content_type = render_latest()
+    return Response(content=body, media_type=content_type)
+
 if __name__ == "__main__":
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
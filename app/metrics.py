@@ -0,0 +1,132 @@
+"""
+    Prometheus metrics for the service: HTTP request latency, storage backend
+    call latency, upload sizes, image validation and re-encoding time, and how
+    hot-key lookups were coalesced, hedged reads, circuit breaker state and
+    DynamoDB consumed capacity.
+"""
+from contextlib import contextmanager
+from functools import wraps
+import time
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+REQUEST_LATENCY = Histogram(
+    "image_service_http_request_duration_seconds",
+    "HTTP request latency by route and status code.",
+    ["method", "route", "status"],
+)
+
+BACKEND_LATENCY = Histogram(
+    "image_service_backend_call_duration_seconds",
+    "S3/DynamoDB call latency by operation and outcome.",
+    ["backend", "operation", "outcome"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+BACKEND_ERRORS = Counter(
+    "image_service_backend_errors_total",
+    "S3/DynamoDB calls that raised, by operation and exception type.",
+    ["backend", "operation", "error"],
+)
+
+UPLOAD_BYTES = Histogram(
+    "image_service_upload_bytes",
+    "Size of uploaded image bodies in bytes.",
+    ["content_type"],
+    buckets=(1024, 10 * 1024, 100 * 1024, 512 * 1024, 1024 ** 2, 5 * 1024 ** 2, 10 * 1024 ** 2, 50 * 1024 ** 2),
+)
+
+VALIDATION_LATENCY = Histogram(
+    "image_service_validation_duration_seconds",
+    "Time spent validating uploaded image bytes.",
+    ["content_type", "outcome"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+REENCODE_LATENCY = Histogram(
+    "image_service_reencode_duration_seconds",
+    "Time spent applying the upload re-encoding policy.",
+    ["content_type", "outcome"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+COALESCED_CALLS = Counter(
+    "image_service_coalesced_calls_total",
+    "Coalesced lookups by how they were served: hit (cache), leader (made the backend call) or follower (shared a "
+    "leader's call). Followers that gave up waiting and made the call themselves are also counted as timeout.",
+    ["group", "result"],
+)
+
+HEDGED_READS = Counter(
+    "image_service_hedged_reads_total",
+    "Hedged storage reads: sent, then won (the hedge answered first) or lost.",
+    ["backend", "operation", "result"],
+)
+
+CIRCUIT_STATE = Gauge(
+    "image_service_circuit_breaker_state",
+    "Storage circuit breaker state: 0 closed, 1 open, 2 half-open.",
+    ["backend"],
+)
+
+CIRCUIT_REJECTIONS = Counter(
+    "image_service_circuit_breaker_rejections_total",
+    "Storage calls failed fast because the circuit breaker was open.",
+    ["backend"],
+)
+
+DYNAMODB_CONSUMED_CAPACITY = Counter(
+    "image_service_dynamodb_consumed_capacity_units_total",
+    "DynamoDB capacity units consumed, by table, operation and kind (read/write).",
+    ["table", "operation", "kind"],
+)
+
+DYNAMODB_ITEMS = Counter(
+    "image_service_dynamodb_items_total",
+    "Items read (scanned) and returned after filtering by DynamoDB queries and scans.",
+    ["table", "operation", "stage"],
+)
+
+REQUEST_CONSUMED_CAPACITY = Counter(
+    "image_service_request_consumed_capacity_units_total",
+    "DynamoDB capacity units consumed on behalf of HTTP requests, by route, user (if enabled) and kind.",
+    ["route", "user", "kind"],
+)
+
+REQUEST_SCAN_EFFICIENCY = Histogram(
+    "image_service_request_scan_efficiency_ratio",
+    "Per request, items returned by DynamoDB queries and scans divided by items they read.",
+    ["route"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0),
+)
+
+@contextmanager
+def track(histogram: Histogram, **labels):
+    """Observes the duration of the block on `histogram`, labelled with outcome=success|error."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "success"
+    finally:
+        histogram.labels(outcome=outcome, **labels).observe(time.perf_counter() - start)
+
+def instrumented(backend: str):
+    """Decorator timing a storage service method, labelled by backend and method name."""
+    def decorator(func):
+        operation = func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                with track(BACKEND_LATENCY, backend=backend, operation=operation):
+                    return func(*args, **kwargs)
+            except Exception as e:
+                BACKEND_ERRORS.labels(backend=backend, operation=operation, error=type(e).__name__).inc()
+                raise
+        return wrapper
+    return decorator
+
+def render_latest():
+    """Returns the current metrics in Prometheus text format and its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,167 @@
+"""
+    Opt-in per-request profiling.
+
+    When `profiling_enabled` is set, a request is profiled if it carries the
+    profiling header or is picked by `profiling_sample_rate`. The endpoint call
+    (including work done in the threadpool for sync handlers, and calls async
+    handlers make through this module's `run_in_threadpool`) runs under
+    cProfile and the stats are written as a `.prof` file that snakeviz, tuna or
+    gprof2dot can open. At most one request per worker is profiled at a time and
+    at most `profiling_max_per_minute` per worker, which bounds the overhead.
+"""
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Callable, List, Optional, Sequence
+import asyncio
+import cProfile
+import os
+import pstats
+import random
+import threading
+import uuid
+import logging
+
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool as _run_in_threadpool
+from fastapi.routing import APIRoute
+
+from app.admission import TokenBucket
+from app.settings import settings
+
+log = logging.getLogger(__name__)
+
+_profile_id: ContextVar[Optional[str]] = ContextVar("profile_id", default=None)
+# Profiles of threadpool calls made by the async endpoint being profiled
+_thread_profiles: ContextVar[Optional[List[cProfile.Profile]]] = ContextVar("thread_profiles", default=None)
+_active = threading.Lock()
+_budget: Optional[TokenBucket] = None
+
+def _take_budget() -> bool:
+    """Takes one slot from the per-minute profiling budget."""
+    global _budget
+    limit = settings.profiling_max_per_minute
+    if _budget is None or _budget.burst != limit:
+        _budget = TokenBucket(rate=limit / 60.0, burst=limit)
+    return _budget.try_take() == 0.0
+
+def _should_profile(request: Request) -> bool:
+    if not settings.profiling_enabled:
+        return False
+    requested = request.headers.get(settings.profiling_header, "").lower() in {"1", "true", "yes"}
+    sampled = settings.profiling_sample_rate > 0 and random.random() < settings.profiling_sample_rate
+    return (requested or sampled) and _take_budget()
+
+def _run_profiled(profile_id: str, call: Callable):
+    """Runs `call` under cProfile and dumps the stats. Skips profiling if another profile is active."""
+    if not _active.acquire(blocking=False):
+        return call()
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            return call()
+        finally:
+            profiler.disable()
+    finally:
+        _active.release()
+        _dump(profiler, profile_id)
+
+async def _run_profiled_async(profile_id: str, call: Callable):
+    """Async variant of `_run_profiled`. Other coroutines running on the loop meanwhile are included."""
+    if not _active.acquire(blocking=False):
+        return await call()
+    profiler = cProfile.Profile()
+    thread_profiles: List[cProfile.Profile] = []
+    token = _thread_profiles.set(thread_profiles)
+    try:
+        profiler.enable()
+        try:
+            return await call()
+        finally:
+            profiler.disable()
+    finally:
+        _thread_profiles.reset(token)
+        _active.release()
+        _dump(profiler, profile_id, thread_profiles)
+
+async def run_in_threadpool(func: Callable, *args, **kwargs):
+    """
+        `fastapi.concurrency.run_in_threadpool` for async endpoints: when the request is
+        being profiled, the call is profiled in the worker thread and merged into its profile.
+    """
+    thread_profiles = _thread_profiles.get()
+    if thread_profiles is None:
+        return await _run_in_threadpool(func, *args, **kwargs)
+
+    def call():
+        profiler = cProfile.Profile()
+        thread_profiles.append(profiler)
+        profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+    return await _run_in_threadpool(call)
+
+def profile_path(profile_id: str) -> str:
+    """Returns the file a profile is written to."""
+    return os.path.join(settings.profiling_dir, f"{profile_id}.prof")
+
+def _dump(profiler: cProfile.Profile, profile_id: str, thread_profiles: Sequence[cProfile.Profile] = ()):
+    try:
+        os.makedirs(settings.profiling_dir, exist_ok=True)
+        path = profile_path(profile_id)
+        if thread_profiles:
+            stats = pstats.Stats(profiler)
+            stats.add(*thread_profiles)
+            stats.dump_stats(path)
+        else:
+            profiler.dump_stats(path)
+        log.info("Wrote request profile %s", path)
+    except OSError as e:
+        log.error(f"Failed to write profile {profile_id}: {e}")
+
+def profiled(endpoint: Callable) -> Callable:
+    """Wraps an endpoint so it runs under cProfile when the current request was selected."""
+    if asyncio.iscoroutinefunction(endpoint):
+        @wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            profile_id = _profile_id.get()
+            if profile_id is None:
+                return await endpoint(*args, **kwargs)
+            return await _run_profiled_async(profile_id, lambda: endpoint(*args, **kwargs))
+        return async_wrapper
+
+    @wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        # Sync endpoints run in the threadpool; the context variable is copied into the worker thread
+        profile_id = _profile_id.get()
+        if profile_id is None:
+            return endpoint(*args, **kwargs)
+        return _run_profiled(profile_id, lambda: endpoint(*args, **kwargs))
+    return wrapper
+
+class ProfiledRoute(APIRoute):
+    """APIRoute that profiles selected requests and returns the profile id in `X-Profile-Id`."""
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, profiled(endpoint), **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def profiled_handler(request: Request) -> Response:
+            if not _should_profile(request):
+                return await handler(request)
+            timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+            profile_id = f"{timestamp}-{self.name}-{uuid.uuid4().hex[:8]}"
+            token = _profile_id.set(profile_id)
+            try:
+                response = await handler(request)
+            finally:
+                _profile_id.reset(token)
+            if os.path.exists(profile_path(profile_id)):
+                response.headers["X-Profile-Id"] = profile_id
+            return response
+
+        return profiled_handler
@@ -0,0 +1,272 @@
+"""
+    Resilience for storage calls: circuit breaking, hedged reads and deadlines.
+
+    Every S3/DynamoDB method goes through a per-backend circuit breaker. When
+    the share of backend failures (transport errors, throttling, 5xx) in the
+    last CIRCUIT_BREAKER_WINDOW_SECONDS crosses CIRCUIT_BREAKER_ERROR_RATE,
+    calls fail fast with `CircuitOpenError` for CIRCUIT_BREAKER_OPEN_SECONDS;
+    then a single probe call decides whether the circuit closes again.
+
+    Idempotent point reads are additionally hedged: if the first attempt has
+    not answered after the operation's recent STORAGE_HEDGE_PERCENTILE latency,
+    a second identical request is sent and whichever answers first wins. Hedges
+    are limited to STORAGE_HEDGE_MAX_RATIO of reads so a slow backend is not
+    hit with twice the load, and a hedged read gives up after
+    STORAGE_READ_DEADLINE_SECONDS. Other calls are bounded by the botocore
+    connect/read timeouts and retry attempts from `client_config()`.
+
+    Both error types subclass BotoCoreError, so callers handle them like any
+    other backend failure.
+"""
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import wraps
+from typing import Callable, Dict, Optional, Tuple
+import contextvars
+import threading
+import time
+import logging
+
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+from app.metrics import CIRCUIT_STATE, CIRCUIT_REJECTIONS, HEDGED_READS
+from app.settings import settings
+
+log = logging.getLogger(__name__)
+
+# Error codes that mean the backend is struggling, as opposed to the request being wrong
+BACKEND_ERROR_CODES = {
+    "InternalError",
+    "InternalServerError",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "RequestTimeout",
+    "ServiceUnavailable",
+    "SlowDown",
+    "ThrottlingException",
+}
+LATENCY_SAMPLES = 256
+HEDGE_BUDGET_CAP = 10.0
+
+class CircuitOpenError(BotoCoreError):
+    fmt = "Circuit breaker for {backend} is open; failing fast"
+
+class DeadlineExceededError(BotoCoreError):
+    fmt = "{backend} {operation} did not complete within {deadline}s"
+
+def client_config() -> Config:
+    """botocore client configuration bounding each storage call."""
+    return Config(
+        connect_timeout=settings.storage_connect_timeout_seconds,
+        read_timeout=settings.storage_read_timeout_seconds,
+        retries={"max_attempts": settings.storage_max_attempts, "mode": "standard"},
+    )
+
+def is_backend_failure(error: BaseException) -> bool:
+    """True for errors that indicate an unhealthy backend rather than a rejected request."""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, ClientError):
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        return status >= 500 or error.response.get("Error", {}).get("Code") in BACKEND_ERROR_CODES
+    return isinstance(error, BotoCoreError)
+
+class CircuitBreaker:
+    """Error-rate circuit breaker over one-second buckets. Thread-safe."""
+    CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+
+    def __init__(self, backend: str):
+        self.backend = backend
+        self.state = self.CLOSED
+        self._buckets: "deque[list]" = deque()  # [second, calls, failures]
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: int):
+        self.state = state
+        CIRCUIT_STATE.labels(backend=self.backend).set(state)
+
+    def before_call(self):
+        """Raises CircuitOpenError unless a call may go through now."""
+        if not settings.circuit_breaker_enabled:
+            return
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= settings.circuit_breaker_open_seconds:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+        CIRCUIT_REJECTIONS.labels(backend=self.backend).inc()
+        raise CircuitOpenError(backend=self.backend)
+
+    def record(self, failed: bool):
+        """Records the outcome of a call that went through."""
+        if not settings.circuit_breaker_enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+                if failed:
+                    self._trip(now)
+                else:
+                    self._buckets.clear()
+                    self._set_state(self.CLOSED)
+                    log.info("Circuit breaker for %s closed", self.backend)
+                return
+            second = int(now)
+            if not self._buckets or self._buckets[-1][0] != second:
+                self._buckets.append([second, 0, 0])
+            self._buckets[-1][1] += 1
+            self._buckets[-1][2] += failed
+            while self._buckets and self._buckets[0][0] <= second - settings.circuit_breaker_window_seconds:
+                self._buckets.popleft()
+            if not failed or self.state != self.CLOSED:
+                return
+            calls = sum(b[1] for b in self._buckets)
+            failures = sum(b[2] for b in self._buckets)
+            if calls >= settings.circuit_breaker_min_calls and failures / calls >= settings.circuit_breaker_error_rate:
+                self._trip(now)
+
+    def _trip(self, now: float):
+        self._opened_at = now
+        self._buckets.clear()
+        self._set_state(self.OPEN)
+        log.warning("Circuit breaker for %s opened for %ss", self.backend, settings.circuit_breaker_open_seconds)
+
+class LatencyTracker:
+    """Recent successful attempt latencies of one operation, plus its hedge budget."""
+    def __init__(self):
+        self._samples: "deque[float]" = deque(maxlen=LATENCY_SAMPLES)
+        self._threshold: Optional[float] = None
+        self._budget = 1.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            # Recomputing the percentile every few samples keeps the read path cheap
+            if self._threshold is None or len(self._samples) % 16 == 0:
+                ordered = sorted(self._samples)
+                index = min(len(ordered) - 1, int(len(ordered) * settings.storage_hedge_percentile / 100))
+                self._threshold = ordered[index]
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait for the first attempt before hedging."""
+        with self._lock:
+            threshold = self._threshold if self._threshold is not None else settings.storage_hedge_initial_delay_seconds
+        return max(threshold, settings.storage_hedge_min_delay_seconds)
+
+    def credit(self):
+        """Every read earns STORAGE_HEDGE_MAX_RATIO of a hedge."""
+        with self._lock:
+            self._budget = min(HEDGE_BUDGET_CAP, self._budget + settings.storage_hedge_max_ratio)
+
+    def try_hedge(self) -> bool:
+        with self._lock:
+            if self._budget < 1.0:
+                return False
+            self._budget -= 1.0
+            return True
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_trackers: Dict[Tuple[str, str], LatencyTracker] = {}
+_registry_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+def breaker(backend: str) -> CircuitBreaker:
+    with _registry_lock:
+        if backend not in _breakers:
+            _breakers[backend] = CircuitBreaker(backend)
+        return _breakers[backend]
+
+def _tracker(backend: str, operation: str) -> LatencyTracker:
+    with _registry_lock:
+        key = (backend, operation)
+        if key not in _trackers:
+            _trackers[key] = LatencyTracker()
+        return _trackers[key]
+
+def _hedge_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _registry_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.storage_hedge_max_workers, thread_name_prefix="storage-read")
+        return _executor
+
+def _hedged_call(backend: str, operation: str, call: Callable[[], object]):
+    tracker = _tracker(backend, operation)
+    tracker.credit()
+
+    def attempt():
+        start = time.perf_counter()
+        result = call()
+        tracker.observe(time.perf_counter() - start)
+        return result
+
+    def submit():
+        # Each attempt runs in its own copy of the caller's context (request-scoped contextvars)
+        return _hedge_executor().submit(contextvars.copy_context().run, attempt)
+
+    deadline = settings.storage_read_deadline_seconds
+    deadline_at = time.monotonic() + deadline if deadline > 0 else None
+
+    def remaining() -> Optional[float]:
+        return None if deadline_at is None else max(0.0, deadline_at - time.monotonic())
+
+    primary = submit()
+    delay = tracker.hedge_delay()
+    left = remaining()
+    done, _ = wait([primary], timeout=delay if left is None else min(delay, left))
+    pending = {primary}
+    hedge = None
+    if not done and settings.storage_hedge_max_ratio > 0 and tracker.try_hedge():
+        HEDGED_READS.labels(backend=backend, operation=operation, result="sent").inc()
+        hedge = submit()
+        pending.add(hedge)
+
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, timeout=remaining(), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            if future.exception() is None:
+                if hedge is not None:
+                    HEDGED_READS.labels(
+                        backend=backend, operation=operation, result="won" if future is hedge else "lost",
+                    ).inc()
+                return future.result()
+            error = future.exception()
+    if error is not None and not pending:
+        raise error
+    raise DeadlineExceededError(backend=backend, operation=operation, deadline=deadline)
+
+def resilient(backend: str, hedged: bool = False):
+    """
+        Decorator guarding a storage service method with the backend's circuit breaker.
+        `hedged=True` marks idempotent reads, which are also hedged and bounded by the read deadline.
+    """
+    def decorator(func):
+        operation = func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            circuit = breaker(backend)
+            circuit.before_call()
+            try:
+                if hedged:
+                    result = _hedged_call(backend, operation, lambda: func(*args, **kwargs))
+                else:
+                    result = func(*args, **kwargs)
+            except Exception as e:
+                circuit.record(is_backend_failure(e))
+                raise
+            circuit.record(False)
+            return result
+        return wrapper
+    return decorator
@@ -1,26 +1,44 @@
-from fastapi import APIRouter, Depends, UploadFile, File, Form, Query, Response
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, UploadFile, File, Form, Header, Query, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from datetime import datetime
+from decimal import Decimal
 from typing import Optional
 from io import BytesIO
 import logging
 from PIL import Image
-import xml.etree.ElementTree as ET
 from botocore.exceptions import BotoCoreError, ClientError
 
 from app.storage.dynamodb import DynamoDBService
 from app.storage.s3 import S3Service
-from app.dependencies.dependencies import get_s3_service, get_dynamodb_service
-from app.image_service.service import save_image_and_meta, fetch_images, get_image_meta, remove_image
-from app.image_service.models import ImageItem, UploadResponse, ListImagesResponse
+from app.dependencies.dependencies import (
+    get_s3_service, get_dynamodb_service, enforce_user_rate_limit, attribute_dynamodb_usage,
+)
+from app.image_service.service import save_image_and_meta, fetch_images, get_image_meta, remove_image, as_utc, get_user_stats
+from app.image_service.models import (
+    ImageInfo, ImageItem, UploadResponse, ListImagesResponse, SearchHit, SearchResponse,
+    SimilarImage, SimilarImagesResponse, UserStatsResponse, TagSuggestion, TagSuggestionsResponse,
+)
+from app.image_service.search import search_index
+from app.image_service.tags import tag_index
+from app.image_service.export import iter_export_items, ndjson_lines, gzip_chunks
+from app.image_service.similarity import SearchTooBroad, dhash, similarity_index
+from app.image_service.attributes import raster_attributes, svg_attributes
+from app.image_service.svg import svg_root_attributes
+from app.image_service.reencode import apply_upload_policy, stored_filename
 from app.exceptions import InvalidImageException, ImageNotFoundException, S3UploadException
 from app.settings import settings
+from app.metrics import track, VALIDATION_LATENCY, UPLOAD_BYTES
+from app.profiling import ProfiledRoute, run_in_threadpool
+from app.idempotency import IdempotentRequest, IDEMPOTENCY_HEADER, fingerprint
 
 log = logging.getLogger(__name__)
 
 router = APIRouter(
     prefix="/images",
-    tags=["image-uploader-service"]
+    tags=["image-uploader-service"],
+    dependencies=[Depends(attribute_dynamodb_usage)],
+    route_class=ProfiledRoute
 )
 
 # Allowed content types
@@ -34,49 +52,75 @@ ALLOWED_IMAGE_TYPES = {
 
 def validate_image_bytes(file_bytes: bytes, content_type: str) -> str:
     """Validate that the uploaded file is a real image."""
-    if content_type in {"image/png", "image/jpeg", "image/gif", "image/webp"}:
-        try:
-            img = Image.open(BytesIO(file_bytes))
-            img.load()
-            MIME_MAP = {
-                "JPEG": "image/jpeg",
-                "PNG": "image/png",
-                "GIF": "image/gif",
-                "WEBP": "image/webp",
-            }
-            mime_type = MIME_MAP.get(img.format.upper())
-            if mime_type not in ALLOWED_IMAGE_TYPES:
-                raise InvalidImageException(f"Unsupported image type: {mime_type}")
-            return mime_type
-        except Exception:
-            raise InvalidImageException("Invalid image file")
-    elif content_type == "image/svg+xml":
-        try:
-            root = ET.fromstring(file_bytes.decode("utf-8"))
-            # Check if root tag is svg (with or without namespace)
-            tag_name = root.tag.split("}")[-1].lower() if "}" in root.tag else root.tag.lower()
-            if tag_name == "svg":
-                return "image/svg+xml"
-            raise InvalidImageException("Invalid SVG root element")
-        except InvalidImageException:
-            raise
-        except Exception:
-            raise InvalidImageException("Invalid SVG file")
-    else:
-        raise InvalidImageException(f"Unsupported content type: {content_type}")
+    return inspect_image_bytes(file_bytes, content_type).content_type
+
+def inspect_image_bytes(file_bytes: bytes, content_type: str) -> ImageInfo:
+    """Validates the uploaded bytes and extracts attributes while the image is open."""
+    with track(VALIDATION_LATENCY, content_type=content_type):
+        if content_type in {"image/png", "image/jpeg", "image/gif", "image/webp"}:
+            try:
+                img = Image.open(BytesIO(file_bytes))
+                img.load()
+                MIME_MAP = {
+                    "JPEG": "image/jpeg",
+                    "PNG": "image/png",
+                    "GIF": "image/gif",
+                    "WEBP": "image/webp",
+                }
+                mime_type = MIME_MAP.get(img.format.upper())
+                if mime_type not in ALLOWED_IMAGE_TYPES:
+                    raise InvalidImageException(f"Unsupported image type: {mime_type}")
+                return ImageInfo(content_type=mime_type, phash=dhash(img), **raster_attributes(img))
+            except Exception:
+                raise InvalidImageException("Invalid image file")
+        elif content_type == "image/svg+xml":
+            # Parses only up to the root element, with DTD/entity declarations rejected
+            attrib = svg_root_attributes(
+                file_bytes, max_bytes=settings.svg_max_bytes, max_prolog_bytes=settings.svg_max_prolog_bytes,
+            )
+            return ImageInfo(content_type="image/svg+xml", **svg_attributes(attrib))
+        else:
+            raise InvalidImageException(f"Unsupported content type: {content_type}")
 
-@router.post("", response_model=UploadResponse, status_code=201)
+def to_image_item(it) -> ImageItem:
+    """Converts a DynamoDB metadata item to the API model."""
+    return ImageItem(
+        image_id=it["image_id"],
+        user_id=it["user_id"],
+        title=it.get("title"),
+        description=it.get("description"),
+        tags=it.get("tags", []),
+        filename=it.get("filename"),
+        content_type=it.get("content_type"),
+        size=int(it.get("size", 0)),
+        s3_key=it["s3_key"],
+        uploaded_at=datetime.fromisoformat(it["uploaded_at"]),
+        original_size=int(it["original_size"]) if it.get("original_size") is not None else None,
+        original_content_type=it.get("original_content_type"),
+        phash=it.get("phash"),
+        width=int(it["width"]) if it.get("width") is not None else None,
+        height=int(it["height"]) if it.get("height") is not None else None,
+        frame_count=int(it["frame_count"]) if it.get("frame_count") is not None else None,
+        orientation=it.get("orientation"),
+        exif=it.get("exif"),
+    )
+
+@router.post("", response_model=UploadResponse, status_code=201, dependencies=[Depends(enforce_user_rate_limit)])
 async def upload_image(
     file: UploadFile = File(...),
     user_id: str = Form(...),
     title: Optional[str] = Form(None),
     description: Optional[str] = Form(None),
     tags: Optional[str] = Form(None),  # Comma Separated Values
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER, min_length=1, max_length=255),
     response: Response = None,
     db: DynamoDBService = Depends(get_dynamodb_service),
     s3: S3Service = Depends(get_s3_service)
 ):
-    """Uploads an image and its metadata with content-type verification."""
+    """
+        Uploads an image and its metadata with content-type verification.
+        With an Idempotency-Key, a retried upload returns the original response.
+    """
     # Add security header
     if response:
         response.headers["X-Content-Type-Options"] = "nosniff"
@@ -90,28 +134,58 @@ async def upload_image(
     contents = await file.read()
     fileobj = BytesIO(contents)
 
-    # Validate actual file content
-    content_type = validate_image_bytes(contents, file.content_type)
+    idempotent = None
+    if idempotency_key:
+        idempotent = IdempotentRequest(
+            db, f"upload#{user_id}", idempotency_key,
+            fingerprint(title, description, tags_list, file.filename, file.content_type, contents),
+        )
+        replayed = await run_in_threadpool(idempotent.begin)
+        if replayed:
+            replay = replayed.to_response()
+            replay.headers["X-Content-Type-Options"] = "nosniff"
+            return replay
 
-    image = save_image_and_meta(
-        db=db,
-        s3=s3,
-        fileobj=fileobj,
-        filename=file.filename,
-        content_type=content_type,
-        size=len(contents),
-        user_id=user_id,
-        title=title,
-        description=description,
-        tags=tags_list
-    )
-    return UploadResponse(
+    try:
+        # Validate actual file content (Pillow decode, dHash and EXIF, so off the event loop)
+        info = await run_in_threadpool(inspect_image_bytes, contents, file.content_type)
+        UPLOAD_BYTES.labels(content_type=info.content_type).observe(len(contents))
+
+        # Upload policy: possibly re-encode to a smaller format (CPU bound, so off the event loop)
+        stored_bytes, stored_info = await run_in_threadpool(apply_upload_policy, contents, info)
+        reencoded = stored_bytes is not contents
+
+        # S3 and DynamoDB writes plus index updates are blocking calls
+        image = await run_in_threadpool(
+            save_image_and_meta,
+            db=db,
+            s3=s3,
+            fileobj=BytesIO(stored_bytes) if reencoded else fileobj,
+            filename=stored_filename(file.filename, stored_info.content_type) if reencoded else file.filename,
+            content_type=stored_info.content_type,
+            size=len(stored_bytes),
+            user_id=user_id,
+            title=title,
+            description=description,
+            tags=tags_list,
+            info=stored_info,
+            original_size=len(contents) if reencoded else None,
+            original_content_type=info.content_type if reencoded else None,
+        )
+    except Exception:
+        if idempotent:
+            await run_in_threadpool(idempotent.release)
+        raise
+    result = UploadResponse(
         image_id=image.image_id,
         user_id=image.user_id,
         s3_key=image.s3_key,
         filename=image.filename,
         uploaded_at=image.uploaded_at,
     )
+    if idempotent:
+        await run_in_threadpool(idempotent.complete, 201, jsonable_encoder(result))
+    return result
 
 @router.get("", response_model=ListImagesResponse)
 def list_images_handler(
@@ -119,9 +193,19 @@ def list_images_handler(
     tag: Optional[str] = Query(None),
     limit: int = Query(50, ge=1, le=100),
     exclusive_start_key: Optional[str] = Query(None),
+    since: Optional[datetime] = Query(None, description="Only images uploaded at or after this time"),
+    until: Optional[datetime] = Query(None, description="Only images uploaded at or before this time"),
+    order: Optional[str] = Query(None, pattern="^(asc|desc)$", description="Sort by upload time (default desc when a time range is given)"),
+    min_width: Optional[int] = Query(None, ge=1),
+    min_height: Optional[int] = Query(None, ge=1),
+    orientation: Optional[str] = Query(None, pattern="^(landscape|portrait|square)$"),
     db: DynamoDBService = Depends(get_dynamodb_service)
 ):
     """Lists images with optional filters."""
+    since = as_utc(since) if since else None
+    until = as_utc(until) if until else None
+    if since and until and since > until:
+        raise InvalidImageException("since must not be after until")
     eks = None
     if exclusive_start_key:
         import json
@@ -130,28 +214,78 @@ def list_images_handler(
         except Exception:
             raise InvalidImageException("invalid exclusive_start_key")
 
-    resp = fetch_images(db=db, user_id=user_id, tag=tag, limit=limit, exclusive_start_key=eks)
+    resp = fetch_images(
+        db=db, user_id=user_id, tag=tag, limit=limit, exclusive_start_key=eks,
+        since=since, until=until, order=order,
+        min_width=min_width, min_height=min_height, orientation=orientation,
+    )
     items = resp.get("Items", [])
 
-    def to_item(it):
-        return ImageItem(
-            image_id=it["image_id"],
-            user_id=it["user_id"],
-            title=it.get("title"),
-            description=it.get("description"),
-            tags=it.get("tags", []),
-            filename=it.get("filename"),
-            content_type=it.get("content_type"),
-            size=int(it.get("size", 0)),
-            s3_key=it["s3_key"],
-            uploaded_at=datetime.fromisoformat(it["uploaded_at"]),
-        )
-
-    images = [to_item(it) for it in items]
+    images = [to_image_item(it) for it in items]
     next_token = resp.get("LastEvaluatedKey")
 
     import json
-    return ListImagesResponse(images=images, next_token=json.dumps(next_token) if next_token else None)
+    # Index keys contain numbers, which boto3 returns as Decimal
+    def encode_key(value):
+        if isinstance(value, Decimal):
+            return int(value)
+        raise TypeError(f"Unserializable key value: {value!r}")
+
+    return ListImagesResponse(images=images, next_token=json.dumps(next_token, default=encode_key) if next_token else None)
+
+@router.get("/export", response_class=StreamingResponse)
+def export_images(
+    user_id: Optional[str] = Query(None),
+    gzip: bool = Query(False, description="Compress the NDJSON stream with gzip"),
+    db: DynamoDBService = Depends(get_dynamodb_service)
+):
+    """
+        Streams all image metadata as NDJSON, one image per line, in no particular order.
+        The table is read with a parallel scan that only runs ahead of the client by a bounded buffer.
+    """
+    items = iter_export_items(
+        db,
+        user_id=user_id,
+        total_segments=settings.export_scan_segments,
+        page_size=settings.export_page_size,
+        buffered_pages=settings.export_buffered_pages,
+    )
+    body = ndjson_lines(items, lambda it: to_image_item(it).model_dump_json())
+    if gzip:
+        return StreamingResponse(
+            gzip_chunks(body),
+            media_type="application/gzip",
+            headers={"Content-Disposition": 'attachment; filename="images.ndjson.gz"'},
+        )
+    return StreamingResponse(body, media_type="application/x-ndjson")
+
+@router.get("/search", response_model=SearchResponse)
+def search_images(
+    q: str = Query(..., min_length=1, max_length=256),
+    user_id: Optional[str] = Query(None),
+    limit: int = Query(10, ge=1, le=100)
+):
+    """Full-text search over titles, descriptions and tags, served from the in-process index."""
+    hits = search_index.search(q, user_id=user_id, limit=limit)
+    return SearchResponse(results=[SearchHit(**hit) for hit in hits])
+
+@router.get("/tags/autocomplete", response_model=TagSuggestionsResponse)
+def autocomplete_tags(
+    prefix: str = Query(..., min_length=1, max_length=128),
+    user_id: Optional[str] = Query(None),
+    limit: int = Query(10, ge=1, le=50)
+):
+    """Suggests the most used tags starting with `prefix`, served from the in-process index."""
+    suggestions = tag_index.autocomplete(prefix, user_id=user_id, limit=limit)
+    return TagSuggestionsResponse(prefix=prefix, suggestions=[TagSuggestion(**s) for s in suggestions])
+
+@router.get("/users/{user_id}/stats", response_model=UserStatsResponse)
+def get_usage_stats(
+    user_id: str,
+    db: DynamoDBService = Depends(get_dynamodb_service)
+):
+    """Returns a user's image count and stored bytes, read from their aggregate item."""
+    return UserStatsResponse(**get_user_stats(db, user_id))
 
 @router.get("/{image_id}", response_model=ImageItem)
 def get_image(
@@ -164,18 +298,29 @@ def get_image(
     if not meta:
         raise ImageNotFoundException(image_id)
 
-    return ImageItem(
-        image_id=meta["image_id"],
-        user_id=meta["user_id"],
-        title=meta.get("title"),
-        description=meta.get("description"),
-        tags=meta.get("tags", []),
-        filename=meta["filename"],
-        content_type=meta["content_type"],
-        size=int(meta.get("size", 0)),
-        s3_key=meta["s3_key"],
-        uploaded_at=datetime.fromisoformat(meta["uploaded_at"]),
-    )
+    return to_image_item(meta)
+
+@router.get("/{image_id}/similar", response_model=SimilarImagesResponse)
+def get_similar_images(
+    image_id: str,
+    max_distance: int = Query(8, ge=0, le=12, description="Maximum Hamming distance between perceptual hashes"),
+    limit: int = Query(50, ge=1, le=500),
+    db: DynamoDBService = Depends(get_dynamodb_service)
+):
+    """Finds near-duplicates of an image by perceptual-hash Hamming distance."""
+    meta = get_image_meta(db, image_id)
+    if not meta.get("phash"):
+        raise InvalidImageException("Image has no perceptual hash")
+
+    try:
+        matches = similarity_index.search(
+            meta["phash"], max_distance=max_distance, limit=limit + 1,
+            max_visits=settings.similarity_max_visited_nodes,
+        )
+    except SearchTooBroad:
+        raise InvalidImageException(f"max_distance {max_distance} matches too much of the index; use a smaller one")
+    results = [SimilarImage(image_id=i, distance=d) for i, d in matches if i != image_id][:limit]
+    return SimilarImagesResponse(image_id=image_id, phash=meta["phash"], results=results)
 
 @router.get("/{image_id}/download", response_model=dict)
 def get_presigned_url(
@@ -213,9 +358,26 @@ def get_presigned_url(
 @router.delete("/{image_id}", status_code=204)
 def delete_image(
     image_id: str,
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER, min_length=1, max_length=255),
     db: DynamoDBService = Depends(get_dynamodb_service),
     s3: S3Service = Depends(get_s3_service)
 ):
-    """Deletes an image and its metadata."""
-    remove_image(db, s3, image_id)
+    """
+        Deletes an image and its metadata.
+        With an Idempotency-Key, a retried delete returns 204 instead of 404.
+    """
+    if not idempotency_key:
+        remove_image(db, s3, image_id)
+        return JSONResponse(status_code=204, content=None)
+
+    idempotent = IdempotentRequest(db, f"delete#{image_id}", idempotency_key, fingerprint(image_id))
+    replayed = idempotent.begin()
+    if replayed:
+        return replayed.to_response()
+    try:
+        remove_image(db, s3, image_id)
+    except Exception:
+        idempotent.release()
+        raise
+    idempotent.complete(204)
     return JSONResponse(status_code=204, content=None)
@@ -1,14 +1,42 @@
 from pydantic_settings import BaseSettings
 from pydantic import Field
-from typing import Optional
+from typing import Literal, Optional
 
 class Settings(BaseSettings):
     aws_region: str = Field("us-east-1", env="AWS_REGION")
     s3_bucket: str = Field("image-service-bucket", env="S3_BUCKET")
     dynamodb_table: str = Field("Images", env="DYNAMODB_TABLE")
+    user_stats_table: str = Field("ImageUserStats", env="USER_STATS_TABLE")
+    idempotency_table: str = Field("ImageIdempotencyKeys", env="IDEMPOTENCY_TABLE")
     aws_endpoint_url: Optional[str] = Field(None, env="AWS_ENDPOINT_URL")
     external_endpoint: Optional[str] = Field(None, env="AWS_EXTERNAL_ENDPOINT_URL")  # for presigned URLs
     presign_expire_seconds: int = Field(900, env="PRESIGN_EXPIRE_SECONDS")
+    # S3 key layout for new objects: "legacy" ({user_id}/{day}/...) or "hashed", which
+    # prepends S3_KEY_HASH_CHARS (1-32) hex digits to spread load over prefixes.
+    # Both are validated when the settings load, so a typo fails startup rather than uploads
+    s3_key_layout: Literal["legacy", "hashed"] = Field("legacy", env="S3_KEY_LAYOUT")
+    s3_key_hash_chars: int = Field(2, ge=1, le=32, env="S3_KEY_HASH_CHARS")
+
+    # Storage call bounds: botocore timeouts and attempts for every call, plus an overall
+    # deadline for hedged point reads (0 disables it)
+    storage_connect_timeout_seconds: float = Field(2.0, env="STORAGE_CONNECT_TIMEOUT_SECONDS")
+    storage_read_timeout_seconds: float = Field(5.0, env="STORAGE_READ_TIMEOUT_SECONDS")
+    storage_max_attempts: int = Field(3, env="STORAGE_MAX_ATTEMPTS")
+    storage_read_deadline_seconds: float = Field(5.0, env="STORAGE_READ_DEADLINE_SECONDS")
+    # Hedged reads: a second request is sent once the first has taken longer than the
+    # operation's recent latency percentile, for at most STORAGE_HEDGE_MAX_RATIO of reads (0 disables)
+    storage_hedge_percentile: float = Field(95.0, env="STORAGE_HEDGE_PERCENTILE")
+    storage_hedge_initial_delay_seconds: float = Field(0.05, env="STORAGE_HEDGE_INITIAL_DELAY_SECONDS")
+    storage_hedge_min_delay_seconds: float = Field(0.005, env="STORAGE_HEDGE_MIN_DELAY_SECONDS")
+    storage_hedge_max_ratio: float = Field(0.05, env="STORAGE_HEDGE_MAX_RATIO")
+    storage_hedge_max_workers: int = Field(32, env="STORAGE_HEDGE_MAX_WORKERS")
+    # Per-backend circuit breaker: opens when at least ERROR_RATE of the calls in the window
+    # (and MIN_CALLS of them) failed, then fails fast for OPEN_SECONDS before probing again
+    circuit_breaker_enabled: bool = Field(True, env="CIRCUIT_BREAKER_ENABLED")
+    circuit_breaker_error_rate: float = Field(0.5, env="CIRCUIT_BREAKER_ERROR_RATE")
+    circuit_breaker_min_calls: int = Field(20, env="CIRCUIT_BREAKER_MIN_CALLS")
+    circuit_breaker_window_seconds: int = Field(10, env="CIRCUIT_BREAKER_WINDOW_SECONDS")
+    circuit_breaker_open_seconds: float = Field(5.0, env="CIRCUIT_BREAKER_OPEN_SECONDS")
 
     aws_access_key_id: str = Field("test", env="AWS_ACCESS_KEY_ID")
     aws_secret_access_key: str = Field("test", env="AWS_SECRET_ACCESS_KEY")
@@ -16,6 +44,84 @@ class Settings(BaseSettings):
     # 👇 this was missing
     app_title: str = Field("Image Service", env="APP_TITLE")
 
+    # Time-range listing: global queries without `since` look back this many days
+    list_max_lookback_days: int = Field(30, env="LIST_MAX_LOOKBACK_DAYS")
+
+    # In-process indexes (search, ...): warmed at startup from a snapshot or a table scan
+    index_warm_on_startup: bool = Field(True, env="INDEX_WARM_ON_STARTUP")
+    index_snapshot_dir: Optional[str] = Field(None, env="INDEX_SNAPSHOT_DIR")
+    index_rebuild_interval_seconds: int = Field(3600, env="INDEX_REBUILD_INTERVAL_SECONDS")  # 0 disables
+
+    # Upload policy, applied after validation: re-encode rasters to a smaller format
+    # ("webp", or empty to keep the format) and/or strip EXIF/ICC/text metadata.
+    # The re-encoded version is stored only when it is smaller than the original.
+    upload_reencode_format: Optional[str] = Field(None, env="UPLOAD_REENCODE_FORMAT")
+    upload_reencode_lossless: bool = Field(False, env="UPLOAD_REENCODE_LOSSLESS")
+    upload_reencode_quality: int = Field(80, env="UPLOAD_REENCODE_QUALITY")
+    upload_strip_metadata: bool = Field(False, env="UPLOAD_STRIP_METADATA")
+
+    # SVG validation limits: total size, and how far into the file the root element must start
+    svg_max_bytes: int = Field(10 * 1024 * 1024, env="SVG_MAX_BYTES")
+    svg_max_prolog_bytes: int = Field(64 * 1024, env="SVG_MAX_PROLOG_BYTES")
+
+    # Metadata item storage encoding: "legacy" or "compact" (short names, string-set tags,
+    # compressed long descriptions). Items in either encoding are always readable by
+    # releases that know "compact"; switch once no older workers are left running.
+    metadata_encoding: Literal["legacy", "compact"] = Field("legacy", env="METADATA_ENCODING")
+    metadata_compress_min_bytes: int = Field(256, env="METADATA_COMPRESS_MIN_BYTES")
+
+    # Concurrent metadata lookups of the same image always share one DynamoDB read.
+    # A positive TTL also caches found items in-process for that long (0 disables caching)
+    metadata_cache_ttl_seconds: float = Field(0.0, env="METADATA_CACHE_TTL_SECONDS")
+    metadata_cache_max_entries: int = Field(10000, env="METADATA_CACHE_MAX_ENTRIES")
+
+    # Idempotency-Key handling: how long results are replayable, how long a claim is held
+    # by an in-flight request, and how long a concurrent duplicate waits for its result
+    idempotency_ttl_seconds: int = Field(24 * 3600, env="IDEMPOTENCY_TTL_SECONDS")
+    idempotency_lease_seconds: int = Field(60, env="IDEMPOTENCY_LEASE_SECONDS")
+    idempotency_wait_seconds: float = Field(10.0, env="IDEMPOTENCY_WAIT_SECONDS")
+
+    # Near-duplicate search: BK-tree nodes one /similar query may visit before it is
+    # rejected as too broad (0 disables the limit)
+    similarity_max_visited_nodes: int = Field(50000, env="SIMILARITY_MAX_VISITED_NODES")
+
+    # Per-user usage statistics: drift reconciliation job (0 disables)
+    stats_reconcile_interval_seconds: int = Field(0, env="STATS_RECONCILE_INTERVAL_SECONDS")
+
+    # Soft delete / background garbage collection
+    gc_enabled: bool = Field(True, env="GC_ENABLED")
+    gc_interval_seconds: int = Field(60, env="GC_INTERVAL_SECONDS")
+    gc_batch_size: int = Field(100, env="GC_BATCH_SIZE")  # max images purged per run
+    gc_grace_period_seconds: int = Field(3600, env="GC_GRACE_PERIOD_SECONDS")
+
+    # Admission control / load shedding (per worker)
+    admission_enabled: bool = Field(True, env="ADMISSION_ENABLED")
+    max_concurrent_requests: int = Field(64, env="MAX_CONCURRENT_REQUESTS")
+    max_inflight_upload_bytes: int = Field(256 * 1024 * 1024, env="MAX_INFLIGHT_UPLOAD_BYTES")
+    user_rate_limit_per_second: float = Field(10.0, env="USER_RATE_LIMIT_PER_SECOND")
+    user_rate_limit_burst: int = Field(20, env="USER_RATE_LIMIT_BURST")
+    admission_retry_after_seconds: int = Field(1, env="ADMISSION_RETRY_AFTER_SECONDS")
+
+    # Opt-in profiling (cProfile .prof files, viewable with snakeviz/tuna/gprof2dot)
+    profiling_enabled: bool = Field(False, env="PROFILING_ENABLED")
+    profiling_header: str = Field("X-Profile", env="PROFILING_HEADER")
+    profiling_sample_rate: float = Field(0.0, env="PROFILING_SAMPLE_RATE")
+    profiling_dir: str = Field("/tmp/image-service-profiles", env="PROFILING_DIR")
+    profiling_max_per_minute: int = Field(6, env="PROFILING_MAX_PER_MINUTE")  # caps overhead
+
+    # Metadata export: parallel scan segments and pages buffered ahead of the client
+    export_scan_segments: int = Field(4, env="EXPORT_SCAN_SEGMENTS")
+    export_page_size: int = Field(500, env="EXPORT_PAGE_SIZE")
+    export_buffered_pages: int = Field(8, env="EXPORT_BUFFERED_PAGES")
+
+    # DynamoDB usage accounting: X-DynamoDB-* response headers, a per-user label on the
+    # request capacity metric (one series per user), and a warning for requests whose
+    # queries/scans read at least WARN_MIN_SCANNED items but returned under WARN_RATIO of them
+    capacity_headers_enabled: bool = Field(True, env="CAPACITY_HEADERS_ENABLED")
+    capacity_metrics_per_user: bool = Field(False, env="CAPACITY_METRICS_PER_USER")
+    scan_efficiency_warn_ratio: float = Field(0.1, env="SCAN_EFFICIENCY_WARN_RATIO")
+    scan_efficiency_warn_min_scanned: int = Field(100, env="SCAN_EFFICIENCY_WARN_MIN_SCANNED")
+
     class Config:
         env_file = ".env"
         extra = "allow"  # tolerate unknown vars if needed
@@ -1,11 +1,27 @@
 import boto3
-from typing import Optional, Dict, Any
+import time
+from typing import Optional, Dict, Any, List, Tuple
+from boto3.dynamodb.conditions import Attr, Key
 from botocore.exceptions import ClientError
 from app.settings import settings
+from app.metrics import instrumented
+from app.resilience import client_config, resilient
+from app.capacity import RETURN_CONSUMED_CAPACITY, record as record_capacity
 import logging
 
 log = logging.getLogger(__name__)
 
+TOMBSTONE_INDEX = "TombstoneIndex"
+TOMBSTONE_VALUE = "1"
+# uploaded_ts (epoch microseconds) is the sort key of the time-ordered indexes
+USER_TIME_INDEX = "UserTimeIndex"
+UPLOAD_DAY_INDEX = "UploadDayIndex"
+# Per-content-type attribute prefixes on user stats items (ADD only works on top-level attributes)
+STATS_COUNT_PREFIX = "count:"
+STATS_BYTES_PREFIX = "bytes:"
+# Bumped by every stats update, so reconciliation can tell whether an item changed after it was read
+STATS_VERSION = "version"
+
 # -------------------------
 # DynamoDB Service
 # -------------------------
@@ -21,6 +37,7 @@ class DynamoDBService:
         # Only set endpoint_url if not in test mode (moto will handle it)
         if settings.aws_endpoint_url and not os.environ.get("TESTING"):
             kwargs["endpoint_url"] = settings.aws_endpoint_url
+        kwargs["config"] = client_config()
 
         self.resource = session.resource("dynamodb", **kwargs)
         log.info("Initialized DynamoDB resource")
@@ -28,8 +45,12 @@ class DynamoDBService:
         # Ensure table exists at initialization (skip if in test environment with moto)
         if settings.aws_endpoint_url and not os.environ.get("TESTING"):
             self.ensure_table()
+            self.ensure_stats_table()
+            self.ensure_idempotency_table()
 
     # Refer here: https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/dynamodb/client/create_table.html
+    @instrumented("dynamodb")
+    @resilient("dynamodb")
     def ensure_table(self):
         """Ensures the DynamoDB table exists, creating it if necessary."""
         try:
@@ -42,6 +63,10 @@ class DynamoDBService:
                 AttributeDefinitions=[
                     {"AttributeName": "image_id", "AttributeType": "S"},
                     {"AttributeName": "user_id", "AttributeType": "S"},
+                    {"AttributeName": "tombstone", "AttributeType": "S"},
+                    {"AttributeName": "deleted_at", "AttributeType": "S"},
+                    {"AttributeName": "uploaded_ts", "AttributeType": "N"},
+                    {"AttributeName": "upload_day", "AttributeType": "S"},
                 ],
                 GlobalSecondaryIndexes=[
                     {
@@ -49,53 +74,388 @@ class DynamoDBService:
                         "KeySchema": [{"AttributeName": "user_id", "KeyType": "HASH"}],
                         "Projection": {"ProjectionType": "ALL"},
                         "ProvisionedThroughput": {"ReadCapacityUnits": 5, "WriteCapacityUnits": 5},
-                    }
+                    },
+                    {
+                        # Sparse index: only tombstoned items carry the key attributes
+                        "IndexName": TOMBSTONE_INDEX,
+                        "KeySchema": [
+                            {"AttributeName": "tombstone", "KeyType": "HASH"},
+                            {"AttributeName": "deleted_at", "KeyType": "RANGE"},
+                        ],
+                        "Projection": {"ProjectionType": "ALL"},
+                        "ProvisionedThroughput": {"ReadCapacityUnits": 5, "WriteCapacityUnits": 5},
+                    },
+                    {
+                        "IndexName": USER_TIME_INDEX,
+                        "KeySchema": [
+                            {"AttributeName": "user_id", "KeyType": "HASH"},
+                            {"AttributeName": "uploaded_ts", "KeyType": "RANGE"},
+                        ],
+                        "Projection": {"ProjectionType": "ALL"},
+                        "ProvisionedThroughput": {"ReadCapacityUnits": 5, "WriteCapacityUnits": 5},
+                    },
+                    {
+                        # Global time queries walk one UTC day bucket at a time
+                        "IndexName": UPLOAD_DAY_INDEX,
+                        "KeySchema": [
+                            {"AttributeName": "upload_day", "KeyType": "HASH"},
+                            {"AttributeName": "uploaded_ts", "KeyType": "RANGE"},
+                        ],
+                        "Projection": {"ProjectionType": "ALL"},
+                        "ProvisionedThroughput": {"ReadCapacityUnits": 5, "WriteCapacityUnits": 5},
+                    },
                 ],
                 ProvisionedThroughput={"ReadCapacityUnits": 5, "WriteCapacityUnits": 5},
             )
             table.wait_until_exists()
             log.info("Created table %s", settings.dynamodb_table)
 
+    @instrumented("dynamodb")
+    @resilient("dynamodb")
+    def ensure_stats_table(self):
+        """Ensures the per-user usage statistics table exists, creating it if necessary."""
+        try:
+            table = self.resource.Table(settings.user_stats_table)
+            table.load()
+        except ClientError:
+            table = self.resource.create_table(
+                TableName=settings.user_stats_table,
+                KeySchema=[{"AttributeName": "user_id", "KeyType": "HASH"}],
+                AttributeDefinitions=[{"AttributeName": "user_id", "AttributeType": "S"}],
+                ProvisionedThroughput={"ReadCapacityUnits": 5, "WriteCapacityUnits": 5},
+            )
+            table.wait_until_exists()
+            log.info("Created table %s", settings.user_stats_table)
+
+    @instrumented("dynamodb")
+    @resilient("dynamodb")
+    def ensure_idempotency_table(self):
+        """Ensures the idempotency key table exists, with expired records removed by DynamoDB TTL."""
+        try:
+            table = self.resource.Table(settings.idempotency_table)
+            table.load()
+        except ClientError:
+            table = self.resource.create_table(
+                TableName=settings.idempotency_table,
+                KeySchema=[{"AttributeName": "idempotency_key", "KeyType": "HASH"}],
+                AttributeDefinitions=[{"AttributeName": "idempotency_key", "AttributeType": "S"}],
+                ProvisionedThroughput={"ReadCapacityUnits": 5, "WriteCapacityUnits": 5},
+            )
+            table.wait_until_exists()
+            self.resource.meta.client.update_time_to_live(
+                TableName=settings.idempotency_table,
+                TimeToLiveSpecification={"Enabled": True, "AttributeName": "expires_at"},
+            )
+            log.info("Created table %s", settings.idempotency_table)
+
+    @instrumented("dynamodb")
+    @resilient("dynamodb")
     def put_metadata(self, item: Dict[str, Any]):
         """Puts an item into the DynamoDB table."""
         table = self.resource.Table(settings.dynamodb_table)
-        table.put_item(Item=item)
+        resp = table.put_item(Item=item, ReturnConsumedCapacity=RETURN_CONSUMED_CAPACITY)
+        record_capacity(settings.dynamodb_table, "put_metadata", "write", resp)
         log.debug("Inserted metadata %s", item.get("image_id"))
 
+    @instrumented("dynamodb")
+    @resilient("dynamodb", hedged=True)
     def get_metadata(self, image_id: str) -> Optional[Dict[str, Any]]:
         """Gets an item from the DynamoDB table."""
         table = self.resource.Table(settings.dynamodb_table)
-        resp = table.get_item(Key={"image_id": image_id})
+        resp = table.get_item(Key={"image_id": image_id}, ReturnConsumedCapacity=RETURN_CONSUMED_CAPACITY)
+        record_capacity(settings.dynamodb_table, "get_metadata", "read", resp)
         return resp.get("Item")
 
-    def delete_metadata(self, image_id: str):
-        """Deletes an item from the DynamoDB table."""
+    @instrumented("dynamodb")
+    @resilient("dynamodb")
+    def mark_deleted(self, image_id: str, deleted_at: str):
+        """Writes a tombstone on an item. Fails if it is missing or already tombstoned."""
         table = self.resource.Table(settings.dynamodb_table)
-        table.delete_item(Key={"image_id": image_id})
-        log.debug("Deleted metadata %s", image_id)
+        resp = table.update_item(
+            Key={"image_id": image_id},
+            UpdateExpression="SET tombstone = :t, deleted_at = :d",
+            ConditionExpression=Attr("image_id").exists() & Attr("deleted_at").not_exists(),
+            ExpressionAttributeValues={":t": TOMBSTONE_VALUE, ":d": deleted_at},
+            ReturnConsumedCapacity=RETURN_CONSUMED_CAPACITY,
+        )
+        record_capacity(settings.dynamodb_table, "mark_deleted", "write", resp)
+        log.debug("Tombstoned metadata %s", image_id)
+
+    @instrumented("dynamodb")
+    @resilient("dynamodb")
+    def query_tombstones(self, deleted_before: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """Returns up to `limit` tombstoned items deleted before the given ISO timestamp, oldest first."""
+        table = self.resource.Table(settings.dynamodb_table)
+        resp = table.query(
+            IndexName=TOMBSTONE_INDEX,
+            KeyConditionExpression=Key("tombstone").eq(TOMBSTONE_VALUE) & Key("deleted_at").lt(deleted_before),
+            Limit=limit,
+            ReturnConsumedCapacity=RETURN_CONSUMED_CAPACITY,
+        )
+        record_capacity(settings.dynamodb_table, "query_tombstones", "read", resp)
+        return resp.get("Items", [])
+
+    @instrumented("dynamodb")
+    @resilient("dynamodb")
+    def batch_delete_metadata(self, image_ids: List[str], max_attempts: int = 8) -> List[str]:
+        """
+            Deletes items in batches of 25, retrying unprocessed keys with exponential
+            backoff. Returns the ids that were still unprocessed after `max_attempts`.
+        """
+        requests = [{"DeleteRequest": {"Key": {"image_id": image_id}}} for image_id in image_ids]
+        _, unprocessed = self._batch_write(requests, max_attempts, "batch_delete_metadata")
+        log.debug("Batch deleted %d metadata items", len(image_ids) - len(unprocessed))
+        return [r["DeleteRequest"]["Key"]["image_id"] for r in unprocessed]
 
+    @instrumented("dynamodb")
+    @resilient("dynamodb")
+    def update_live_metadata(
+        self, image_id: str, set_attributes: Dict[str, Any], remove_attributes: List[str],
+    ) -> float:
+        """
+            Sets and removes attributes of a live item with one UpdateItem and returns the write
+            capacity consumed. Raises ConditionalCheckFailedException if the item was deleted or
+            tombstoned meanwhile.
+        """
+        table = self.resource.Table(settings.dynamodb_table)
+        names = {"#id": "image_id", "#deleted": "deleted_at"}
+        values = {}
+        clauses = []
+        if set_attributes:
+            names.update({f"#s{i}": name for i, name in enumerate(set_attributes)})
+            values.update({f":s{i}": value for i, value in enumerate(set_attributes.values())})
+            clauses.append("SET " + ", ".join(f"#s{i} = :s{i}" for i in range(len(set_attributes))))
+        if remove_attributes:
+            names.update({f"#r{i}": name for i, name in enumerate(remove_attributes)})
+            clauses.append("REMOVE " + ", ".join(f"#r{i}" for i in range(len(remove_attributes))))
+        update_kwargs = {"ExpressionAttributeValues": values} if values else {}
+        resp = table.update_item(
+            Key={"image_id": image_id},
+            UpdateExpression=" ".join(clauses),
+            ConditionExpression="attribute_exists(#id) AND attribute_not_exists(#deleted)",
+            ExpressionAttributeNames=names,
+            ReturnConsumedCapacity=RETURN_CONSUMED_CAPACITY,
+            **update_kwargs,
+        )
+        return record_capacity(settings.dynamodb_table, "update_live_metadata", "write", resp)
+
+    def _batch_write(
+        self, requests: List[Dict[str, Any]], max_attempts: int, operation: str,
+    ) -> Tuple[float, List[Dict[str, Any]]]:
+        """BatchWriteItem in chunks of 25 with backoff on unprocessed requests. Returns (consumed WCU, unprocessed)."""
+        consumed = 0.0
+        unprocessed: List[Dict[str, Any]] = []
+        for start in range(0, len(requests), 25):
+            chunk = requests[start:start + 25]
+            for attempt in range(max_attempts):
+                resp = self.resource.batch_write_item(
+                    RequestItems={settings.dynamodb_table: chunk},
+                    ReturnConsumedCapacity=RETURN_CONSUMED_CAPACITY,
+                )
+                consumed += record_capacity(settings.dynamodb_table, operation, "write", resp)
+                chunk = resp.get("UnprocessedItems", {}).get(settings.dynamodb_table, [])
+                if not chunk:
+                    break
+                time.sleep(min(0.05 * 2 ** attempt, 2.0))
+            unprocessed.extend(chunk)
+        return consumed, unprocessed
+
+    @instrumented("dynamodb")
+    @resilient("dynamodb")
+    def approximate_item_count(self) -> int:
+        """Returns DynamoDB's item count for the table, refreshed roughly every six hours."""
+        table = self.resource.Table(settings.dynamodb_table)
+        table.reload()
+        return table.item_count
+
+    @instrumented("dynamodb")
+    @resilient("dynamodb")
+    def query_metadata(
+        self,
+        index_name: str,
+        key_condition,
+        filter_expression=None,
+        ascending: bool = True,
+        limit: int = 50,
+        exclusive_start_key: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """Queries a secondary index with a key condition. Tombstoned items are skipped."""
+        table = self.resource.Table(settings.dynamodb_table)
+        filters = Attr("deleted_at").not_exists()
+        if filter_expression is not None:
+            filters = filters & filter_expression
+        query_kwargs = {
+            "IndexName": index_name,
+            "KeyConditionExpression": key_condition,
+            "FilterExpression": filters,
+            "ScanIndexForward": ascending,
+            "Limit": limit,
+            "ReturnConsumedCapacity": RETURN_CONSUMED_CAPACITY,
+        }
+        if exclusive_start_key:
+            query_kwargs["ExclusiveStartKey"] = exclusive_start_key
+        resp = table.query(**query_kwargs)
+        record_capacity(settings.dynamodb_table, "query_metadata", "read", resp)
+        return resp
+
+    @instrumented("dynamodb")
+    @resilient("dynamodb")
     def scan_metadata(
         self,
         filter_expression: Optional[Dict[str, Any]] = None,
         limit: int = 50,
         exclusive_start_key: Optional[Dict[str, str]] = None,
+        condition=None,
+        segment: Optional[int] = None,
+        total_segments: Optional[int] = None,
     ) -> Dict[str, Any]:
-        """Scans the DynamoDB table with optional filters."""
+        """
+            Scans the DynamoDB table with optional equality filters and an extra
+            filter condition. Tombstoned items are skipped. Passing `segment` and
+            `total_segments` scans one segment of a parallel scan.
+        """
         table = self.resource.Table(settings.dynamodb_table)
-        scan_kwargs = {"Limit": limit}
+        scan_kwargs = {"Limit": limit, "ReturnConsumedCapacity": RETURN_CONSUMED_CAPACITY}
         if exclusive_start_key:
             scan_kwargs["ExclusiveStartKey"] = exclusive_start_key
+        if total_segments is not None:
+            scan_kwargs["Segment"] = segment
+            scan_kwargs["TotalSegments"] = total_segments
+        filters = Attr("deleted_at").not_exists()
         if filter_expression:
-            from boto3.dynamodb.conditions import Attr
-
-            filters = None
             for k, v in filter_expression.items():
-                cond = Attr(k).eq(v)
-                filters = cond if filters is None else filters & cond
-            if filters is not None:
-                scan_kwargs["FilterExpression"] = filters
-        return table.scan(**scan_kwargs)
+                filters = filters & Attr(k).eq(v)
+        if condition is not None:
+            filters = filters & condition
+        scan_kwargs["FilterExpression"] = filters
+        resp = table.scan(**scan_kwargs)
+        record_capacity(settings.dynamodb_table, "scan_metadata", "read", resp)
+        return resp
     
+    @instrumented("dynamodb")
+    @resilient("dynamodb")
+    def add_user_stats(self, user_id: str, deltas: Dict[str, int], expected_version: Optional[int] = None):
+        """
+            Atomically adds the given deltas to a user's aggregate attributes with a single ADD
+            update, bumping the item's version. With `expected_version` the update only applies
+            if the item is still at that version (0: never versioned); otherwise it raises
+            ConditionalCheckFailedException.
+        """
+        table = self.resource.Table(settings.user_stats_table)
+        names = {f"#a{i}": name for i, name in enumerate(deltas)}
+        values = {f":v{i}": delta for i, delta in enumerate(deltas.values())}
+        names["#version"] = STATS_VERSION
+        values[":one"] = 1
+        update_kwargs = {}
+        if expected_version:
+            update_kwargs["ConditionExpression"] = "#version = :expected"
+            values[":expected"] = expected_version
+        elif expected_version is not None:
+            update_kwargs["ConditionExpression"] = "attribute_not_exists(#version)"
+        resp = table.update_item(
+            Key={"user_id": user_id},
+            UpdateExpression="ADD " + ", ".join([f"#a{i} :v{i}" for i in range(len(deltas))] + ["#version :one"]),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+            ReturnConsumedCapacity=RETURN_CONSUMED_CAPACITY,
+            **update_kwargs,
+        )
+        record_capacity(settings.user_stats_table, "add_user_stats", "write", resp)
+
+    @instrumented("dynamodb")
+    @resilient("dynamodb", hedged=True)
+    def get_user_stats(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Gets a user's aggregate item."""
+        table = self.resource.Table(settings.user_stats_table)
+        resp = table.get_item(Key={"user_id": user_id}, ReturnConsumedCapacity=RETURN_CONSUMED_CAPACITY)
+        record_capacity(settings.user_stats_table, "get_user_stats", "read", resp)
+        return resp.get("Item")
+
+    @instrumented("dynamodb")
+    @resilient("dynamodb")
+    def scan_user_stats(
+        self,
+        limit: int = 1000,
+        exclusive_start_key: Optional[Dict[str, str]] = None,
+    ) -> Dict[str, Any]:
+        """Scans the per-user aggregates table."""
+        table = self.resource.Table(settings.user_stats_table)
+        scan_kwargs = {"Limit": limit, "ReturnConsumedCapacity": RETURN_CONSUMED_CAPACITY}
+        if exclusive_start_key:
+            scan_kwargs["ExclusiveStartKey"] = exclusive_start_key
+        resp = table.scan(**scan_kwargs)
+        record_capacity(settings.user_stats_table, "scan_user_stats", "read", resp)
+        return resp
+
+    @instrumented("dynamodb")
+    @resilient("dynamodb")
+    def claim_idempotency_key(self, key: str, owner: str, fingerprint: str, now: int, lease_seconds: int):
+        """
+            Claims an idempotency key for one request. Succeeds if the key is unused, its
+            record has expired (TTL deletion lags), or an in-progress claim's lease ran out.
+            Raises ConditionalCheckFailedException otherwise.
+        """
+        table = self.resource.Table(settings.idempotency_table)
+        resp = table.put_item(
+            Item={
+                "idempotency_key": key,
+                "state": "in_progress",
+                "owner": owner,
+                "fingerprint": fingerprint,
+                "expires_at": now + lease_seconds,
+            },
+            ConditionExpression=Attr("idempotency_key").not_exists() | Attr("expires_at").lt(now),
+            ReturnConsumedCapacity=RETURN_CONSUMED_CAPACITY,
+        )
+        record_capacity(settings.idempotency_table, "claim_idempotency_key", "write", resp)
+
+    @instrumented("dynamodb")
+    @resilient("dynamodb", hedged=True)
+    def get_idempotency_record(self, key: str) -> Optional[Dict[str, Any]]:
+        """Reads an idempotency record with a strongly consistent read."""
+        table = self.resource.Table(settings.idempotency_table)
+        resp = table.get_item(
+            Key={"idempotency_key": key}, ConsistentRead=True, ReturnConsumedCapacity=RETURN_CONSUMED_CAPACITY,
+        )
+        record_capacity(settings.idempotency_table, "get_idempotency_record", "read", resp)
+        return resp.get("Item")
+
+    @instrumented("dynamodb")
+    @resilient("dynamodb")
+    def complete_idempotency_key(self, key: str, owner: str, status_code: int, body: Optional[str], expires_at: int):
+        """Stores the response of a claimed request. Fails if the claim was lost to another request."""
+        table = self.resource.Table(settings.idempotency_table)
+        values = {":done": "completed", ":status": status_code, ":exp": expires_at}
+        expression = "SET #state = :done, status_code = :status, expires_at = :exp"
+        if body is not None:
+            expression += ", response_body = :body"
+            values[":body"] = body
+        resp = table.update_item(
+            Key={"idempotency_key": key},
+            UpdateExpression=expression,
+            ConditionExpression=Attr("owner").eq(owner),
+            ExpressionAttributeNames={"#state": "state"},
+            ExpressionAttributeValues=values,
+            ReturnConsumedCapacity=RETURN_CONSUMED_CAPACITY,
+        )
+        record_capacity(settings.idempotency_table, "complete_idempotency_key", "write", resp)
+
+    @instrumented("dynamodb")
+    @resilient("dynamodb")
+    def release_idempotency_key(self, key: str, owner: str):
+        """Deletes an in-progress claim so the request can be retried. No-op if the claim was lost."""
+        table = self.resource.Table(settings.idempotency_table)
+        try:
+            resp = table.delete_item(
+                Key={"idempotency_key": key},
+                ConditionExpression=Attr("owner").eq(owner),
+                ReturnConsumedCapacity=RETURN_CONSUMED_CAPACITY,
+            )
+            record_capacity(settings.idempotency_table, "release_idempotency_key", "write", resp)
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
     def close(self):
         """Closes the DynamoDB resource."""
         log.info("Closed DynamoDB resource")
\ No newline at end of file
@@ -1,7 +1,9 @@
 import boto3
-from typing import Optional
+from typing import Optional, List
 from botocore.exceptions import ClientError
 from app.settings import settings
+from app.metrics import instrumented
+from app.resilience import client_config, resilient
 import logging
 
 log = logging.getLogger(__name__)
@@ -21,6 +23,7 @@ class S3Service:
         # Only set endpoint_url if not in test mode (moto will handle it)
         if settings.aws_endpoint_url and not os.environ.get("TESTING"):
             kwargs["endpoint_url"] = settings.aws_endpoint_url
+        kwargs["config"] = client_config()
 
         self.client = session.client("s3", **kwargs)
         log.info("Initialized S3 client")
@@ -29,6 +32,8 @@ class S3Service:
         if settings.aws_endpoint_url and not os.environ.get("TESTING"):
             self.ensure_bucket()
 
+    @instrumented("s3")
+    @resilient("s3")
     def ensure_bucket(self):
         """Ensures the S3 bucket exists, creating it if necessary."""
         try:
@@ -43,6 +48,8 @@ class S3Service:
                 log.error("Failed to check/create bucket: %s", e)
                 raise
 
+    @instrumented("s3")
+    @resilient("s3")
     def upload(self, fileobj, key: str, content_type: str):
         """Uploads a file to the S3 bucket."""
         self.client.upload_fileobj(
@@ -53,6 +60,7 @@ class S3Service:
         )
         log.debug("Uploaded %s to s3://%s/%s", key, settings.s3_bucket, key)
 
+    @instrumented("s3")
     def generate_presigned_url(self, key: str, expires_in: Optional[int] = None) -> str:
         """Generates a presigned URL for an S3 object."""
         expires = expires_in or settings.presign_expire_seconds
@@ -65,11 +73,30 @@ class S3Service:
                 url = url.replace(settings.aws_endpoint_url, settings.external_endpoint)
         return url
 
-    def delete(self, key: str):
-        """Deletes an object from the S3 bucket."""
-        self.client.delete_object(Bucket=settings.s3_bucket, Key=key)
-        log.debug("Deleted s3://%s/%s", settings.s3_bucket, key)
-    
+    @instrumented("s3")
+    @resilient("s3")
+    def download(self, key: str) -> bytes:
+        """Reads an object from the S3 bucket into memory."""
+        resp = self.client.get_object(Bucket=settings.s3_bucket, Key=key)
+        return resp["Body"].read()
+
+    @instrumented("s3")
+    @resilient("s3")
+    def delete_many(self, keys: List[str]) -> List[str]:
+        """Deletes objects with DeleteObjects (1000 keys per call). Returns the keys that failed."""
+        failed = []
+        for start in range(0, len(keys), 1000):
+            chunk = keys[start:start + 1000]
+            resp = self.client.delete_objects(
+                Bucket=settings.s3_bucket,
+                Delete={"Objects": [{"Key": k} for k in chunk], "Quiet": True},
+            )
+            for err in resp.get("Errors", []):
+                log.error("Failed to delete s3://%s/%s: %s", settings.s3_bucket, err.get("Key"), err.get("Message"))
+                failed.append(err.get("Key"))
+        log.debug("Deleted %d objects from s3://%s", len(keys) - len(failed), settings.s3_bucket)
+        return failed
+
     def close(self):
         """Closes the S3 client."""
         log.info("Closed S3 client")
\ No newline at end of file
@@ -0,0 +1,69 @@
+"""
+    Timing helpers and the baseline-comparing recorder used by the benchmarks.
+"""
+import statistics
+import time
+
+# Below this many samples a p99 is close to the single slowest call, too noisy to gate on
+MIN_SAMPLES_FOR_TAIL_GATE = 1000
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of samples."""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def timed_samples(func, iterations, warmup=3):
+    """Runs `func` `warmup` times untimed, then `iterations` times, returning the per-call durations in seconds."""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+class BenchmarkRecorder:
+    """Collects benchmark metrics and checks them against the stored baseline."""
+    def __init__(self, baseline, tolerance, update_baseline):
+        self.baseline = baseline
+        self.tolerance = tolerance
+        self.update_baseline = update_baseline
+        self.results = {}
+
+    def record(self, name, value, unit, higher_is_better, gated=True):
+        """Records a metric and, if `gated`, fails if it regressed beyond the tolerance."""
+        self.results[name] = {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+        previous = self.baseline.get(name)
+        if not gated or self.update_baseline or previous is None:
+            return
+        base = previous["value"]
+        if higher_is_better:
+            limit = base * (1 - self.tolerance)
+            assert value >= limit, f"{name} regressed: {value:.4g} {unit} < {limit:.4g} (baseline {base:.4g})"
+        else:
+            limit = base * (1 + self.tolerance)
+            assert value <= limit, f"{name} regressed: {value:.4g} {unit} > {limit:.4g} (baseline {base:.4g})"
+
+    def record_latencies(self, name, samples):
+        """
+            Records p50/p99/mean latency in milliseconds for a list of samples. The median is
+            always gated; p99 only with at least MIN_SAMPLES_FOR_TAIL_GATE samples.
+        """
+        self.record(f"{name}.p50_ms", percentile(samples, 50) * 1000, "ms", higher_is_better=False)
+        self.record(
+            f"{name}.p99_ms", percentile(samples, 99) * 1000, "ms", higher_is_better=False,
+            gated=len(samples) >= MIN_SAMPLES_FOR_TAIL_GATE,
+        )
+        self.record(f"{name}.mean_ms", statistics.mean(samples) * 1000, "ms", higher_is_better=False, gated=False)
+
+    def record_throughput(self, name, samples, per_call=1.0, unit="ops/s"):
+        """
+            Records `per_call` units over the median call duration, so the gated rate is as
+            stable as the median latency rather than swayed by a few slow calls.
+        """
+        self.record(name, per_call / percentile(samples, 50), unit, higher_is_better=True)
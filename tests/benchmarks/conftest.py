@@ -0,0 +1,68 @@
+"""
+    Benchmark helpers. Benchmarks only run with BENCHMARK=1, e.g.
+
+        BENCHMARK=1 python -m pytest tests/benchmarks -q
+
+    Results are written to BENCHMARK_OUTPUT (default: benchmark-results.json)
+    and compared against tests/benchmarks/baseline.json. A metric that is
+    worse than the baseline by more than BENCHMARK_TOLERANCE (default 0.5,
+    i.e. 50%) fails its test. Latencies are gated on their median, and
+    throughputs are derived from the median call duration; p99 is reported,
+    but only gated when measured over enough samples to be stable (see
+    benchutils.MIN_SAMPLES_FOR_TAIL_GATE). Run with
+    BENCHMARK_UPDATE_BASELINE=1 to record a new baseline instead.
+"""
+import json
+import os
+import platform
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+from benchutils import BenchmarkRecorder
+
+BASELINE_PATH = Path(__file__).parent / "baseline.json"
+
+
+@pytest.fixture(scope="session")
+def bench():
+    baseline = {}
+    if BASELINE_PATH.exists():
+        baseline = json.loads(BASELINE_PATH.read_text()).get("metrics", {})
+    recorder = BenchmarkRecorder(
+        baseline=baseline,
+        tolerance=float(os.environ.get("BENCHMARK_TOLERANCE", "0.5")),
+        update_baseline=bool(os.environ.get("BENCHMARK_UPDATE_BASELINE")),
+    )
+    yield recorder
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "metrics": recorder.results,
+        "comparison": {
+            name: {
+                "baseline": recorder.baseline[name]["value"],
+                "current": result["value"],
+                "change": (result["value"] - recorder.baseline[name]["value"]) / recorder.baseline[name]["value"]
+                if recorder.baseline[name]["value"] else None,
+            }
+            for name, result in recorder.results.items() if name in recorder.baseline
+        },
+    }
+    output = Path(os.environ.get("BENCHMARK_OUTPUT", "benchmark-results.json"))
+    output.write_text(json.dumps(report, indent=2, sort_keys=True))
+    if recorder.update_baseline:
+        BASELINE_PATH.write_text(json.dumps(
+            {k: report[k] for k in ("created_at", "python", "machine", "metrics")}, indent=2, sort_keys=True,
+        ) + "\n")
+
+
+@pytest.fixture
+def bench_client(test_client, monkeypatch):
+    """test_client with admission control disabled so the benchmark is not rate limited."""
+    from app.main import app
+    monkeypatch.setattr(app.state, "admission", None)
+    return test_client
@@ -0,0 +1,200 @@
+import io
+import os
+import random
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import pytest
+from PIL import Image
+
+from benchutils import percentile, timed_samples
+
+pytestmark = pytest.mark.skipif(not os.environ.get("BENCHMARK"), reason="set BENCHMARK=1 to run benchmarks")
+
+FORMATS = {
+    "png": ("PNG", "image/png"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+    "gif": ("GIF", "image/gif"),
+}
+
+
+def make_image_bytes(side, fmt):
+    """Random-noise image so encoders cannot compress it away."""
+    rng = random.Random(side)
+    img = Image.frombytes("RGB", (side, side), bytes(rng.getrandbits(8) for _ in range(side * side * 3)))
+    buf = io.BytesIO()
+    img.save(buf, format=FORMATS[fmt][0])
+    return buf.getvalue()
+
+
+def seed_table(db, count, users=10, tags=("a", "b", "c", "d")):
+    """Writes `count` metadata items directly, bypassing S3."""
+    now = datetime.now(timezone.utc).isoformat()
+    for i in range(count):
+        db.put_metadata({
+            "image_id": f"seed-{i}",
+            "user_id": f"user-{i % users}",
+            "title": f"image {i}",
+            "description": None,
+            "tags": [tags[i % len(tags)]],
+            "s3_key": f"user-{i % users}/seed/{i}_seed.png",
+            "filename": "seed.png",
+            "content_type": "image/png",
+            "size": 1024,
+            "uploaded_at": now,
+        })
+
+
+# ------------------------------
+# Upload throughput
+# ------------------------------
+
+@pytest.mark.parametrize("fmt", list(FORMATS))
+@pytest.mark.parametrize("side", [64, 512, 1024])
+def test_upload_throughput(bench_client, bench, fmt, side):
+    data = make_image_bytes(side, fmt)
+    iterations = 40 if side < 1024 else 15
+
+    def upload():
+        files = {"file": (f"b.{fmt}", data, FORMATS[fmt][1])}
+        resp = bench_client.post("/images", data={"user_id": "bench"}, files=files)
+        assert resp.status_code == 201
+
+    samples = timed_samples(upload, iterations)
+    name = f"upload.{fmt}.{side}px"
+    bench.record_throughput(f"{name}.ops_per_s", samples)
+    bench.record_throughput(f"{name}.mb_per_s", samples, per_call=len(data) / 1024 ** 2, unit="MB/s")
+
+
+# ------------------------------
+# List latency
+# ------------------------------
+
+@pytest.mark.parametrize("table_size", [100, 1000])
+def test_list_latency(bench_client, bench, table_size):
+    from app.main import app
+    seed_table(app.state.db, table_size)
+
+    filters = {
+        "none": {},
+        "user": {"user_id": "user-3"},
+        "tag": {"tag": "b"},
+        "user_and_tag": {"user_id": "user-3", "tag": "d"},
+    }
+    for label, params in filters.items():
+        def list_images():
+            resp = bench_client.get("/images", params={**params, "limit": 50})
+            assert resp.status_code == 200
+
+        samples = timed_samples(list_images, 50)
+        bench.record_latencies(f"list.{label}.{table_size}_items", samples)
+
+
+# ------------------------------
+# Memory per concurrent upload
+# ------------------------------
+
+@pytest.mark.parametrize("concurrency", [1, 8])
+def test_memory_per_concurrent_upload(bench_client, bench, concurrency):
+    data = make_image_bytes(1024, "png")
+
+    def upload(i):
+        files = {"file": ("m.png", data, "image/png")}
+        resp = bench_client.post("/images", data={"user_id": f"mem-{i}"}, files=files)
+        assert resp.status_code == 201
+
+    tracemalloc.start()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(upload, range(concurrency)))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    bench.record(
+        f"upload_memory.concurrency_{concurrency}.peak_mb_per_upload",
+        peak / concurrency / 1024 ** 2,
+        "MB",
+        higher_is_better=False,
+    )
+
+
+# ------------------------------
+# Presign throughput
+# ------------------------------
+
+def test_presign_throughput(bench_client, bench):
+    files = {"file": ("p.png", make_image_bytes(64, "png"), "image/png")}
+    img_id = bench_client.post("/images", data={"user_id": "presign"}, files=files).json()["image_id"]
+
+    def presign():
+        resp = bench_client.get(f"/images/{img_id}/download")
+        assert resp.status_code == 200
+
+    samples = timed_samples(presign, 100)
+    bench.record_throughput("presign.endpoint.ops_per_s", samples)
+    bench.record_latencies("presign.endpoint", samples)
+
+    from app.main import app
+    samples = timed_samples(lambda: app.state.s3.generate_presigned_url("presign/key.png"), 1000)
+    bench.record_throughput("presign.direct.ops_per_s", samples)
+
+
+# ------------------------------
+# S3 key layout
+# ------------------------------
+
+@pytest.mark.parametrize("hash_chars", [1, 2])
+def test_key_layout_distribution(bench, monkeypatch, hash_chars):
+    """One heavy user uploading all day should spread evenly over the hashed prefixes."""
+    import uuid
+    from app.image_service import keys
+    monkeypatch.setattr(keys.settings, "s3_key_layout", "hashed")
+    monkeypatch.setattr(keys.settings, "s3_key_hash_chars", hash_chars)
+
+    now = datetime.now(timezone.utc)
+    count = 200_000
+    counts = {}
+    for _ in range(count):
+        prefix = keys.build_s3_key("heavy-user", now, str(uuid.uuid4()), "x.png").split("/", 1)[0]
+        counts[prefix] = counts.get(prefix, 0) + 1
+
+    assert len(counts) == 16 ** hash_chars
+    mean = count / len(counts)
+    max_over_mean = max(counts.values()) / mean
+    bench.record(f"key_layout.hashed.{hash_chars}_chars.max_over_mean", max_over_mean, "ratio", higher_is_better=False)
+    # With uniform hashing the busiest prefix stays within a few standard deviations of the mean
+    assert max_over_mean < 1 + 5 / mean ** 0.5
+
+
+# ------------------------------
+# Tag autocomplete latency
+# ------------------------------
+
+@pytest.mark.parametrize("vocabulary", [10_000, 100_000])
+def test_tag_autocomplete_latency(bench, vocabulary):
+    """Keystroke-rate lookups must stay under a millisecond at p99."""
+    import string
+    from app.image_service.tags import TagIndex
+
+    rng = random.Random(vocabulary)
+    letters = string.ascii_lowercase
+    index = TagIndex()
+    for i in range(vocabulary):
+        tags = ["".join(rng.choice(letters) for _ in range(rng.randint(3, 12))) for _ in range(3)]
+        index.add({"image_id": f"img-{i}", "user_id": f"user-{i % 100}", "tags": tags})
+
+    prefixes = ["".join(rng.choice(letters) for _ in range(rng.randint(1, 4))) for _ in range(500)]
+    # The first query for a dense prefix ranks all its matches and caches the result
+    cold = iter(prefixes)
+    cold_samples = timed_samples(lambda: index.autocomplete(next(cold), limit=10), len(prefixes), warmup=0)
+    bench.record(
+        f"tags.autocomplete.{vocabulary}_images.cold_mean_ms", sum(cold_samples) / len(cold_samples) * 1000, "ms",
+        higher_is_better=False, gated=False,
+    )
+    warm = iter(prefixes)
+    samples = timed_samples(lambda: index.autocomplete(next(warm), limit=10), len(prefixes), warmup=0)
+    bench.record_latencies(f"tags.autocomplete.{vocabulary}_images", samples)
+    assert percentile(samples, 99) < 0.001
@@ -1,6 +1,8 @@
+import io
 import os
 import pytest
 from moto import mock_aws
+from PIL import Image
 from fastapi.testclient import TestClient
 import boto3
 import importlib
@@ -28,6 +30,18 @@ from app.storage.s3 import S3Service
 from app.storage.dynamodb import DynamoDBService
 
 
+def _png_bytes(size=(10, 10), color="red"):
+    buf = io.BytesIO()
+    Image.new("RGB", size, color=color).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@pytest.fixture
+def make_png_bytes():
+    """Factory for the PNG bytes of a solid-color image: make_png_bytes(size=(10, 10), color="red")."""
+    return _png_bytes
+
+
 @pytest.fixture(scope="function")
 def aws_credentials():
     """Mocked AWS Credentials for moto."""
@@ -57,6 +71,10 @@ def test_client(aws_credentials):
             AttributeDefinitions=[
                 {"AttributeName": "image_id", "AttributeType": "S"},
                 {"AttributeName": "user_id", "AttributeType": "S"},
+                {"AttributeName": "tombstone", "AttributeType": "S"},
+                {"AttributeName": "deleted_at", "AttributeType": "S"},
+                {"AttributeName": "uploaded_ts", "AttributeType": "N"},
+                {"AttributeName": "upload_day", "AttributeType": "S"},
             ],
             GlobalSecondaryIndexes=[
                 {
@@ -64,11 +82,52 @@ def test_client(aws_credentials):
                     "KeySchema": [{"AttributeName": "user_id", "KeyType": "HASH"}],
                     "Projection": {"ProjectionType": "ALL"},
                     "ProvisionedThroughput": {"ReadCapacityUnits": 5, "WriteCapacityUnits": 5},
-                }
+                },
+                {
+                    "IndexName": "TombstoneIndex",
+                    "KeySchema": [
+                        {"AttributeName": "tombstone", "KeyType": "HASH"},
+                        {"AttributeName": "deleted_at", "KeyType": "RANGE"},
+                    ],
+                    "Projection": {"ProjectionType": "ALL"},
+                    "ProvisionedThroughput": {"ReadCapacityUnits": 5, "WriteCapacityUnits": 5},
+                },
+                {
+                    "IndexName": "UserTimeIndex",
+                    "KeySchema": [
+                        {"AttributeName": "user_id", "KeyType": "HASH"},
+                        {"AttributeName": "uploaded_ts", "KeyType": "RANGE"},
+                    ],
+                    "Projection": {"ProjectionType": "ALL"},
+                    "ProvisionedThroughput": {"ReadCapacityUnits": 5, "WriteCapacityUnits": 5},
+                },
+                {
+                    "IndexName": "UploadDayIndex",
+                    "KeySchema": [
+                        {"AttributeName": "upload_day", "KeyType": "HASH"},
+                        {"AttributeName": "uploaded_ts", "KeyType": "RANGE"},
+                    ],
+                    "Projection": {"ProjectionType": "ALL"},
+                    "ProvisionedThroughput": {"ReadCapacityUnits": 5, "WriteCapacityUnits": 5},
+                },
             ],
             ProvisionedThroughput={"ReadCapacityUnits": 5, "WriteCapacityUnits": 5},
         )
 
+        dynamodb.create_table(
+            TableName="ImageUserStats",
+            KeySchema=[{"AttributeName": "user_id", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "user_id", "AttributeType": "S"}],
+            ProvisionedThroughput={"ReadCapacityUnits": 5, "WriteCapacityUnits": 5},
+        )
+
+        dynamodb.create_table(
+            TableName="ImageIdempotencyKeys",
+            KeySchema=[{"AttributeName": "idempotency_key", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "idempotency_key", "AttributeType": "S"}],
+            ProvisionedThroughput={"ReadCapacityUnits": 5, "WriteCapacityUnits": 5},
+        )
+
         # Create services within the moto context
         s3_service = S3Service()
         db_service = DynamoDBService()
@@ -0,0 +1,89 @@
+
+from app.admission import TokenBucket, AdmissionController
+
+
+# ------------------------------
+# TokenBucket
+# ------------------------------
+
+def test_token_bucket_allows_burst_then_limits():
+    bucket = TokenBucket(rate=1, burst=2)
+    assert bucket.try_take() == 0
+    assert bucket.try_take() == 0
+    wait = bucket.try_take()
+    assert 0 < wait <= 1
+
+
+# ------------------------------
+# AdmissionController
+# ------------------------------
+
+def test_controller_caps_concurrent_requests():
+    controller = AdmissionController(max_concurrent_requests=1, max_inflight_bytes=100, user_rate=1, user_burst=1)
+    assert controller.try_admit(10) is None
+    assert controller.try_admit(10) is not None
+    controller.release(10)
+    assert controller.try_admit(10) is None
+
+
+def test_controller_caps_inflight_bytes():
+    controller = AdmissionController(max_concurrent_requests=10, max_inflight_bytes=100, user_rate=1, user_burst=1)
+    assert controller.try_admit(80) is None
+    assert controller.try_admit(30) is not None
+    assert controller.try_admit(20) is None
+    assert controller.inflight_bytes == 100
+
+
+def test_controller_user_buckets_are_independent():
+    controller = AdmissionController(max_concurrent_requests=10, max_inflight_bytes=100, user_rate=0.1, user_burst=1)
+    assert controller.check_user("a") == 0
+    assert controller.check_user("a") > 0
+    assert controller.check_user("b") == 0
+
+
+# ------------------------------
+# Routes
+# ------------------------------
+
+def test_upload_rate_limited_per_user(test_client, monkeypatch, make_png_bytes):
+    from app.main import app
+    controller = AdmissionController(max_concurrent_requests=10, max_inflight_bytes=10_000_000, user_rate=0.01, user_burst=1)
+    monkeypatch.setattr(app.state, "admission", controller)
+
+    files = {"file": ("r.png", make_png_bytes(), "image/png")}
+    first = test_client.post("/images", data={"user_id": "limited"}, files=files)
+    assert first.status_code == 201
+
+    second = test_client.post("/images", data={"user_id": "limited"}, files=files)
+    assert second.status_code == 429
+    assert int(second.headers["Retry-After"]) >= 1
+
+    other = test_client.post("/images", data={"user_id": "someone-else"}, files=files)
+    assert other.status_code == 201
+
+    # Only uploads spend tokens; reads by the same user are not limited
+    assert test_client.get("/images", params={"user_id": "limited"}).status_code == 200
+
+
+def test_oversized_upload_rejected(test_client, monkeypatch, make_png_bytes):
+    from app.main import app
+    controller = AdmissionController(max_concurrent_requests=10, max_inflight_bytes=100, user_rate=10, user_burst=10)
+    monkeypatch.setattr(app.state, "admission", controller)
+
+    files = {"file": ("big.png", make_png_bytes(), "image/png")}
+    resp = test_client.post("/images", data={"user_id": "big"}, files=files)
+    assert resp.status_code == 413
+    assert controller.inflight_requests == 0
+
+
+def test_overloaded_worker_sheds_load(test_client, monkeypatch):
+    from app.main import app
+    controller = AdmissionController(max_concurrent_requests=0, max_inflight_bytes=100, user_rate=10, user_burst=10)
+    monkeypatch.setattr(app.state, "admission", controller)
+
+    resp = test_client.get("/images")
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == "1"
+
+    # health check is not subject to admission control
+    assert test_client.get("/").status_code == 200
@@ -0,0 +1,158 @@
+import json
+
+import pytest
+
+from app.backfill import Backfill, BackfillError, TRANSFORMS, main
+from app.image_service.encoding import decode_item
+
+
+def put_legacy_items(test_client, png_bytes, count, strip=True):
+    """Uploads images in the legacy encoding, then strips the attributes added by later releases."""
+    from app.main import app
+    from app.image_service import encoding
+    db = app.state.db
+    files = {"file": ("b.png", png_bytes, "image/png")}
+    current = encoding.settings.metadata_encoding
+    encoding.settings.metadata_encoding = "legacy"
+    try:
+        ids = [test_client.post("/images", data={"user_id": "bf"}, files=files).json()["image_id"] for _ in range(count)]
+    finally:
+        encoding.settings.metadata_encoding = current
+    if not strip:
+        return db, ids
+    table = db.resource.Table("Images")
+    for image_id in ids:
+        table.update_item(
+            Key={"image_id": image_id},
+            UpdateExpression="REMOVE uploaded_ts, upload_day, width, height, frame_count, orientation, phash",
+        )
+    return db, ids
+
+
+def test_backfill_rewrites_items_and_checkpoints(test_client, tmp_path, make_png_bytes, monkeypatch):
+    from app.main import app
+    from app.image_service import encoding
+    db, ids = put_legacy_items(test_client, make_png_bytes(size=(8, 4)), 5)
+    monkeypatch.setattr(encoding.settings, "metadata_encoding", "compact")
+    checkpoint = tmp_path / "checkpoint.json"
+
+    report = Backfill(
+        db, ["upload-time-keys", "image-attributes"], total_segments=2, page_size=2,
+        max_wcu=1000, checkpoint_path=str(checkpoint), s3=app.state.s3,
+    ).run(report_every=0.05)
+
+    assert report["scanned"] == 5
+    assert report["updated"] == 5
+    assert report["segments_done"] == 2
+    for image_id in ids:
+        stored = db.get_metadata(image_id)
+        # rewritten items use the configured (compact) encoding
+        assert stored["v"] == 2
+        item = decode_item(stored)
+        assert item["uploaded_ts"] > 0 and len(item["upload_day"]) == 8
+        assert (item["width"], item["height"], item["orientation"]) == (8, 4, "landscape")
+        assert item["phash"]
+
+    saved = json.loads(checkpoint.read_text())
+    assert all(state["done"] for state in saved["segments"].values())
+
+    # a resumed run finds every segment finished and does nothing
+    again = Backfill(db, ["upload-time-keys", "image-attributes"], total_segments=2, checkpoint_path=str(checkpoint)).run()
+    assert again["scanned"] == 5 and again["items_per_second"] == 0
+
+
+def test_backfill_dry_run_does_not_write(test_client, tmp_path, make_png_bytes):
+    db, ids = put_legacy_items(test_client, make_png_bytes(size=(8, 4)), 3)
+
+    report = Backfill(db, ["upload-time-keys"], total_segments=3, dry_run=True,
+                      checkpoint_path=str(tmp_path / "c.json")).run()
+
+    assert report["dry_run"] is True
+    assert report["updated"] == 3
+    assert report["estimated_total"] is not None
+    assert "eta_seconds" in report
+    assert "uploaded_ts" not in db.get_metadata(ids[0])
+    assert not (tmp_path / "c.json").exists()
+
+
+def test_backfill_resumes_from_checkpoint(mocker, tmp_path):
+    checkpoint = tmp_path / "checkpoint.json"
+    checkpoint.write_text(json.dumps({
+        "transforms": ["upload-time-keys"],
+        "total_segments": 2,
+        "segments": {
+            "0": {"last_key": None, "done": True, "scanned": 10, "updated": 1},
+            "1": {"last_key": {"image_id": "x"}, "done": False, "scanned": 4, "updated": 0},
+        },
+    }))
+    db = mocker.Mock()
+    db.approximate_item_count.return_value = 20
+    db.scan_metadata.return_value = {"Items": [], "ConsumedCapacity": {"CapacityUnits": 0.5}}
+
+    report = Backfill(db, ["upload-time-keys"], total_segments=2, checkpoint_path=str(checkpoint)).run()
+
+    db.scan_metadata.assert_called_once()
+    assert db.scan_metadata.call_args.kwargs["segment"] == 1
+    assert db.scan_metadata.call_args.kwargs["exclusive_start_key"] == {"image_id": "x"}
+    assert report["scanned"] == 14 and report["segments_done"] == 2
+
+
+def test_backfill_rejects_mismatched_checkpoint(mocker, tmp_path):
+    checkpoint = tmp_path / "checkpoint.json"
+    checkpoint.write_text(json.dumps({"transforms": ["image-attributes"], "total_segments": 4, "segments": {}}))
+    with pytest.raises(BackfillError):
+        Backfill(mocker.Mock(), ["upload-time-keys"], checkpoint_path=str(checkpoint)).run()
+
+
+def test_backfill_skips_items_deleted_after_the_scan(test_client, make_png_bytes):
+    db, ids = put_legacy_items(test_client, make_png_bytes(size=(8, 4)), 3)
+    scan = db.scan_metadata
+
+    def scan_then_delete(**kwargs):
+        resp = scan(**kwargs)
+        # the API soft-deletes one image while the page is being transformed
+        assert test_client.delete(f"/images/{ids[0]}").status_code == 204
+        return resp
+
+    db.scan_metadata = scan_then_delete
+    report = Backfill(db, ["upload-time-keys"], total_segments=1).run()
+
+    assert (report["updated"], report["skipped"]) == (2, 1)
+    tombstoned = db.resource.Table("Images").get_item(Key={"image_id": ids[0]})["Item"]
+    assert "deleted_at" in tombstoned and "uploaded_ts" not in tombstoned
+    # only the changed attributes were written to the live items
+    live = decode_item(db.get_metadata(ids[1]))
+    assert live["uploaded_ts"] > 0 and live["user_id"] == "bf"
+
+
+def test_backfill_raises_other_write_errors(mocker):
+    from botocore.exceptions import ClientError
+    db = mocker.Mock()
+    db.scan_metadata.return_value = {"Items": [{"image_id": "1", "uploaded_at": "2024-01-01T00:00:00+00:00"}]}
+    db.update_live_metadata.side_effect = ClientError({"Error": {"Code": "ValidationException"}}, "UpdateItem")
+    with pytest.raises(ClientError):
+        Backfill(db, ["upload-time-keys"], total_segments=1).run()
+
+
+def test_cli_rejects_unknown_transform(mocker):
+    mocker.patch("app.backfill.DynamoDBService")
+    assert main(["no-such-transform"]) == 1
+    assert "upload-time-keys" in TRANSFORMS
+
+
+def test_backfill_reencodes_legacy_items(test_client, make_png_bytes, monkeypatch):
+    from app.image_service import encoding
+    db, ids = put_legacy_items(test_client, make_png_bytes(size=(8, 4)), 2, strip=False)
+    monkeypatch.setattr(encoding.settings, "metadata_encoding", "compact")
+    before = decode_item(db.get_metadata(ids[0]))
+    assert "v" not in before
+
+    report = Backfill(db, ["storage-encoding"], total_segments=1).run()
+
+    assert report["updated"] == 2
+    after = db.get_metadata(ids[0])
+    assert after["v"] == 2 and "uploaded_at" not in after
+    decoded = decode_item(after)
+    assert {k: decoded[k] for k in ("s3_key", "filename", "content_type", "size", "uploaded_at")} == \
+        {k: before[k] for k in ("s3_key", "filename", "content_type", "size", "uploaded_at")}
+    assert Backfill(db, ["storage-encoding"], total_segments=1).run()["updated"] == 0
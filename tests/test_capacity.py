@@ -0,0 +1,100 @@
+import logging
+from prometheus_client import REGISTRY
+
+from app import capacity
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+# ------------------------------
+# Accounting
+# ------------------------------
+
+def test_consumed_units_for_single_and_batch_responses():
+    assert capacity.consumed_units({}) == 0
+    assert capacity.consumed_units({"ConsumedCapacity": {"CapacityUnits": 1.5}}) == 1.5
+    assert capacity.consumed_units({"ConsumedCapacity": [{"CapacityUnits": 1}, {"CapacityUnits": 2}]}) == 3
+
+
+def test_record_adds_to_the_current_request_only():
+    before = sample("image_service_dynamodb_consumed_capacity_units_total", table="T", operation="op", kind="read")
+    capacity.record("T", "op", "read", {"ConsumedCapacity": {"CapacityUnits": 0.5}})
+
+    token = capacity.start_request()
+    try:
+        usage = capacity.current_usage()
+        capacity.record("T", "op", "read", {"ConsumedCapacity": {"CapacityUnits": 2}, "ScannedCount": 40, "Count": 4})
+        capacity.record("T", "put", "write", {"ConsumedCapacity": {"CapacityUnits": 1}})
+    finally:
+        capacity.end_request(token)
+
+    assert (usage.read_units, usage.write_units, usage.scanned, usage.returned) == (2, 1, 40, 4)
+    assert usage.scan_efficiency == 0.1
+    assert capacity.current_usage() is None
+    assert sample("image_service_dynamodb_consumed_capacity_units_total", table="T", operation="op", kind="read") == before + 2.5
+
+
+def test_finish_request_warns_on_inefficient_scans(caplog, monkeypatch):
+    monkeypatch.setattr(capacity.settings, "scan_efficiency_warn_min_scanned", 100)
+    monkeypatch.setattr(capacity.settings, "scan_efficiency_warn_ratio", 0.1)
+    usage = capacity.RequestUsage()
+    usage.user_id = "u1"
+    usage.add("read", 12.5, scanned=1000, returned=10)
+    headers = {}
+    with caplog.at_level(logging.WARNING, logger="app.capacity"):
+        capacity.finish_request(usage, "/test-route", headers)
+
+    assert "1000 items scanned, 10 returned" in caplog.text and "u1" in caplog.text
+    assert headers[capacity.READ_UNITS_HEADER] == "12.5"
+    assert headers[capacity.SCANNED_HEADER] == "1000"
+    assert headers[capacity.RETURNED_HEADER] == "10"
+
+    caplog.clear()
+    efficient = capacity.RequestUsage()
+    efficient.add("read", 1, scanned=1000, returned=500)
+    with caplog.at_level(logging.WARNING, logger="app.capacity"):
+        capacity.finish_request(efficient, "/test-route")
+    assert caplog.text == ""
+
+
+# ------------------------------
+# Routes
+# ------------------------------
+
+def test_requests_report_their_consumed_capacity(test_client, make_png_bytes):
+    files = {"file": ("c.png", make_png_bytes(), "image/png")}
+    upload = test_client.post("/images", data={"user_id": "cap1"}, files=files)
+    # Metadata put plus the usage counter update
+    assert float(upload.headers[capacity.WRITE_UNITS_HEADER]) > 1
+
+    resp = test_client.get(f"/images/{upload.json()['image_id']}")
+    assert float(resp.headers[capacity.READ_UNITS_HEADER]) > 0
+    assert resp.headers[capacity.WRITE_UNITS_HEADER] == "0"
+
+    before = sample("image_service_request_consumed_capacity_units_total", route="/images", user="", kind="read")
+    resp = test_client.get("/images", params={"user_id": "cap1"})
+    assert int(resp.headers[capacity.SCANNED_HEADER]) >= int(resp.headers[capacity.RETURNED_HEADER]) >= 1
+    assert sample("image_service_request_consumed_capacity_units_total", route="/images", user="", kind="read") > before
+
+
+def test_inefficient_list_is_logged_per_user(test_client, monkeypatch, caplog):
+    from app.main import app
+    monkeypatch.setattr(capacity.settings, "scan_efficiency_warn_min_scanned", 5)
+    monkeypatch.setattr(capacity.settings, "capacity_metrics_per_user", True)
+    for i in range(20):
+        app.state.db.put_metadata({"image_id": f"cap-noise-{i}", "user_id": "someone-else", "tags": ["x"]})
+
+    with caplog.at_level(logging.WARNING, logger="app.capacity"):
+        resp = test_client.get("/images", params={"user_id": "cap-rare", "tag": "x"})
+    assert resp.status_code == 200
+    assert resp.headers[capacity.RETURNED_HEADER] == "0"
+    assert "Inefficient DynamoDB reads on /images for user cap-rare" in caplog.text
+    assert sample("image_service_request_consumed_capacity_units_total", route="/images", user="cap-rare", kind="read") > 0
+
+
+def test_headers_can_be_disabled(test_client, monkeypatch):
+    monkeypatch.setattr(capacity.settings, "capacity_headers_enabled", False)
+    resp = test_client.get("/images")
+    assert capacity.READ_UNITS_HEADER not in resp.headers
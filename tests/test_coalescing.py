@@ -0,0 +1,217 @@
+import threading
+import time
+import pytest
+from prometheus_client import REGISTRY
+
+from app.image_service import coalescing, service
+from app.image_service.coalescing import CoalescingCache, SingleFlight
+from app.exceptions import ImageNotFoundException
+
+
+def sample(group, result):
+    return REGISTRY.get_sample_value("image_service_coalesced_calls_total", {"group": group, "result": result}) or 0
+
+
+def run_concurrently(call, followers, group):
+    """Runs `call` in 1 + `followers` threads, releasing the leader once every follower has joined it."""
+    entered = threading.Event()
+    release = threading.Event()
+    results, errors = [], []
+    baseline = sample(group, "follower")
+
+    def worker():
+        try:
+            results.append(call(entered, release))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker)]
+    threads[0].start()
+    assert entered.wait(5)
+    threads += [threading.Thread(target=worker) for _ in range(followers)]
+    for t in threads[1:]:
+        t.start()
+    deadline = time.monotonic() + 5
+    while sample(group, "follower") - baseline < followers and time.monotonic() < deadline:
+        time.sleep(0.005)
+    release.set()
+    for t in threads:
+        t.join(5)
+    return results, errors
+
+
+# ------------------------------
+# SingleFlight
+# ------------------------------
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight("test-share")
+    calls = []
+
+    def call(entered, release):
+        def load():
+            calls.append(1)
+            entered.set()
+            release.wait(5)
+            return "value"
+        return flight.do("k", load)
+
+    results, errors = run_concurrently(call, followers=8, group="test-share")
+    assert not errors
+    assert results == ["value"] * 9
+    assert len(calls) == 1
+    assert sample("test-share", "leader") == 1
+    assert sample("test-share", "follower") == 8
+
+
+def test_single_flight_shares_errors_and_forgets_the_call():
+    flight = SingleFlight("test-errors")
+
+    def call(entered, release):
+        def load():
+            entered.set()
+            release.wait(5)
+            raise RuntimeError("backend down")
+        return flight.do("k", load)
+
+    results, errors = run_concurrently(call, followers=3, group="test-errors")
+    assert not results
+    assert len(errors) == 4 and all(isinstance(e, RuntimeError) for e in errors)
+    # A later call starts a fresh flight
+    assert flight.do("k", lambda: "recovered") == "recovered"
+
+
+def test_followers_stop_waiting_for_a_stuck_leader():
+    flight = SingleFlight("test-stuck")
+    entered, release = threading.Event(), threading.Event()
+
+    def stuck():
+        entered.set()
+        release.wait(5)
+        return "late"
+
+    leader = threading.Thread(target=flight.do, args=("k", stuck))
+    leader.start()
+    assert entered.wait(5)
+    start = time.monotonic()
+    assert flight.do("k", lambda: "direct", wait_seconds=0.05) == "direct"
+    assert time.monotonic() - start < 1
+    assert sample("test-stuck", "timeout") == 1
+    release.set()
+    leader.join(5)
+
+
+# ------------------------------
+# CoalescingCache
+# ------------------------------
+
+def test_cache_hits_until_expiry(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(coalescing.time, "monotonic", lambda: now[0])
+    cache = CoalescingCache("test-ttl")
+    loads = []
+
+    def load():
+        loads.append(1)
+        return {"n": len(loads)}
+
+    assert cache.get("k", load, ttl_seconds=2) == {"n": 1}
+    now[0] += 1
+    assert cache.get("k", load, ttl_seconds=2) == {"n": 1}
+    now[0] += 2
+    assert cache.get("k", load, ttl_seconds=2) == {"n": 2}
+    assert sample("test-ttl", "hit") == 1
+    assert sample("test-ttl", "leader") == 2
+
+
+def test_cache_does_not_keep_misses_or_cache_without_ttl():
+    cache = CoalescingCache("test-nocache")
+    loads = []
+
+    def load():
+        loads.append(1)
+        return None
+
+    cache.get("k", load, ttl_seconds=10)
+    cache.get("k", load, ttl_seconds=10)
+    cache.get("j", lambda: loads.append(1) or "v")
+    cache.get("j", lambda: loads.append(1) or "v")
+    assert len(loads) == 4
+
+
+def test_cache_evicts_least_recently_used():
+    cache = CoalescingCache("test-lru", max_entries=2)
+    for key in ("a", "b"):
+        cache.get(key, lambda: key, ttl_seconds=60)
+    cache.get("a", lambda: "reloaded", ttl_seconds=60)
+    cache.get("c", lambda: "c", ttl_seconds=60)
+    assert cache.get("a", lambda: "reloaded", ttl_seconds=60) == "a"
+    assert cache.get("b", lambda: "reloaded", ttl_seconds=60) == "reloaded"
+
+
+def test_expired_entry_is_refreshed_once(monkeypatch):
+    cache = CoalescingCache("test-stampede")
+    cache.get("k", lambda: "old", ttl_seconds=0.01)
+    time.sleep(0.02)
+    calls = []
+
+    def call(entered, release):
+        def load():
+            calls.append(1)
+            entered.set()
+            release.wait(5)
+            return "new"
+        return cache.get("k", load, ttl_seconds=60)
+
+    results, errors = run_concurrently(call, followers=5, group="test-stampede")
+    assert not errors
+    assert results == ["new"] * 6
+    assert len(calls) == 1
+
+
+# ------------------------------
+# get_image_meta
+# ------------------------------
+
+@pytest.fixture
+def metadata_reads(monkeypatch):
+    cache = CoalescingCache("metadata")
+    monkeypatch.setattr(service, "METADATA_READS", cache)
+    return cache
+
+
+def test_get_image_meta_coalesces_concurrent_reads(mocker, metadata_reads):
+    mock_db = mocker.Mock()
+    gate = {}
+
+    def get_metadata(image_id):
+        gate["entered"].set()
+        gate["release"].wait(5)
+        return {"image_id": image_id, "s3_key": "k"}
+    mock_db.get_metadata.side_effect = get_metadata
+
+    def call(entered, release):
+        gate.setdefault("entered", entered)
+        gate.setdefault("release", release)
+        return service.get_image_meta(mock_db, "hot")
+
+    results, errors = run_concurrently(call, followers=10, group="metadata")
+    assert not errors
+    assert len(results) == 11 and all(r["image_id"] == "hot" for r in results)
+    assert mock_db.get_metadata.call_count == 1
+    # Callers get their own copy of the shared item
+    assert len({id(r) for r in results}) == 11
+
+
+def test_get_image_meta_cache_is_invalidated_on_delete(mocker, metadata_reads, monkeypatch):
+    monkeypatch.setattr(service.settings, "metadata_cache_ttl_seconds", 60)
+    mock_db = mocker.Mock()
+    mock_db.get_metadata.return_value = {"image_id": "1", "s3_key": "k", "user_id": "u1", "size": 1}
+    service.get_image_meta(mock_db, "1")
+    service.get_image_meta(mock_db, "1")
+    assert mock_db.get_metadata.call_count == 1
+
+    service.remove_image(mock_db, mocker.Mock(), "1")
+    mock_db.get_metadata.return_value = {"image_id": "1", "deleted_at": "2024-01-01T00:00:00+00:00"}
+    with pytest.raises(ImageNotFoundException):
+        service.get_image_meta(mock_db, "1")
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+from boto3.dynamodb.types import TypeSerializer
+
+from app.image_service.encoding import decode_item, encode_item, stored_version
+
+LEGACY = {
+    "image_id": "img-1",
+    "user_id": "u1",
+    "title": "Beach",
+    "description": "sunset " * 100,
+    "tags": ["sea", "beach"],
+    "s3_key": "u1/20240301/0b7c6a9e-5d7e-4f7e-9a59-3c1f0f7f8c11_beach.png",
+    "filename": "beach.png",
+    "content_type": "image/png",
+    "size": 12345,
+    "uploaded_at": "2024-03-01T12:30:45.123456+00:00",
+    "uploaded_ts": 1709296245123456,
+    "upload_day": "20240301",
+    "phash": "ffd8e0c0c0c0e0f0",
+    "width": 640,
+    "height": 480,
+    "frame_count": 1,
+    "orientation": "landscape",
+    "exif": {"Make": "Canon"},
+}
+
+
+def item_size(item):
+    """Approximates DynamoDB item size: attribute names plus serialized values."""
+    serializer = TypeSerializer()
+    return sum(len(k) + len(json.dumps(serializer.serialize(v), default=str)) for k, v in item.items())
+
+
+def test_legacy_is_the_default_encoding():
+    # Old workers cannot read compact items, so a plain deploy must keep writing legacy ones
+    from app.settings import Settings
+    assert Settings().metadata_encoding == "legacy"
+    assert stored_version(encode_item(LEGACY)) == 1
+
+
+def test_unknown_encoding_fails_at_load(monkeypatch):
+    from pydantic import ValidationError
+    from app.settings import Settings
+    monkeypatch.setenv("METADATA_ENCODING", "compat")
+    with pytest.raises(ValidationError):
+        Settings()
+
+
+def test_compact_round_trip():
+    stored = encode_item(LEGACY, encoding="compact")
+    assert stored_version(stored) == 2
+    # key attributes keep their names so indexes and key conditions still work
+    for key in ("image_id", "user_id", "uploaded_ts", "upload_day"):
+        assert stored[key] == LEGACY[key]
+    assert "uploaded_at" not in stored and "fn" not in stored
+    assert stored["tg"] == {"sea", "beach"}
+    assert stored["ct"] == "png"
+    assert "dz" in stored and "d" not in stored
+
+    decoded = decode_item(stored)
+    decoded.pop("v")
+    assert decoded == {**LEGACY, "tags": ["beach", "sea"]}
+
+
+def test_compact_items_are_smaller():
+    assert item_size(encode_item(LEGACY, encoding="compact")) < item_size(LEGACY) * 0.6
+
+
+def test_compact_keeps_what_cannot_be_derived():
+    item = {**LEGACY, "filename": "other.png", "tags": [], "description": "short", "title": None}
+    stored = encode_item(item, encoding="compact")
+    assert stored["fn"] == "other.png"
+    assert "tg" not in stored and "t" not in stored
+    assert stored["d"] == "short"
+    decoded = decode_item(stored)
+    assert decoded["filename"] == "other.png" and decoded["tags"] == [] and decoded["description"] == "short"
+
+
+def test_legacy_items_decode_unchanged():
+    assert decode_item(dict(LEGACY)) == LEGACY
+    assert decode_item(None) is None
+    assert stored_version(encode_item(LEGACY, encoding="legacy")) == 1
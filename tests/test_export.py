@@ -0,0 +1,87 @@
+import gzip
+import threading
+import time
+
+import pytest
+
+from app.image_service.export import iter_export_items, ndjson_lines, gzip_chunks
+from app.exceptions import DynamoDBException
+
+
+class FakeSegmentedTable:
+    """Serves `pages_per_segment` pages per segment and records how many were fetched."""
+    def __init__(self, pages_per_segment, page_size=2):
+        self.pages_per_segment = pages_per_segment
+        self.page_size = page_size
+        self.fetched = 0
+        self.lock = threading.Lock()
+
+    def scan_metadata(self, filter_expression=None, limit=50, exclusive_start_key=None,
+                      segment=None, total_segments=None):
+        page = exclusive_start_key["page"] if exclusive_start_key else 0
+        with self.lock:
+            self.fetched += 1
+        items = [{"image_id": f"{segment}-{page}-{i}"} for i in range(self.page_size)]
+        last = page + 1 >= self.pages_per_segment
+        return {"Items": items, "LastEvaluatedKey": None if last else {"page": page + 1}}
+
+
+def test_iter_export_items_reads_every_segment():
+    table = FakeSegmentedTable(pages_per_segment=3)
+    items = list(iter_export_items(table, total_segments=4, page_size=2, buffered_pages=2))
+    assert len(items) == 4 * 3 * 2
+    assert len({it["image_id"] for it in items}) == len(items)
+
+
+def test_iter_export_items_applies_backpressure_and_stops():
+    table = FakeSegmentedTable(pages_per_segment=1000)
+    items = iter_export_items(table, total_segments=2, page_size=2, buffered_pages=2)
+    next(items)
+    time.sleep(0.2)
+    # buffered pages + the consumed page + one blocked page per segment
+    assert table.fetched <= 2 + 1 + 2
+    items.close()
+    fetched = table.fetched
+    time.sleep(0.7)
+    assert table.fetched == fetched
+
+
+def test_iter_export_items_surfaces_scan_errors(mocker):
+    from botocore.exceptions import ClientError
+    db = mocker.Mock()
+    db.scan_metadata.side_effect = ClientError({"Error": {"Code": "InternalServerError"}}, "Scan")
+    with pytest.raises(DynamoDBException):
+        list(iter_export_items(db, total_segments=2))
+
+
+def test_iter_export_items_surfaces_unexpected_worker_errors(mocker):
+    db = mocker.Mock()
+    db.scan_metadata.side_effect = ValueError("bad page")
+    lines = []
+
+    def read():
+        lines.extend(ndjson_lines(iter_export_items(db, total_segments=2), str))
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    reader.join(timeout=5)
+    assert not reader.is_alive()
+    assert lines[-1].startswith(b'{"_export": {"complete": false')
+
+
+def test_ndjson_lines_end_with_a_trailer():
+    def failing():
+        yield {"n": 1}
+        raise DynamoDBException("scan failed")
+
+    lines = list(ndjson_lines([{"n": 1}, {"n": 2}], lambda it: f'{{"n": {it["n"]}}}'))
+    assert lines[-1] == b'{"_export": {"complete": true, "count": 2}}\n'
+
+    lines = list(ndjson_lines(failing(), lambda it: f'{{"n": {it["n"]}}}'))
+    assert lines == [b'{"n": 1}\n', b'{"_export": {"complete": false, "error": "scan failed", "count": 1}}\n']
+
+
+def test_gzip_chunks_round_trip():
+    lines = list(ndjson_lines(({"n": i} for i in range(5000)), lambda it: f'{{"n": {it["n"]}}}'))
+    compressed = b"".join(gzip_chunks(lines))
+    assert gzip.decompress(compressed) == b"".join(lines)
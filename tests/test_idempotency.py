@@ -0,0 +1,138 @@
+import threading
+
+import pytest
+
+from app.idempotency import IdempotentRequest, fingerprint
+from app.exceptions import ConflictException, IdempotencyKeyReusedException
+
+
+def count_objects():
+    from app.main import app
+    return app.state.s3.client.list_objects_v2(Bucket="image-service-bucket").get("KeyCount", 0)
+
+
+def test_upload_retry_replays_original_response(test_client, make_png_bytes):
+    data = make_png_bytes()
+    files = {"file": ("i.png", data, "image/png")}
+    headers = {"Idempotency-Key": "abc-1"}
+
+    first = test_client.post("/images", data={"user_id": "idem1"}, files=files, headers=headers)
+    second = test_client.post("/images", data={"user_id": "idem1"}, files=files, headers=headers)
+
+    assert first.status_code == second.status_code == 201
+    assert second.json() == first.json()
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert count_objects() == 1
+    listed = test_client.get("/images", params={"user_id": "idem1"}).json()["images"]
+    assert [it["image_id"] for it in listed] == [first.json()["image_id"]]
+
+    # the same key from another user is a different request
+    other = test_client.post("/images", data={"user_id": "idem2"}, files=files, headers=headers)
+    assert other.status_code == 201 and other.json()["image_id"] != first.json()["image_id"]
+
+
+def test_upload_key_reused_with_different_body(test_client, make_png_bytes):
+    headers = {"Idempotency-Key": "abc-2"}
+    files = {"file": ("i.png", make_png_bytes(), "image/png")}
+    assert test_client.post("/images", data={"user_id": "idem3"}, files=files, headers=headers).status_code == 201
+
+    resp = test_client.post("/images", data={"user_id": "idem3", "title": "changed"}, files=files, headers=headers)
+    assert resp.status_code == 422
+
+
+def test_failed_upload_releases_key(test_client):
+    headers = {"Idempotency-Key": "abc-3"}
+    bad = {"file": ("i.png", b"not an image", "image/png")}
+    assert test_client.post("/images", data={"user_id": "idem4"}, files=bad, headers=headers).status_code == 400
+    # the failure was not recorded, so the retry is validated (and fails) again
+    assert test_client.post("/images", data={"user_id": "idem4"}, files=bad, headers=headers).status_code == 400
+
+
+def test_upload_idempotency_writes_run_off_the_event_loop(test_client, make_png_bytes, monkeypatch):
+    import asyncio
+
+    def on_event_loop():
+        try:
+            asyncio.get_running_loop()
+            return True
+        except RuntimeError:
+            return False
+
+    calls = []
+    for name in ("begin", "complete", "release"):
+        original = getattr(IdempotentRequest, name)
+
+        def recorded(self, *args, _name=name, _original=original, **kwargs):
+            calls.append((_name, on_event_loop()))
+            return _original(self, *args, **kwargs)
+
+        monkeypatch.setattr(IdempotentRequest, name, recorded)
+
+    files = {"file": ("i.png", make_png_bytes(), "image/png")}
+    test_client.post("/images", data={"user_id": "idem6"}, files=files, headers={"Idempotency-Key": "loop-1"})
+    bad = {"file": ("i.png", b"not an image", "image/png")}
+    test_client.post("/images", data={"user_id": "idem6"}, files=bad, headers={"Idempotency-Key": "loop-2"})
+
+    assert [name for name, _ in calls] == ["begin", "complete", "begin", "release"]
+    assert not any(blocking for _, blocking in calls)
+
+
+def test_delete_retry_is_replayed(test_client, make_png_bytes):
+    files = {"file": ("d.png", make_png_bytes(), "image/png")}
+    image_id = test_client.post("/images", data={"user_id": "idem5"}, files=files).json()["image_id"]
+    headers = {"Idempotency-Key": "del-1"}
+
+    assert test_client.delete(f"/images/{image_id}", headers=headers).status_code == 204
+    replay = test_client.delete(f"/images/{image_id}", headers=headers)
+    assert replay.status_code == 204
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    # without the key the image is simply gone
+    assert test_client.delete(f"/images/{image_id}").status_code == 404
+
+
+def test_concurrent_duplicates_are_collapsed(test_client):
+    from app.main import app
+    db = app.state.db
+    owner = IdempotentRequest(db, "upload#u", "k", fingerprint("same"))
+    assert owner.begin() is None
+
+    replays = []
+    waiter = threading.Thread(
+        target=lambda: replays.append(IdempotentRequest(db, "upload#u", "k", fingerprint("same")).begin())
+    )
+    waiter.start()
+    owner.complete(201, {"image_id": "x"})
+    waiter.join(timeout=5)
+
+    assert replays[0].status_code == 201
+    assert replays[0].body == '{"image_id": "x"}'
+
+
+def test_in_progress_duplicate_times_out(test_client, monkeypatch):
+    from app.main import app
+    from app import idempotency
+    monkeypatch.setattr(idempotency.settings, "idempotency_wait_seconds", 0.2)
+    db = app.state.db
+    assert IdempotentRequest(db, "s", "k", fingerprint(1)).begin() is None
+
+    with pytest.raises(ConflictException):
+        IdempotentRequest(db, "s", "k", fingerprint(1)).begin()
+    with pytest.raises(IdempotencyKeyReusedException):
+        IdempotentRequest(db, "s", "k", fingerprint(2)).begin()
+
+
+def test_expired_claim_can_be_taken_over(test_client, monkeypatch):
+    from app.main import app
+    from app import idempotency
+    monkeypatch.setattr(idempotency.settings, "idempotency_lease_seconds", -1)
+    db = app.state.db
+    crashed = IdempotentRequest(db, "s", "k2", fingerprint(1))
+    assert crashed.begin() is None
+
+    retry = IdempotentRequest(db, "s", "k2", fingerprint(1))
+    assert retry.begin() is None
+    # the crashed owner can no longer complete or release the key
+    crashed.complete(201, {"stale": True})
+    crashed.release()
+    assert db.get_idempotency_record("s#k2")["owner"] == retry.owner
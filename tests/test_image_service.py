@@ -3,7 +3,7 @@ import pytest
 from PIL import Image
 
 from app.image_service import service
-from app.routers.image_service import validate_image_bytes
+from app.routers.image_service import validate_image_bytes, inspect_image_bytes
 from app.exceptions import InvalidImageException, ImageNotFoundException
 
 
@@ -42,6 +42,93 @@ def test_validate_svg_invalid_root():
         validate_image_bytes(bad_svg, "image/svg+xml")
 
 
+def test_validate_svg_rejects_entity_declarations():
+    bomb = (
+        b'<?xml version="1.0"?><!DOCTYPE svg [<!ENTITY a "aaaaaaaaaa"><!ENTITY b "&a;&a;&a;&a;">]>'
+        b'<svg xmlns="http://www.w3.org/2000/svg"><text>&b;</text></svg>'
+    )
+    with pytest.raises(InvalidImageException, match="DTD"):
+        validate_image_bytes(bomb, "image/svg+xml")
+
+
+def test_validate_svg_allows_public_doctype():
+    svg = (
+        b'<?xml version="1.0" encoding="UTF-8"?>\n<!-- exported -->\n'
+        b'<!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN" "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">\n'
+        b'<svg xmlns="http://www.w3.org/2000/svg" width="10" height="20"></svg>'
+    )
+    info = inspect_image_bytes(svg, "image/svg+xml")
+    assert (info.width, info.height) == (10, 20)
+
+
+def test_validate_svg_stops_at_root_element():
+    # Nothing after the root start tag is parsed, so the body's size does not matter
+    svg = b'<svg xmlns="http://www.w3.org/2000/svg">' + b"<rect/>" * 500_000 + b"</svg>"
+    assert validate_image_bytes(svg, "image/svg+xml") == "image/svg+xml"
+
+
+def test_validate_svg_enforces_size_limits(monkeypatch):
+    from app.routers import image_service as image_router
+    monkeypatch.setattr(image_router.settings, "svg_max_bytes", 100)
+    with pytest.raises(InvalidImageException, match="exceeds"):
+        validate_image_bytes(b'<svg xmlns="http://www.w3.org/2000/svg">' + b" " * 100 + b"</svg>", "image/svg+xml")
+
+    monkeypatch.setattr(image_router.settings, "svg_max_bytes", 1_000_000)
+    monkeypatch.setattr(image_router.settings, "svg_max_prolog_bytes", 64)
+    padded = b"<!--" + b"x" * 200 + b'--><svg xmlns="http://www.w3.org/2000/svg"></svg>'
+    with pytest.raises(InvalidImageException, match="first 64 bytes"):
+        validate_image_bytes(padded, "image/svg+xml")
+
+
+def test_validate_svg_malformed():
+    with pytest.raises(InvalidImageException):
+        validate_image_bytes(b"<<svg", "image/svg+xml")
+    with pytest.raises(InvalidImageException):
+        validate_image_bytes(b"", "image/svg+xml")
+
+
+def test_inspect_extracts_dimensions_and_exif():
+    img = Image.new("RGB", (40, 20), color="red")
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotated 90 degrees when displayed
+    exif[0x010F] = "ACME"  # Make
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", exif=exif)
+
+    info = inspect_image_bytes(buf.getvalue(), "image/jpeg")
+    assert (info.width, info.height, info.frame_count) == (40, 20, 1)
+    assert info.orientation == "portrait"
+    assert info.exif["Make"] == "ACME"
+
+
+def test_inspect_counts_frames_and_svg_dimensions():
+    frames = [Image.new("RGB", (8, 8), color=c) for c in ("red", "blue", "green")]
+    buf = io.BytesIO()
+    frames[0].save(buf, format="GIF", save_all=True, append_images=frames[1:])
+    info = inspect_image_bytes(buf.getvalue(), "image/gif")
+    assert info.frame_count == 3
+    assert info.orientation == "square"
+    assert info.exif is None
+
+    svg = b'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 300 100"></svg>'
+    info = inspect_image_bytes(svg, "image/svg+xml")
+    assert (info.width, info.height, info.orientation) == (300, 100, "landscape")
+
+
+@pytest.mark.parametrize("root", [
+    'viewBox="0 0 1e999 10"',
+    'viewBox="0 0 inf nan"',
+    'viewBox="0 0 -300 100"',
+    'width="1' + "0" * 41 + '" height="10"',
+    'width="300" height="99999999999"',
+])
+def test_inspect_ignores_unusable_svg_dimensions(root):
+    svg = f'<svg xmlns="http://www.w3.org/2000/svg" {root}></svg>'.encode()
+    info = inspect_image_bytes(svg, "image/svg+xml")
+    assert None in (info.width, info.height)
+    assert info.orientation is None
+
+
 def test_validate_unsupported_type():
     with pytest.raises(InvalidImageException):
         validate_image_bytes(b"fake", "application/pdf")
@@ -75,6 +162,43 @@ def test_save_image_and_meta_success(mocker):
     assert image.s3_key.endswith("test.png")
     mock_s3.upload.assert_called_once()
     mock_db.put_metadata.assert_called_once()
+    mock_db.add_user_stats.assert_called_once_with("user1", {
+        "image_count": 1, "total_bytes": 5, "count:image/png": 1, "bytes:image/png": 5,
+    })
+
+
+def test_save_image_and_meta_hashed_key_layout(mocker, monkeypatch):
+    from app.image_service import keys
+    monkeypatch.setattr(keys.settings, "s3_key_layout", "hashed")
+    monkeypatch.setattr(keys.settings, "s3_key_hash_chars", 3)
+    image = service.save_image_and_meta(
+        db=mocker.Mock(), s3=mocker.Mock(), fileobj=io.BytesIO(b"x"), filename="a_b.png",
+        content_type="image/png", size=1, user_id="user1", title=None, description=None, tags=[],
+    )
+    prefix, user_id, day, name = image.s3_key.split("/")
+    object_id = name.split("_", 1)[0]
+    assert prefix == keys.hash_prefix(object_id, 3) and len(prefix) == 3
+    assert user_id == "user1"
+    assert day == image.uploaded_at.strftime("%Y%m%d")
+    assert name.endswith("_a_b.png")
+
+
+def test_unknown_key_layout_is_rejected(monkeypatch):
+    from datetime import datetime, timezone
+    from app.image_service import keys
+    monkeypatch.setattr(keys.settings, "s3_key_layout", "nope")
+    with pytest.raises(ValueError):
+        keys.build_s3_key("u", datetime.now(timezone.utc), "id", "f.png")
+
+
+@pytest.mark.parametrize("env", [{"S3_KEY_LAYOUT": "hashd"}, {"S3_KEY_HASH_CHARS": "0"}, {"S3_KEY_HASH_CHARS": "33"}])
+def test_invalid_key_settings_fail_at_load(monkeypatch, env):
+    from pydantic import ValidationError
+    from app.settings import Settings
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    with pytest.raises(ValidationError):
+        Settings()
 
 
 def test_save_image_and_meta_s3_error(mocker):
@@ -118,6 +242,67 @@ def test_fetch_images_without_tag(mocker):
     assert resp["Items"][0]["image_id"] == "2"
 
 
+def test_fetch_images_user_time_range_uses_index(mocker):
+    from datetime import datetime, timezone
+    mock_db = mocker.Mock()
+    mock_db.query_metadata.return_value = {"Items": [{"image_id": "3"}]}
+
+    since = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    resp = service.fetch_images(mock_db, user_id="u3", since=since, order="asc", limit=5)
+
+    assert resp["Items"][0]["image_id"] == "3"
+    mock_db.scan_metadata.assert_not_called()
+    args, kwargs = mock_db.query_metadata.call_args
+    assert args[0] == "UserTimeIndex"
+    assert kwargs["ascending"] is True
+
+
+def test_fetch_images_global_time_range_pages_across_day_buckets(mocker):
+    from datetime import datetime, timezone
+    mock_db = mocker.Mock()
+    # newest day has one item, the previous day has two
+    mock_db.query_metadata.side_effect = [
+        {"Items": [{"image_id": "c"}]},
+        {"Items": [{"image_id": "b"}], "LastEvaluatedKey": {"upload_day": "20240101", "uploaded_ts": 2, "image_id": "b"}},
+    ]
+
+    resp = service.fetch_images(
+        mock_db,
+        since=datetime(2024, 1, 1, tzinfo=timezone.utc),
+        until=datetime(2024, 1, 2, 23, 0, tzinfo=timezone.utc),
+        limit=2,
+    )
+
+    assert [it["image_id"] for it in resp["Items"]] == ["c", "b"]
+    assert resp["LastEvaluatedKey"]["upload_day"] == "20240101"
+    days = [call.args[1].get_expression()["values"][0].get_expression()["values"][1] for call in mock_db.query_metadata.call_args_list]
+    assert days == ["20240102", "20240101"]
+
+
+def test_fetch_images_global_time_range_token_on_bucket_boundary(mocker):
+    from datetime import datetime, timezone
+    mock_db = mocker.Mock()
+    mock_db.query_metadata.return_value = {"Items": [{"image_id": "c"}]}
+
+    resp = service.fetch_images(
+        mock_db,
+        since=datetime(2024, 1, 1, tzinfo=timezone.utc),
+        until=datetime(2024, 1, 2, tzinfo=timezone.utc),
+        limit=1,
+    )
+    assert resp["LastEvaluatedKey"] == {"upload_day": "20240101"}
+
+    # resuming from the token starts at the next bucket without an ExclusiveStartKey
+    service.fetch_images(
+        mock_db,
+        since=datetime(2024, 1, 1, tzinfo=timezone.utc),
+        until=datetime(2024, 1, 2, tzinfo=timezone.utc),
+        limit=1,
+        exclusive_start_key={"upload_day": "20240101"},
+    )
+    assert mock_db.query_metadata.call_args.kwargs["exclusive_start_key"] is None
+
+
 # ------------------------------
 # get_image_meta
 # ------------------------------
@@ -143,11 +328,18 @@ def test_get_image_meta_not_found(mocker):
 def test_remove_image_success(mocker):
     mock_db = mocker.Mock()
     mock_s3 = mocker.Mock()
-    mock_db.get_metadata.return_value = {"image_id": "1", "s3_key": "k"}
+    mock_db.get_metadata.return_value = {
+        "image_id": "1", "s3_key": "k", "user_id": "u1", "content_type": "image/png", "size": 5,
+    }
     result = service.remove_image(mock_db, mock_s3, "1")
     assert result is True
-    mock_s3.delete.assert_called_once()
-    mock_db.delete_metadata.assert_called_once()
+    # Soft delete: only a tombstone is written, storage is purged later
+    mock_db.mark_deleted.assert_called_once()
+    mock_s3.delete_many.assert_not_called()
+    mock_db.batch_delete_metadata.assert_not_called()
+    mock_db.add_user_stats.assert_called_once_with("u1", {
+        "image_count": -1, "total_bytes": -5, "count:image/png": -1, "bytes:image/png": -5,
+    })
 
 
 def test_remove_image_not_found(mocker):
@@ -155,4 +347,121 @@ def test_remove_image_not_found(mocker):
     mock_s3 = mocker.Mock()
     mock_db.get_metadata.return_value = None
     with pytest.raises(ImageNotFoundException):
-        service.remove_image(mock_db, mock_s3, "doesnotexist")
\ No newline at end of file
+        service.remove_image(mock_db, mock_s3, "doesnotexist")
+
+
+def test_get_image_meta_tombstoned(mocker):
+    mock_db = mocker.Mock()
+    mock_db.get_metadata.return_value = {"image_id": "1", "deleted_at": "2024-01-01T00:00:00+00:00"}
+    with pytest.raises(ImageNotFoundException):
+        service.get_image_meta(mock_db, "1")
+
+
+# ------------------------------
+# purge_deleted_images
+# ------------------------------
+
+def test_purge_deleted_images_batches(mocker):
+    mock_db = mocker.Mock()
+    mock_s3 = mocker.Mock()
+    mock_db.query_tombstones.return_value = [
+        {"image_id": "1", "s3_key": "k1"},
+        {"image_id": "2", "s3_key": "k2"},
+    ]
+    mock_s3.delete_many.return_value = []
+    mock_db.batch_delete_metadata.return_value = []
+
+    purged = service.purge_deleted_images(mock_db, mock_s3, grace_period_seconds=0, batch_size=10)
+
+    assert purged == 2
+    mock_s3.delete_many.assert_called_once_with(["k1", "k2"])
+    mock_db.batch_delete_metadata.assert_called_once_with(["1", "2"])
+
+
+def test_purge_deleted_images_keeps_failed_objects(mocker):
+    mock_db = mocker.Mock()
+    mock_s3 = mocker.Mock()
+    mock_db.query_tombstones.return_value = [
+        {"image_id": "1", "s3_key": "k1"},
+        {"image_id": "2", "s3_key": "k2"},
+    ]
+    mock_s3.delete_many.return_value = ["k2"]
+    mock_db.batch_delete_metadata.return_value = []
+
+    purged = service.purge_deleted_images(mock_db, mock_s3, grace_period_seconds=0, batch_size=10)
+
+    assert purged == 1
+    mock_db.batch_delete_metadata.assert_called_once_with(["1"])
+
+
+def test_purge_deleted_images_nothing_to_do(mocker):
+    mock_db = mocker.Mock()
+    mock_s3 = mocker.Mock()
+    mock_db.query_tombstones.return_value = []
+    assert service.purge_deleted_images(mock_db, mock_s3, grace_period_seconds=0, batch_size=10) == 0
+    mock_s3.delete_many.assert_not_called()
+
+# ------------------------------
+# user stats
+# ------------------------------
+
+def test_save_image_and_meta_survives_stats_failure(mocker):
+    from botocore.exceptions import ClientError
+    mock_db = mocker.Mock()
+    mock_s3 = mocker.Mock()
+    mock_db.add_user_stats.side_effect = ClientError({"Error": {"Code": "ThrottlingException"}}, "UpdateItem")
+
+    image = service.save_image_and_meta(
+        db=mock_db, s3=mock_s3, fileobj=io.BytesIO(b"12345"), filename="a.png",
+        content_type="image/png", size=5, user_id="user1", title=None, description=None, tags=[],
+    )
+
+    assert image.user_id == "user1"
+    mock_db.put_metadata.assert_called_once()
+
+
+def test_get_user_stats_formats_breakdown(mocker):
+    from decimal import Decimal
+    mock_db = mocker.Mock()
+    mock_db.get_user_stats.return_value = {
+        "user_id": "u1", "image_count": Decimal(2), "total_bytes": Decimal(30),
+        "count:image/png": Decimal(2), "bytes:image/png": Decimal(30),
+        "count:image/gif": Decimal(0), "bytes:image/gif": Decimal(0),
+    }
+
+    stats = service.get_user_stats(mock_db, "u1")
+
+    assert stats == {
+        "user_id": "u1", "image_count": 2, "total_bytes": 30,
+        "content_types": {"image/png": {"count": 2, "bytes": 30}},
+    }
+
+
+def test_reconcile_user_stats_adds_only_drift(mocker):
+    from decimal import Decimal
+    mock_db = mocker.Mock()
+    mock_db.scan_metadata.return_value = {"Items": [
+        {"image_id": "1", "user_id": "u1", "content_type": "image/png", "size": Decimal(10)},
+        {"image_id": "2", "user_id": "u1", "content_type": "image/png", "size": Decimal(20)},
+        {"image_id": "3", "user_id": "u2", "content_type": "image/gif", "size": Decimal(5)},
+    ]}
+    mock_db.scan_user_stats.return_value = {"Items": [
+        # u1 missed one upload, u2 is correct, u3 has no images left
+        {"user_id": "u1", "image_count": Decimal(1), "total_bytes": Decimal(10),
+         "count:image/png": Decimal(1), "bytes:image/png": Decimal(10), "version": Decimal(4)},
+        {"user_id": "u2", "image_count": Decimal(1), "total_bytes": Decimal(5),
+         "count:image/gif": Decimal(1), "bytes:image/gif": Decimal(5)},
+        {"user_id": "u3", "image_count": Decimal(1), "total_bytes": Decimal(7),
+         "count:image/jpeg": Decimal(1), "bytes:image/jpeg": Decimal(7)},
+    ]}
+
+    assert service.reconcile_user_stats(mock_db) == 2
+
+    calls = {c.args[0]: c.args[1] for c in mock_db.add_user_stats.call_args_list}
+    assert calls == {
+        "u1": {"image_count": 1, "total_bytes": 20, "count:image/png": 1, "bytes:image/png": 20},
+        "u3": {"image_count": -1, "total_bytes": -7, "count:image/jpeg": -1, "bytes:image/jpeg": -7},
+    }
+    # corrections only apply to the versions that were read
+    versions = {c.args[0]: c.kwargs["expected_version"] for c in mock_db.add_user_stats.call_args_list}
+    assert versions == {"u1": 4, "u3": 0}
@@ -0,0 +1,55 @@
+
+from app.metrics import instrumented
+from prometheus_client import REGISTRY
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+# ------------------------------
+# instrumented
+# ------------------------------
+
+def test_instrumented_records_success_and_error():
+    class Fake:
+        @instrumented("fake")
+        def ok(self):
+            return 1
+
+        @instrumented("fake")
+        def boom(self):
+            raise ValueError("x")
+
+    before_ok = sample("image_service_backend_call_duration_seconds_count", backend="fake", operation="ok", outcome="success")
+    before_err = sample("image_service_backend_errors_total", backend="fake", operation="boom", error="ValueError")
+
+    assert Fake().ok() == 1
+    try:
+        Fake().boom()
+    except ValueError:
+        pass
+
+    assert sample("image_service_backend_call_duration_seconds_count", backend="fake", operation="ok", outcome="success") == before_ok + 1
+    assert sample("image_service_backend_errors_total", backend="fake", operation="boom", error="ValueError") == before_err + 1
+
+
+# ------------------------------
+# /metrics
+# ------------------------------
+
+def test_metrics_endpoint_exposes_request_and_backend_metrics(test_client, make_png_bytes):
+    files = {"file": ("m.png", make_png_bytes(), "image/png")}
+    upload = test_client.post("/images", data={"user_id": "metrics"}, files=files)
+    img_id = upload.json()["image_id"]
+    test_client.get(f"/images/{img_id}")
+
+    resp = test_client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain")
+    text = resp.text
+    assert 'route="/images/{image_id}"' in text
+    assert 'backend="s3",operation="upload",outcome="success"' in text
+    assert 'backend="dynamodb",operation="get_metadata",outcome="success"' in text
+    assert "image_service_upload_bytes_count" in text
+    assert "image_service_validation_duration_seconds_count" in text
@@ -0,0 +1,47 @@
+import pstats
+
+from app import profiling
+
+
+def test_profiling_disabled_by_default(test_client):
+    resp = test_client.get("/images", headers={"X-Profile": "1"})
+    assert resp.status_code == 200
+    assert "X-Profile-Id" not in resp.headers
+
+
+def test_profile_requested_by_header(test_client, monkeypatch, tmp_path, make_png_bytes):
+    monkeypatch.setattr(profiling.settings, "profiling_enabled", True)
+    monkeypatch.setattr(profiling.settings, "profiling_dir", str(tmp_path))
+
+    files = {"file": ("p.png", make_png_bytes(), "image/png")}
+    resp = test_client.post("/images", data={"user_id": "prof"}, files=files, headers={"X-Profile": "1"})
+    assert resp.status_code == 201
+    profile_id = resp.headers["X-Profile-Id"]
+
+    stats = pstats.Stats(str(tmp_path / f"{profile_id}.prof"))
+    functions = {name for (_, _, name) in stats.stats}
+    assert "inspect_image_bytes" in functions
+    assert "save_image_and_meta" in functions
+
+
+def test_profile_of_sync_handler_runs_in_threadpool(test_client, monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling.settings, "profiling_enabled", True)
+    monkeypatch.setattr(profiling.settings, "profiling_dir", str(tmp_path))
+    monkeypatch.setattr(profiling.settings, "profiling_sample_rate", 1.0)
+
+    resp = test_client.get("/images")
+    profile_id = resp.headers["X-Profile-Id"]
+    stats = pstats.Stats(str(tmp_path / f"{profile_id}.prof"))
+    assert "fetch_images" in {name for (_, _, name) in stats.stats}
+
+
+def test_profiling_budget_bounds_overhead(test_client, monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling.settings, "profiling_enabled", True)
+    monkeypatch.setattr(profiling.settings, "profiling_dir", str(tmp_path))
+    monkeypatch.setattr(profiling.settings, "profiling_max_per_minute", 1)
+    monkeypatch.setattr(profiling, "_budget", None)
+
+    first = test_client.get("/images", headers={"X-Profile": "1"})
+    second = test_client.get("/images", headers={"X-Profile": "1"})
+    assert "X-Profile-Id" in first.headers
+    assert "X-Profile-Id" not in second.headers
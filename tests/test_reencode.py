@@ -0,0 +1,121 @@
+import io
+
+import pytest
+from PIL import Image
+
+from app.image_service import reencode as reencode_module
+from app.image_service.models import ImageInfo
+from app.image_service.reencode import apply_upload_policy, stored_filename
+
+
+@pytest.fixture
+def policy(monkeypatch):
+    def configure(**values):
+        for name, value in values.items():
+            monkeypatch.setattr(reencode_module.settings, name, value)
+    configure(upload_reencode_format=None, upload_strip_metadata=False,
+              upload_reencode_lossless=False, upload_reencode_quality=80)
+    return configure
+
+
+def screenshot_png():
+    # Flat regions like a UI screenshot, saved without compression
+    img = Image.new("RGB", (200, 120), (240, 240, 240))
+    for y in range(0, 120, 20):
+        img.paste((30, 90, 200), (10, y, 190, y + 8))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", compress_level=0)
+    return buf.getvalue()
+
+
+def jpeg_with_exif(orientation=None):
+    img = Image.new("RGB", (64, 32), (200, 10, 10))
+    exif = Image.Exif()
+    exif[0x010F] = "Canon"
+    exif[0x9286] = "x" * 20000  # large comment block
+    if orientation:
+        exif[0x0112] = orientation
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", exif=exif.tobytes(), quality=90)
+    return buf.getvalue()
+
+
+def test_policy_off_stores_original(policy):
+    data = screenshot_png()
+    info = ImageInfo(content_type="image/png", width=200, height=120)
+    assert apply_upload_policy(data, info) == (data, info)
+
+
+def test_reencode_to_lossless_webp_when_smaller(policy):
+    policy(upload_reencode_format="webp", upload_reencode_lossless=True)
+    data = screenshot_png()
+    stored, info = apply_upload_policy(data, ImageInfo(content_type="image/png", width=200, height=120))
+
+    assert info.content_type == "image/webp"
+    assert len(stored) < len(data)
+    decoded = Image.open(io.BytesIO(stored))
+    assert decoded.format == "WEBP" and decoded.size == (200, 120)
+    # lossless: identical pixels
+    assert decoded.convert("RGB").tobytes() == Image.open(io.BytesIO(data)).convert("RGB").tobytes()
+
+
+def test_keeps_original_when_not_smaller(policy):
+    policy(upload_reencode_format="webp", upload_reencode_lossless=True)
+    # Noise at a low lossy quality: a lossless copy is always larger
+    buf = io.BytesIO()
+    Image.frombytes("RGB", (64, 64), bytes((i * 7919) % 251 for i in range(64 * 64 * 3))).save(buf, format="WEBP", quality=5)
+    data = buf.getvalue()
+    info = ImageInfo(content_type="image/webp", width=64, height=64)
+    assert apply_upload_policy(data, info) == (data, info)
+
+
+def test_strip_metadata_keeps_format_and_orientation(policy):
+    policy(upload_strip_metadata=True)
+    data = jpeg_with_exif(orientation=6)
+    stored, info = apply_upload_policy(data, ImageInfo(content_type="image/jpeg", width=64, height=32))
+
+    assert info.content_type == "image/jpeg"
+    assert len(stored) < len(data)
+    decoded = Image.open(io.BytesIO(stored))
+    assert not decoded.getexif()
+    # the rotation was applied to the pixels before the orientation tag was dropped
+    assert decoded.size == (32, 64) == (info.width, info.height)
+
+
+def test_stripped_upload_drops_stored_exif(policy):
+    policy(upload_strip_metadata=True)
+    original = ImageInfo(content_type="image/jpeg", width=64, height=32, orientation="portrait",
+                         exif={"Make": "Canon", "Orientation": "6"})
+    _, info = apply_upload_policy(jpeg_with_exif(orientation=6), original)
+    assert info.exif is None
+    assert info.orientation == "portrait"
+
+    # Without stripping, the EXIF block is carried over to the new file
+    policy(upload_strip_metadata=False, upload_reencode_format="webp", upload_reencode_lossless=False)
+    _, info = apply_upload_policy(screenshot_png(), ImageInfo(content_type="image/png", exif={"Make": "Canon"}))
+    assert info.exif == {"Make": "Canon"}
+
+
+def test_stored_filename_matches_the_stored_format():
+    assert stored_filename("shot.png", "image/webp") == "shot.webp"
+    assert stored_filename("Photo.JPEG", "image/jpeg") == "Photo.JPEG"
+    assert stored_filename("photo.jpeg", "image/png") == "photo.png"
+    assert stored_filename("scan", "image/webp") == "scan.webp"
+    assert stored_filename("release.v1.2", "image/webp") == "release.v1.2.webp"
+
+
+def test_animated_gif_to_webp_keeps_frames(policy):
+    policy(upload_reencode_format="webp", upload_reencode_lossless=True)
+    frames = [Image.new("RGB", (40, 40), (i * 60, 0, 0)) for i in range(4)]
+    buf = io.BytesIO()
+    frames[0].save(buf, format="GIF", save_all=True, append_images=frames[1:])
+    stored, info = apply_upload_policy(buf.getvalue(), ImageInfo(content_type="image/gif", width=40, height=40))
+    assert info.content_type == "image/webp"
+    assert Image.open(io.BytesIO(stored)).n_frames == 4
+
+
+def test_svg_is_never_reencoded(policy):
+    policy(upload_reencode_format="webp", upload_strip_metadata=True)
+    data = b'<svg xmlns="http://www.w3.org/2000/svg"></svg>'
+    info = ImageInfo(content_type="image/svg+xml")
+    assert apply_upload_policy(data, info) == (data, info)
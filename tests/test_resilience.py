@@ -0,0 +1,199 @@
+import threading
+import time
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+from prometheus_client import REGISTRY
+
+from app import resilience
+from app.resilience import CircuitBreaker, CircuitOpenError, DeadlineExceededError, resilient
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def client_error(code, status=400):
+    return ClientError({"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": status}}, "Op")
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(resilience, "_trackers", {})
+    monkeypatch.setattr(resilience.settings, "circuit_breaker_min_calls", 4)
+    monkeypatch.setattr(resilience.settings, "circuit_breaker_error_rate", 0.5)
+    monkeypatch.setattr(resilience.settings, "circuit_breaker_open_seconds", 60)
+
+
+# ------------------------------
+# is_backend_failure
+# ------------------------------
+
+def test_only_backend_errors_count_as_failures():
+    assert resilience.is_backend_failure(EndpointConnectionError(endpoint_url="http://x"))
+    assert resilience.is_backend_failure(client_error("ProvisionedThroughputExceededException"))
+    assert resilience.is_backend_failure(client_error("Whatever", status=503))
+    assert not resilience.is_backend_failure(client_error("ConditionalCheckFailedException"))
+    assert not resilience.is_backend_failure(CircuitOpenError(backend="x"))
+    assert not resilience.is_backend_failure(ValueError())
+
+
+# ------------------------------
+# CircuitBreaker
+# ------------------------------
+
+def test_breaker_opens_on_error_spike_and_fails_fast():
+    calls = []
+
+    @resilient("test-open")
+    def flaky():
+        calls.append(1)
+        raise EndpointConnectionError(endpoint_url="http://x")
+
+    for _ in range(4):
+        with pytest.raises(EndpointConnectionError):
+            flaky()
+    assert resilience.breaker("test-open").state == CircuitBreaker.OPEN
+    assert sample("image_service_circuit_breaker_state", backend="test-open") == CircuitBreaker.OPEN
+
+    before = sample("image_service_circuit_breaker_rejections_total", backend="test-open")
+    with pytest.raises(CircuitOpenError):
+        flaky()
+    assert len(calls) == 4
+    assert sample("image_service_circuit_breaker_rejections_total", backend="test-open") == before + 1
+
+
+def test_breaker_ignores_request_errors():
+    @resilient("test-request-errors")
+    def conditional():
+        raise client_error("ConditionalCheckFailedException")
+
+    for _ in range(10):
+        with pytest.raises(ClientError):
+            conditional()
+    assert resilience.breaker("test-request-errors").state == CircuitBreaker.CLOSED
+
+
+def test_breaker_half_open_probe_closes_or_reopens(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    circuit = resilience.breaker("test-probe")
+    for _ in range(4):
+        circuit.before_call()
+        circuit.record(True)
+    assert circuit.state == CircuitBreaker.OPEN
+
+    now[0] += 61
+    circuit.before_call()  # the probe
+    with pytest.raises(CircuitOpenError):
+        circuit.before_call()  # others wait for the probe
+    circuit.record(True)
+    assert circuit.state == CircuitBreaker.OPEN
+
+    now[0] += 61
+    circuit.before_call()
+    circuit.record(False)
+    assert circuit.state == CircuitBreaker.CLOSED
+    circuit.before_call()
+
+
+def test_breaker_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(resilience.settings, "circuit_breaker_enabled", False)
+    circuit = resilience.breaker("test-disabled")
+    for _ in range(10):
+        circuit.before_call()
+        circuit.record(True)
+    assert circuit.state == CircuitBreaker.CLOSED
+
+
+# ------------------------------
+# Hedged reads
+# ------------------------------
+
+def test_slow_read_is_hedged_and_hedge_wins(monkeypatch):
+    monkeypatch.setattr(resilience.settings, "storage_hedge_initial_delay_seconds", 0.02)
+    monkeypatch.setattr(resilience.settings, "storage_read_deadline_seconds", 5)
+    attempts = []
+    release = threading.Event()
+
+    @resilient("test-hedge", hedged=True)
+    def read(key):
+        attempts.append(key)
+        if len(attempts) == 1:
+            release.wait(5)  # the first attempt hangs
+            return "slow"
+        return "fast"
+
+    before = sample("image_service_hedged_reads_total", backend="test-hedge", operation="read", result="won")
+    start = time.monotonic()
+    assert read("k") == "fast"
+    assert time.monotonic() - start < 1
+    assert attempts == ["k", "k"]
+    assert sample("image_service_hedged_reads_total", backend="test-hedge", operation="read", result="won") == before + 1
+    release.set()
+
+
+def test_fast_reads_are_not_hedged_and_budget_limits_hedges(monkeypatch):
+    monkeypatch.setattr(resilience.settings, "storage_hedge_initial_delay_seconds", 0.01)
+    monkeypatch.setattr(resilience.settings, "storage_hedge_max_ratio", 0.001)
+    attempts = []
+
+    @resilient("test-budget", hedged=True)
+    def read():
+        attempts.append(1)
+        if len(attempts) > 1:
+            time.sleep(0.05)
+        return len(attempts)
+
+    read()
+    assert len(attempts) == 1
+    # The initial budget allows one hedge; the next one takes another 1000 reads to earn
+    read()
+    read()
+    assert len(attempts) == 4
+
+
+def test_hedge_delay_adapts_to_observed_latency(monkeypatch):
+    monkeypatch.setattr(resilience.settings, "storage_hedge_percentile", 90)
+    tracker = resilience.LatencyTracker()
+    assert tracker.hedge_delay() == resilience.settings.storage_hedge_initial_delay_seconds
+    for i in range(160):
+        tracker.observe(i / 1000)
+    assert tracker.hedge_delay() == pytest.approx(0.144)
+
+
+def test_read_deadline(monkeypatch):
+    monkeypatch.setattr(resilience.settings, "storage_read_deadline_seconds", 0.05)
+    monkeypatch.setattr(resilience.settings, "storage_hedge_max_ratio", 0.0)
+    release = threading.Event()
+
+    @resilient("test-deadline", hedged=True)
+    def read():
+        release.wait(5)
+
+    with pytest.raises(DeadlineExceededError):
+        read()
+    release.set()
+
+
+def test_read_errors_propagate():
+    @resilient("test-errors", hedged=True)
+    def read():
+        raise client_error("ResourceNotFoundException")
+
+    with pytest.raises(ClientError):
+        read()
+
+
+# ------------------------------
+# Routes
+# ------------------------------
+
+def test_open_circuit_fails_requests_fast(test_client):
+    resp = test_client.post("/images", data={"user_id": "cb1"}, files={"file": ("a.svg", b"<svg/>", "image/svg+xml")})
+    image_id = resp.json()["image_id"]
+
+    resilience.breaker("dynamodb")._trip(time.monotonic())
+    resp = test_client.get(f"/images/{image_id}")
+    assert resp.status_code == 500
+    assert "open" in resp.json()["detail"]
@@ -1,4 +1,5 @@
 import io
+from datetime import datetime, timedelta, timezone
 from PIL import Image
 
 
@@ -27,6 +28,41 @@ def test_upload_image_success(test_client):
     assert body["user_id"] == "u1"
 
 
+def test_upload_svg_with_huge_declared_size(test_client):
+    svg = b'<svg xmlns="http://www.w3.org/2000/svg" width="1' + b"0" * 41 + b'" height="10"></svg>'
+    files = {"file": ("big.svg", svg, "image/svg+xml")}
+    resp = test_client.post("/images", data={"user_id": "svg1"}, files=files)
+    assert resp.status_code == 201
+    meta = test_client.get(f"/images/{resp.json()['image_id']}").json()
+    assert meta["width"] is None and meta["height"] == 10
+
+
+def test_upload_validation_and_storage_run_off_the_event_loop(test_client, monkeypatch):
+    import asyncio
+    from app.routers import image_service as router
+
+    def on_event_loop():
+        try:
+            asyncio.get_running_loop()
+            return True
+        except RuntimeError:
+            return False
+
+    calls = []
+    for name in ("inspect_image_bytes", "save_image_and_meta"):
+        original = getattr(router, name)
+
+        def recorded(*args, _name=name, _original=original, **kwargs):
+            calls.append((_name, on_event_loop()))
+            return _original(*args, **kwargs)
+
+        monkeypatch.setattr(router, name, recorded)
+
+    files = {"file": ("i.png", make_png_bytes(), "image/png")}
+    assert test_client.post("/images", data={"user_id": "loop1"}, files=files).status_code == 201
+    assert calls == [("inspect_image_bytes", False), ("save_image_and_meta", False)]
+
+
 def test_upload_invalid_file_type(test_client):
     files = {"file": ("f.txt", b"notimg", "text/plain")}
     resp = test_client.post("/images", data={"user_id": "u1"}, files=files)
@@ -54,6 +90,84 @@ def test_get_and_delete_image(test_client):
     assert delete.status_code == 204
 
 
+def test_deleted_image_is_hidden_then_purged(test_client):
+    from app.main import app
+    from app.image_service.service import purge_deleted_images
+
+    data = make_png_bytes()
+    files = {"file": ("gc.png", data, "image/png")}
+    upload = test_client.post("/images", data={"user_id": "gc1"}, files=files)
+    img_id = upload.json()["image_id"]
+
+    assert test_client.delete(f"/images/{img_id}").status_code == 204
+
+    # tombstoned images are hidden from reads and cannot be deleted twice
+    assert test_client.get(f"/images/{img_id}").status_code == 404
+    assert test_client.delete(f"/images/{img_id}").status_code == 404
+    listed = test_client.get("/images", params={"user_id": "gc1"}).json()["images"]
+    assert img_id not in [it["image_id"] for it in listed]
+
+    # the collector purges both the object and the item
+    purged = purge_deleted_images(app.state.db, app.state.s3, grace_period_seconds=0, batch_size=10)
+    assert purged == 1
+    assert app.state.db.get_metadata(img_id) is None
+
+
+def test_user_stats_track_uploads_and_deletes(test_client):
+    from app.main import app
+    from app.image_service.service import reconcile_user_stats
+
+    data = make_png_bytes()
+    files = {"file": ("s.png", data, "image/png")}
+    first = test_client.post("/images", data={"user_id": "stats1"}, files=files).json()["image_id"]
+    test_client.post("/images", data={"user_id": "stats1"}, files=files)
+
+    stats = test_client.get("/images/users/stats1/stats").json()
+    assert stats["image_count"] == 2
+    assert stats["total_bytes"] == 2 * len(data)
+    assert stats["content_types"] == {"image/png": {"count": 2, "bytes": 2 * len(data)}}
+
+    assert test_client.delete(f"/images/{first}").status_code == 204
+    assert test_client.get("/images/users/stats1/stats").json()["image_count"] == 1
+
+    # drift is repaired by reconciliation
+    app.state.db.add_user_stats("stats1", {"image_count": 5})
+    reconcile_user_stats(app.state.db)
+    assert test_client.get("/images/users/stats1/stats").json()["image_count"] == 1
+
+    empty = test_client.get("/images/users/nobody/stats").json()
+    assert empty == {"user_id": "nobody", "image_count": 0, "total_bytes": 0, "content_types": {}}
+
+
+def test_reconcile_skips_users_updated_meanwhile_and_applies_once(test_client, monkeypatch):
+    from app.main import app
+    from app.image_service import service
+
+    files = {"file": ("s.png", make_png_bytes(), "image/png")}
+    test_client.post("/images", data={"user_id": "stats2"}, files=files)
+    db = app.state.db
+    db.add_user_stats("stats2", {"image_count": 3})  # drift
+
+    # A live update lands after the stats were read: the correction would undo it, so it is skipped
+    scan = service.iter_all_images
+
+    def racing_scan(db):
+        db.add_user_stats("stats2", {"image_count": 1})
+        return scan(db)
+
+    monkeypatch.setattr(service, "iter_all_images", racing_scan)
+    assert service.reconcile_user_stats(db) == 0
+    assert test_client.get("/images/users/stats2/stats").json()["image_count"] == 5
+
+    # Two reconcilers racing on the same snapshot: only the first correction applies
+    monkeypatch.setattr(service, "iter_all_images", scan)
+    snapshot = db.scan_user_stats()
+    monkeypatch.setattr(db, "scan_user_stats", lambda **kwargs: snapshot)
+    assert service.reconcile_user_stats(db) == 1
+    assert service.reconcile_user_stats(db) == 0
+    assert test_client.get("/images/users/stats2/stats").json()["image_count"] == 1
+
+
 def test_get_nonexistent_image(test_client):
     resp = test_client.get("/images/nope")
     assert resp.status_code == 404
@@ -82,6 +196,60 @@ def test_list_images(test_client):
     assert len(body["images"]) >= 2
 
 
+def test_list_images_time_range_and_order(test_client):
+    data = make_png_bytes()
+    files = {"file": ("t.png", data, "image/png")}
+    ids = [
+        test_client.post("/images", data={"user_id": "time1"}, files=files).json()["image_id"]
+        for _ in range(3)
+    ]
+
+    asc = test_client.get("/images", params={"user_id": "time1", "order": "asc"}).json()["images"]
+    assert [it["image_id"] for it in asc] == ids
+    desc = test_client.get("/images", params={"user_id": "time1", "order": "desc"}).json()["images"]
+    assert [it["image_id"] for it in desc] == ids[::-1]
+
+    # global query over day buckets, newest first, paginated
+    since = (datetime.now(timezone.utc) - timedelta(days=2)).isoformat()
+    page = test_client.get("/images", params={"since": since, "limit": 2}).json()
+    assert len(page["images"]) == 2
+    assert page["images"][0]["image_id"] == ids[-1]
+    rest = test_client.get(
+        "/images", params={"since": since, "limit": 2, "exclusive_start_key": page["next_token"]}
+    ).json()
+    assert rest["images"][0]["image_id"] == ids[0]
+
+    # nothing uploaded before 2000
+    old = test_client.get("/images", params={"user_id": "time1", "until": "2000-01-01T00:00:00"}).json()
+    assert old["images"] == []
+
+
+def test_list_images_filter_by_dimensions(test_client):
+    def png(size):
+        buf = io.BytesIO()
+        Image.new("RGB", size, color="blue").save(buf, format="PNG")
+        return buf.getvalue()
+
+    wide = test_client.post("/images", data={"user_id": "dims"}, files={"file": ("w.png", png((300, 100)), "image/png")}).json()["image_id"]
+    tall = test_client.post("/images", data={"user_id": "dims"}, files={"file": ("t.png", png((50, 200)), "image/png")}).json()["image_id"]
+
+    item = test_client.get(f"/images/{wide}").json()
+    assert (item["width"], item["height"], item["orientation"]) == (300, 100, "landscape")
+
+    wide_only = test_client.get("/images", params={"user_id": "dims", "min_width": 200}).json()["images"]
+    assert [it["image_id"] for it in wide_only] == [wide]
+    portrait = test_client.get("/images", params={"user_id": "dims", "orientation": "portrait", "order": "asc"}).json()["images"]
+    assert [it["image_id"] for it in portrait] == [tall]
+
+
+def test_list_images_invalid_time_range(test_client):
+    resp = test_client.get("/images", params={"since": "2024-02-01T00:00:00", "until": "2024-01-01T00:00:00"})
+    assert resp.status_code == 400
+    assert test_client.get("/images", params={"order": "sideways"}).status_code == 422
+    # global ranges are bounded by LIST_MAX_LOOKBACK_DAYS
+    assert test_client.get("/images", params={"since": "2000-01-01T00:00:00Z"}).status_code == 400
+
+
 # ------------------------------
 # /images/{id}/download [GET presigned URL]
 # ------------------------------
@@ -138,3 +306,125 @@ def test_get_presigned_url_invalid_expiry(test_client):
     # try with expiry too long (more than 86400 seconds)
     resp = test_client.get(f"/images/{img_id}/download", params={"expires_in": 100000})
     assert resp.status_code == 422  # Validation error
+
+
+# ------------------------------
+# /images/export
+# ------------------------------
+
+def test_export_streams_ndjson(test_client, monkeypatch):
+    import gzip
+    import json
+    from app.routers import image_service as image_router
+
+    # small pages and several segments so the parallel scan actually pages
+    monkeypatch.setattr(image_router.settings, "export_page_size", 2)
+    monkeypatch.setattr(image_router.settings, "export_scan_segments", 3)
+    monkeypatch.setattr(image_router.settings, "export_buffered_pages", 1)
+
+    data = make_png_bytes()
+    uploaded = set()
+    for i in range(5):
+        files = {"file": (f"e{i}.png", data, "image/png")}
+        uploaded.add(test_client.post("/images", data={"user_id": "export1"}, files=files).json()["image_id"])
+
+    resp = test_client.get("/images/export", params={"user_id": "export1"})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    *lines, trailer = [json.loads(line) for line in resp.text.splitlines()]
+    assert len(lines) == len(uploaded)
+    assert {line["image_id"] for line in lines} == uploaded
+    assert all(line["user_id"] == "export1" for line in lines)
+    assert trailer == {"_export": {"complete": True, "count": len(uploaded)}}
+
+    resp = test_client.get("/images/export", params={"user_id": "export1", "gzip": "true"})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "application/gzip"
+    *lines, trailer = gzip.decompress(resp.content).decode().splitlines()
+    assert {json.loads(line)["image_id"] for line in lines} == uploaded
+    assert json.loads(trailer)["_export"]["complete"] is True
+
+
+def test_failed_export_ends_with_an_incomplete_trailer(test_client, monkeypatch):
+    import json
+    from botocore.exceptions import ClientError
+    from app.main import app
+
+    files = {"file": ("e.png", make_png_bytes(), "image/png")}
+    test_client.post("/images", data={"user_id": "export2"}, files=files)
+
+    def failing_scan(**kwargs):
+        raise ClientError({"Error": {"Code": "InternalServerError"}}, "Scan")
+
+    monkeypatch.setattr(app.state.db, "scan_metadata", failing_scan)
+
+    resp = test_client.get("/images/export", params={"user_id": "export2"})
+    assert resp.status_code == 200
+    trailer = json.loads(resp.text.splitlines()[-1])["_export"]
+    assert trailer["complete"] is False and trailer["count"] == 0
+    assert "Failed to export images" in trailer["error"]
+
+
+def test_list_reads_items_in_both_encodings(test_client, monkeypatch):
+    from app.image_service import encoding
+
+    data = make_png_bytes()
+    ids = []
+    for mode in ("legacy", "compact"):
+        monkeypatch.setattr(encoding.settings, "metadata_encoding", mode)
+        files = {"file": (f"{mode}.png", data, "image/png")}
+        resp = test_client.post("/images", data={"user_id": "enc1", "tags": "mixed"}, files=files)
+        ids.append(resp.json()["image_id"])
+
+    for params in ({"user_id": "enc1"}, {"user_id": "enc1", "tag": "mixed"},
+                   {"user_id": "enc1", "order": "desc"}, {"user_id": "enc1", "min_width": 1}):
+        images = test_client.get("/images", params=params).json()["images"]
+        assert sorted(it["image_id"] for it in images) == sorted(ids), params
+        assert {it["filename"] for it in images} == {"legacy.png", "compact.png"}
+        assert all(it["tags"] == ["mixed"] and it["content_type"] == "image/png" for it in images)
+
+    legacy, compact = (test_client.get(f"/images/{i}").json() for i in ids)
+    assert legacy.keys() == compact.keys()
+
+
+def test_objects_stay_readable_across_key_layouts(test_client, monkeypatch):
+    from app.main import app
+    from app.image_service import keys
+
+    data = make_png_bytes()
+    ids = []
+    for layout in ("legacy", "hashed"):
+        monkeypatch.setattr(keys.settings, "s3_key_layout", layout)
+        files = {"file": (f"{layout}.png", data, "image/png")}
+        ids.append(test_client.post("/images", data={"user_id": "layout1"}, files=files).json()["image_id"])
+
+    legacy, hashed = (test_client.get(f"/images/{i}").json() for i in ids)
+    assert legacy["s3_key"].startswith("layout1/")
+    assert hashed["s3_key"].split("/")[1] == "layout1"
+    for item in (legacy, hashed):
+        assert item["filename"] == item["s3_key"].rsplit("_", 1)[-1]
+        assert test_client.get(f"/images/{item['image_id']}/download").status_code == 200
+        assert app.state.s3.download(item["s3_key"]) == data
+
+
+def test_upload_reencoded_records_both_sizes(test_client, monkeypatch):
+    from app.image_service import reencode
+    monkeypatch.setattr(reencode.settings, "upload_reencode_format", "webp")
+    monkeypatch.setattr(reencode.settings, "upload_reencode_lossless", True)
+
+    buf = io.BytesIO()
+    Image.new("RGB", (120, 80), (250, 250, 250)).save(buf, format="PNG", compress_level=0)
+    data = buf.getvalue()
+    resp = test_client.post("/images", data={"user_id": "re1"}, files={"file": ("shot.png", data, "image/png")})
+    assert resp.status_code == 201
+
+    item = test_client.get(f"/images/{resp.json()['image_id']}").json()
+    assert item["content_type"] == "image/webp"
+    assert item["original_content_type"] == "image/png"
+    assert item["original_size"] == len(data)
+    assert item["size"] < len(data)
+    # the name and key describe the stored bytes
+    assert resp.json()["filename"] == item["filename"] == "shot.webp"
+    assert item["s3_key"].endswith("_shot.webp")
+    stats = test_client.get("/images/users/re1/stats").json()
+    assert stats["total_bytes"] == item["size"]
@@ -0,0 +1,167 @@
+
+from app.image_service.search import SearchIndex, tokenize
+
+
+def item(image_id, title=None, description=None, tags=(), user_id="u"):
+    return {"image_id": image_id, "user_id": user_id, "title": title, "description": description, "tags": list(tags)}
+
+
+# ------------------------------
+# SearchIndex
+# ------------------------------
+
+def test_tokenize():
+    assert tokenize("Sunset at the Beach!") == ["sunset", "at", "the", "beach"]
+    assert tokenize(None) == []
+
+
+def test_search_ranks_title_and_tag_matches_higher():
+    index = SearchIndex()
+    index.add(item("1", title="beach sunset"))
+    index.add(item("2", description="we went to the beach and then home for dinner"))
+    index.add(item("3", title="mountains", tags=["hiking"]))
+
+    results = index.search("beach")
+    assert [r["image_id"] for r in results] == ["1", "2"]
+    assert results[0]["score"] > results[1]["score"]
+
+
+def test_search_user_filter_and_remove():
+    index = SearchIndex()
+    index.add(item("1", title="cat", user_id="a"))
+    index.add(item("2", title="cat", user_id="b"))
+
+    assert [r["image_id"] for r in index.search("cat", user_id="b")] == ["2"]
+    index.remove("2")
+    assert [r["image_id"] for r in index.search("cat")] == ["1"]
+    assert index.search("dog") == []
+
+
+def test_rebuild_keeps_writes_made_during_rebuild():
+    index = SearchIndex()
+
+    def items():
+        yield item("1", title="first")
+        # a write racing with the rebuild
+        index.add(item("2", title="second"))
+        yield item("3", title="third")
+
+    index.rebuild(items())
+    assert {r["image_id"] for r in index.search("first second third")} == {"1", "2", "3"}
+
+
+def test_snapshot_roundtrip(tmp_path):
+    index = SearchIndex()
+    index.add(item("1", title="red car", tags=["vehicle"]))
+    index.add(item("2", title="blue car"))
+    index.save_snapshot(str(tmp_path))
+
+    restored = SearchIndex()
+    assert restored.load_snapshot(str(tmp_path))
+    assert restored.search("car") == index.search("car")
+    assert not SearchIndex().load_snapshot(str(tmp_path / "missing"))
+
+
+def test_concurrent_snapshot_saves_do_not_collide(tmp_path):
+    import threading
+    index = SearchIndex()
+    for i in range(200):
+        index.add(item(str(i), title=f"image number {i}"))
+    threads = [threading.Thread(target=index.save_snapshot, args=(str(tmp_path),)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert [p.name for p in tmp_path.iterdir()] == ["search.json.gz"]
+    restored = SearchIndex()
+    assert restored.load_snapshot(str(tmp_path))
+    assert len(restored.search("number", limit=500)) == 200
+
+
+def test_unusable_snapshots_are_ignored(tmp_path):
+    import gzip
+    index = SearchIndex()
+    path = index.snapshot_path(str(tmp_path))
+
+    with gzip.open(path, "wt") as f:
+        f.write('{"version": 0, "docs": []}')
+    assert not index.load_snapshot(str(tmp_path))
+
+    with open(path, "wb") as f:
+        f.write(b"not gzip")
+    assert not index.load_snapshot(str(tmp_path))
+
+
+# ------------------------------
+# /images/search
+# ------------------------------
+
+def test_search_endpoint_tracks_uploads_and_deletes(test_client, make_png_bytes):
+    files = {"file": ("s.png", make_png_bytes(), "image/png")}
+    upload = test_client.post(
+        "/images",
+        data={"user_id": "searcher", "title": "Holiday at the lake", "tags": "summer,lake"},
+        files=files,
+    )
+    img_id = upload.json()["image_id"]
+
+    resp = test_client.get("/images/search", params={"q": "lake"})
+    assert resp.status_code == 200
+    results = resp.json()["results"]
+    assert results[0]["image_id"] == img_id
+    assert results[0]["tags"] == ["summer", "lake"]
+
+    test_client.delete(f"/images/{img_id}")
+    assert test_client.get("/images/search", params={"q": "lake"}).json()["results"] == []
+
+
+def test_compact_uploads_are_indexed_as_stored(test_client, make_png_bytes, monkeypatch):
+    from app.image_service import encoding
+    monkeypatch.setattr(encoding.settings, "metadata_encoding", "compact")
+    files = {"file": ("s.png", make_png_bytes(), "image/png")}
+    upload = test_client.post("/images", data={"user_id": "compact", "tags": "sea,beach,sea"}, files=files)
+    img_id = upload.json()["image_id"]
+
+    stored = test_client.get(f"/images/{img_id}").json()["tags"]
+    assert stored == ["beach", "sea"]
+    assert test_client.get("/images/search", params={"q": "sea"}).json()["results"][0]["tags"] == stored
+
+
+def test_rebuild_from_table(test_client):
+    from app.main import app
+    from app.image_service.search import search_index
+    from app.image_service.service import rebuild_indexes
+
+    # written behind the index's back, e.g. by another worker
+    app.state.db.put_metadata({
+        "image_id": "external", "user_id": "x", "title": "Penguin colony", "tags": [],
+        "s3_key": "x/1_p.png", "filename": "p.png", "content_type": "image/png", "size": 1,
+        "uploaded_at": "2024-01-01T00:00:00+00:00",
+    })
+    assert search_index.search("penguin") == []
+
+    rebuild_indexes(app.state.db)
+    assert [r["image_id"] for r in search_index.search("penguin")] == ["external"]
+
+
+def test_warm_up_rebuilds_indexes_with_bad_snapshots(test_client, monkeypatch, tmp_path):
+    from app.main import app
+    from app.image_service import service
+    from app.image_service.search import search_index
+    from app.image_service.similarity import similarity_index
+
+    app.state.db.put_metadata({
+        "image_id": "warm", "user_id": "x", "title": "Walrus beach", "tags": [], "phash": "00000000000000ff",
+        "s3_key": "x/1_w.png", "filename": "w.png", "content_type": "image/png", "size": 1,
+        "uploaded_at": "2024-01-01T00:00:00+00:00",
+    })
+    similarity_index.save_snapshot(str(tmp_path))  # a good snapshot, taken before the item was indexed
+    with open(search_index.snapshot_path(str(tmp_path)), "wb") as f:
+        f.write(b"corrupt")
+    monkeypatch.setattr(service.settings, "index_snapshot_dir", str(tmp_path))
+
+    service.warm_indexes(app.state.db)
+    assert [r["image_id"] for r in search_index.search("walrus")] == ["warm"]
+    # the other indexes still start from their snapshots
+    assert similarity_index.search("00000000000000ff", max_distance=0) == []
@@ -0,0 +1,160 @@
+import io
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+from app.image_service.similarity import SearchTooBroad, SimilarityIndex, dhash, hamming
+from app.routers.image_service import inspect_image_bytes
+
+
+def make_picture(seed, size=(200, 150)):
+    """A few random shapes, so different seeds give visually different pictures."""
+    rng = random.Random(seed)
+    img = Image.new("RGB", size, color=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(8):
+        x0, y0 = rng.randrange(size[0]), rng.randrange(size[1])
+        x1, y1 = x0 + rng.randrange(20, 100), y0 + rng.randrange(20, 100)
+        draw.ellipse([x0, y0, x1, y1], fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    return img
+
+
+def encode(img, fmt, **kwargs):
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, **kwargs)
+    return buf.getvalue()
+
+
+# ------------------------------
+# dhash
+# ------------------------------
+
+def test_dhash_is_stable_under_resize_and_reencode():
+    original = make_picture(1)
+    copy = original.resize((120, 90))
+    a = int(dhash(original), 16)
+    b = int(dhash(Image.open(io.BytesIO(encode(copy, "JPEG", quality=60)))), 16)
+    other = int(dhash(make_picture(2)), 16)
+
+    assert hamming(a, b) <= 6
+    assert hamming(a, other) > 12
+
+
+def test_inspect_image_bytes_computes_phash():
+    info = inspect_image_bytes(encode(make_picture(3), "PNG"), "image/png")
+    assert info.content_type == "image/png"
+    assert len(info.phash) == 16
+    svg = inspect_image_bytes(b'<svg xmlns="http://www.w3.org/2000/svg"></svg>', "image/svg+xml")
+    assert svg.phash is None
+
+
+# ------------------------------
+# SimilarityIndex
+# ------------------------------
+
+def test_bk_tree_matches_linear_scan():
+    rng = random.Random(0)
+    index = SimilarityIndex()
+    hashes = {}
+    for i in range(2000):
+        value = rng.getrandbits(64)
+        hashes[str(i)] = value
+        index.add({"image_id": str(i), "phash": f"{value:016x}"})
+
+    target = hashes["42"] ^ 0b1011  # 3 bits away from image 42
+    expected = sorted(
+        ((i, hamming(v, target)) for i, v in hashes.items() if hamming(v, target) <= 12),
+        key=lambda m: (m[1], m[0]),
+    )
+    assert index.search(f"{target:016x}", max_distance=12, limit=10_000) == expected
+    assert expected[0] == ("42", 3)
+
+
+def test_remove_and_duplicate_hashes(tmp_path):
+    index = SimilarityIndex()
+    index.add({"image_id": "a", "phash": "00000000000000ff"})
+    index.add({"image_id": "b", "phash": "00000000000000ff"})
+    index.add({"image_id": "c", "phash": "00000000000000fe"})
+    index.add({"image_id": "no-hash", "phash": None})
+
+    assert index.search("00000000000000ff", max_distance=1) == [("a", 0), ("b", 0), ("c", 1)]
+    index.remove("a")
+    assert index.search("00000000000000ff", max_distance=0) == [("b", 0)]
+
+    index.save_snapshot(str(tmp_path))
+    restored = SimilarityIndex()
+    restored.load_snapshot(str(tmp_path))
+    assert restored.search("00000000000000ff", max_distance=1) == [("b", 0), ("c", 1)]
+
+
+def test_search_does_not_block_writers(monkeypatch):
+    import threading
+    from app.image_service import similarity
+    index = SimilarityIndex()
+    for i in range(100):
+        index.add({"image_id": str(i), "phash": f"{i * 0x9E3779B97F4A7C15 % 2 ** 64:016x}"})
+
+    writers = []
+
+    def hamming_with_concurrent_write(a, b):
+        if not writers:
+            writer = threading.Thread(target=index.add, args=({"image_id": "new", "phash": "00000000000000ff"},))
+            writers.append(writer)
+            writer.start()
+            writer.join(timeout=2)
+        return hamming(a, b)
+
+    monkeypatch.setattr(similarity, "hamming", hamming_with_concurrent_write)
+    index.search("0000000000000000", max_distance=64, limit=1000)
+    assert not writers[0].is_alive()
+    assert ("new", 8) in index.search("0000000000000000", max_distance=8, limit=1000)
+
+
+def test_search_visit_limit():
+    rng = random.Random(1)
+    index = SimilarityIndex()
+    for i in range(500):
+        index.add({"image_id": str(i), "phash": f"{rng.getrandbits(64):016x}"})
+    with pytest.raises(SearchTooBroad):
+        index.search("0000000000000000", max_distance=32, max_visits=100)
+    assert len(index.search("0000000000000000", max_distance=64, limit=1000, max_visits=500)) == 500
+
+
+# ------------------------------
+# /images/{id}/similar
+# ------------------------------
+
+def test_similar_endpoint_finds_reencoded_copy(test_client):
+    original = make_picture(10)
+    uploads = {
+        "original": ("o.png", encode(original, "PNG"), "image/png"),
+        "copy": ("c.jpg", encode(original.resize((100, 75)), "JPEG", quality=50), "image/jpeg"),
+        "other": ("x.png", encode(make_picture(11), "PNG"), "image/png"),
+    }
+    ids = {
+        name: test_client.post("/images", data={"user_id": "dupes"}, files={"file": f}).json()["image_id"]
+        for name, f in uploads.items()
+    }
+
+    resp = test_client.get(f"/images/{ids['original']}/similar", params={"max_distance": 8})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert [r["image_id"] for r in body["results"]] == [ids["copy"]]
+    assert test_client.get(f"/images/{ids['original']}").json()["phash"] == body["phash"]
+    assert test_client.get(f"/images/{ids['original']}/similar", params={"max_distance": 20}).status_code == 422
+
+
+def test_similar_endpoint_rejects_searches_over_the_visit_limit(test_client, monkeypatch):
+    from app.image_service import similarity
+    from app.routers import image_service as router
+    upload = {"file": ("o.png", encode(make_picture(12), "PNG"), "image/png")}
+    image_id = test_client.post("/images", data={"user_id": "broad"}, files=upload).json()["image_id"]
+    monkeypatch.setattr(router.settings, "similarity_max_visited_nodes", 1)
+    monkeypatch.setattr(similarity.similarity_index, "_state", similarity.similarity_index._new_state())
+    target = int(test_client.get(f"/images/{image_id}").json()["phash"], 16)
+    for i in range(50):
+        similarity.similarity_index.add({"image_id": f"n{i}", "phash": f"{target ^ i:016x}"})
+
+    resp = test_client.get(f"/images/{image_id}/similar", params={"max_distance": 12})
+    assert resp.status_code == 400
@@ -0,0 +1,119 @@
+import random
+
+from app.image_service import tags as tags_module
+from app.image_service.tags import TagIndex
+
+
+def item(image_id, tags=(), user_id="u"):
+    return {"image_id": image_id, "user_id": user_id, "tags": list(tags)}
+
+
+# ------------------------------
+# TagIndex
+# ------------------------------
+
+def test_autocomplete_ranks_by_usage():
+    index = TagIndex()
+    index.add(item("1", ["beach", "sunset"]))
+    index.add(item("2", ["beach", "Berlin"]))
+    index.add(item("3", ["bench", "beach"]))
+    index.add(item("4", ["Berlin"]))
+
+    assert index.autocomplete("be") == [
+        {"tag": "beach", "count": 3}, {"tag": "Berlin", "count": 2}, {"tag": "bench", "count": 1},
+    ]
+    assert index.autocomplete("BER") == [{"tag": "Berlin", "count": 2}]
+    assert index.autocomplete("be", limit=1) == [{"tag": "beach", "count": 3}]
+    assert index.autocomplete("x") == []
+
+
+def test_autocomplete_per_user_and_removals():
+    index = TagIndex()
+    index.add(item("1", ["cat", "cat", "car"], user_id="a"))
+    index.add(item("2", ["cat"], user_id="b"))
+
+    assert index.autocomplete("ca", user_id="a") == [{"tag": "car", "count": 1}, {"tag": "cat", "count": 1}]
+    assert index.autocomplete("ca", user_id="nobody") == []
+
+    index.remove("1")
+    assert index.autocomplete("ca") == [{"tag": "cat", "count": 1}]
+    assert index.autocomplete("ca", user_id="a") == []
+    # Re-adding an image replaces its previous tags
+    index.add(item("2", ["cow"], user_id="b"))
+    assert index.autocomplete("c") == [{"tag": "cow", "count": 1}]
+    assert len(index) == 1
+
+
+def test_cached_dense_prefixes_stay_exact(monkeypatch):
+    monkeypatch.setattr(tags_module, "TOP_K", 3)
+    monkeypatch.setattr(tags_module, "DENSE_PREFIX_MATCHES", 2)
+    rng = random.Random(7)
+    vocabulary = ["ab", "abc", "abd", "ac", "acd", "b", "ba", "bac", "bad"]
+    index = TagIndex()
+
+    def expected(prefix, limit):
+        counts = {}
+        for _, tags in index._state.docs.values():
+            for tag in tags:
+                counts[tag] = counts.get(tag, 0) + 1
+        ranked = sorted(((t, c) for t, c in counts.items() if t.startswith(prefix)), key=lambda tc: (-tc[1], tc[0]))
+        return [{"tag": t, "count": c} for t, c in ranked[:limit]]
+
+    for step in range(300):
+        image_id = str(rng.randrange(40))
+        if rng.random() < 0.3:
+            index.remove(image_id)
+        else:
+            index.add(item(image_id, rng.sample(vocabulary, 2)))
+        for prefix in ("", "a", "ab", "b", "ba"):
+            assert index.autocomplete(prefix, limit=3) == expected(prefix, 3), (step, prefix)
+
+
+def test_snapshot_roundtrip(tmp_path):
+    index = TagIndex()
+    index.add(item("1", ["snow", "ski"], user_id="a"))
+    index.add(item("2", ["snow"], user_id="b"))
+    index.save_snapshot(str(tmp_path))
+
+    restored = TagIndex()
+    assert restored.load_snapshot(str(tmp_path))
+    assert restored.autocomplete("s") == index.autocomplete("s")
+    assert restored.autocomplete("s", user_id="b") == [{"tag": "snow", "count": 1}]
+
+
+# ------------------------------
+# /images/tags/autocomplete
+# ------------------------------
+
+def test_autocomplete_endpoint_tracks_uploads_and_deletes(test_client, make_png_bytes):
+    files = {"file": ("t.png", make_png_bytes(), "image/png")}
+    upload = test_client.post("/images", data={"user_id": "tagger", "tags": "Zebra,zoo"}, files=files)
+    img_id = upload.json()["image_id"]
+
+    resp = test_client.get("/images/tags/autocomplete", params={"prefix": "z", "user_id": "tagger"})
+    assert resp.status_code == 200
+    assert resp.json() == {
+        "prefix": "z",
+        "suggestions": [{"tag": "Zebra", "count": 1}, {"tag": "zoo", "count": 1}],
+    }
+
+    test_client.delete(f"/images/{img_id}")
+    resp = test_client.get("/images/tags/autocomplete", params={"prefix": "z", "user_id": "tagger"})
+    assert resp.json()["suggestions"] == []
+    assert test_client.get("/images/tags/autocomplete", params={"prefix": ""}).status_code == 422
+
+
+def test_autocomplete_rebuilds_from_table(test_client):
+    from app.main import app
+    from app.image_service.tags import tag_index
+    from app.image_service.service import rebuild_indexes
+
+    app.state.db.put_metadata({
+        "image_id": "external-tags", "user_id": "x", "title": None, "tags": ["quokka"],
+        "s3_key": "x/1_q.png", "filename": "q.png", "content_type": "image/png", "size": 1,
+        "uploaded_at": "2024-01-01T00:00:00+00:00",
+    })
+    assert tag_index.autocomplete("quo") == []
+
+    rebuild_indexes(app.state.db)
+    assert tag_index.autocomplete("quo") == [{"tag": "quokka", "count": 1}]